@@ -0,0 +1,291 @@
+"""Micro-benchmarks for the thunderstorm messaging and pagination hot paths
+
+Runs offline: Kafka is replaced by a stub producer, the ts_event agent is
+fed from an in-memory stream and Celery's send_task is stubbed out.
+
+Usage:
+    python benchmarks/run.py                    # run and compare to baseline
+    python benchmarks/run.py --save-baseline    # store results as new baseline
+    python benchmarks/run.py --case validate_data --case json_formatter
+
+For every case the throughput (msgs/s), p50/p99 latency (microseconds) and
+the peak memory allocated while running it (KiB, via tracemalloc) are
+reported. These absolute numbers are machine dependent and informational
+only. Each throughput is also divided by the throughput of a reference
+workload, stdlib JSON encoding and decoding, measured in the same run. The
+baseline stores these relative throughputs only, and a case regresses when
+its relative throughput falls below the baseline by more than the
+tolerance, in which case the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from celery import Celery  # noqa: E402
+from marshmallow import Schema, fields  # noqa: E402
+
+from thunderstorm.flask.request_utils import get_pagination_info  # noqa: E402
+from thunderstorm.kafka_messaging import Event, TSKafka  # noqa: E402
+from thunderstorm.logging import JSONFormatter  # noqa: E402
+from thunderstorm.messaging import send_ts_task  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# number of items in the list payloads, small is a typical single entity
+# message and large a typical batch message
+PAYLOAD_SIZES = {'small': 1, 'large': 500}
+
+CASES = {}
+
+
+def case(name):
+    """Register a benchmark case
+
+    The decorated function takes the payload size and returns a callable
+    running one operation, or a coroutine function running ``n`` operations
+    and returning their latencies in seconds.
+    """
+    def decorator(func):
+        CASES[name] = func
+        return func
+    return decorator
+
+
+class ItemSchema(Schema):
+    uuid = fields.UUID(required=True)
+    name = fields.String(required=True)
+    count = fields.Integer()
+    active = fields.Boolean()
+    created_at = fields.DateTime()
+
+
+class PayloadSchema(Schema):
+    event_id = fields.UUID(required=True)
+    items = fields.List(fields.Nested(ItemSchema))
+
+
+def make_payload(size):
+    return {
+        'event_id': '4f5a0b2e-8a43-4c8e-9f3a-3ef0b1f2a0c1',
+        'items': [
+            {
+                'uuid': 'c3a1e9d2-2b7f-4c55-8f0e-{:012d}'.format(i),
+                'name': 'item-{}'.format(i),
+                'count': i,
+                'active': bool(i % 2),
+                'created_at': '2019-10-01T12:00:00+00:00',
+            }
+            for i in range(size)
+        ]
+    }
+
+
+class StubProducer(object):
+    """KafkaProducer replacement which drops every message"""
+
+    def send(self, topic, value=None, key=None):
+        return None
+
+
+def kafka_app():
+    app = TSKafka('bench-service', broker='localhost:9092')
+    app.kafka_producer = StubProducer()
+    return app
+
+
+@case('validate_data')
+def bench_validate_data(size):
+    app = kafka_app()
+    event = Event('bench.event', PayloadSchema)
+    data = PayloadSchema().load(make_payload(size))
+    return lambda: app.validate_data(data, event)
+
+
+@case('compress')
+def bench_compress(size):
+    data = PayloadSchema().load(make_payload(size))
+    return lambda: TSKafka._compress(data, PayloadSchema)
+
+
+@case('send_ts_event')
+def bench_send_ts_event(size):
+    app = kafka_app()
+    event = Event('bench.event', PayloadSchema)
+    data = PayloadSchema().load(make_payload(size))
+    return lambda: app.send_ts_event(data, event)
+
+
+@case('ts_event')
+def bench_ts_event(size):
+    app = kafka_app()
+    payload = make_payload(size)
+
+    @app.ts_event(Event('bench.event', PayloadSchema))
+    async def handler(message):
+        return message
+
+    async def run(n):
+        async def stream():
+            for _ in range(n):
+                yield {'data': payload}
+
+        latencies = []
+        start = time.perf_counter()
+        async for _ in handler.fun(stream()):
+            end = time.perf_counter()
+            latencies.append(end - start)
+            start = end
+        return latencies
+
+    return run
+
+
+@case('send_ts_task')
+def bench_send_ts_task(size):
+    app = Celery('bench', set_as_current=True)
+    app.send_task = lambda *args, **kwargs: None
+    schema = PayloadSchema()
+    data = schema.load(make_payload(size))
+    return lambda: send_ts_task('bench.event', schema, data)
+
+
+@case('json_formatter')
+def bench_json_formatter(size):
+    formatter = JSONFormatter('%(levelname)s %(message)s', ts_log_type='bench', ts_service='bench')
+    record = logging.LogRecord(
+        'bench', logging.INFO, __file__, 1, 'received ts_event on %s', ('bench.event',), None
+    )
+    record.traceId = 'c3a1e9d22b7f4c558f0e000000000000'
+    record.data = make_payload(size)
+    return lambda: formatter.format(record)
+
+
+@case('pagination_info')
+def bench_pagination_info(size):
+    # the size is the number of filters in the query string
+    filters = '&'.join('filter_{}=value-{}'.format(i, i) for i in range(size))
+    url_path = '/api/v1/devices?{}&page_size=50&page=3'.format(filters)
+    return lambda: get_pagination_info(3, 50, 10000, url_path)
+
+
+def _percentile(sorted_values, percentile):
+    index = int(round(percentile / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _run_op(op, iterations):
+    if asyncio.iscoroutinefunction(op):
+        return asyncio.get_event_loop().run_until_complete(op(iterations))
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        op()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_case(name, size, iterations):
+    op = CASES[name](PAYLOAD_SIZES[size])
+    # warm up caches and lazily created objects
+    _run_op(op, max(1, iterations // 10))
+
+    latencies = sorted(_run_op(op, iterations))
+
+    tracemalloc.start()
+    _run_op(op, max(1, iterations // 10))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'msgs_per_sec': round(len(latencies) / sum(latencies), 1),
+        'p50_us': round(_percentile(latencies, 50) * 1e6, 1),
+        'p99_us': round(_percentile(latencies, 99) * 1e6, 1),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def reference_throughput(iterations, rounds=5):
+    """Return the operations per second of the reference workload on this machine
+
+    The best of a few rounds is taken, so a noisy round does not skew every
+    relative throughput of the run.
+    """
+    payload = make_payload(PAYLOAD_SIZES['small'])
+    op = lambda: json.loads(json.dumps(payload))  # noqa: E731
+    _run_op(op, max(1, iterations // 10))
+    return max(len(latencies) / sum(latencies) for latencies in (_run_op(op, iterations) for _ in range(rounds)))
+
+
+def compare(results, baseline, tolerance):
+    """Return the names of results with a relative throughput regression"""
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key, {}).get('relative')
+        if expected and result['relative'] < expected * (1 - tolerance):
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--case', action='append', choices=sorted(CASES), help='case to run, defaults to all')
+    parser.add_argument('--size', action='append', choices=sorted(PAYLOAD_SIZES), help='payload size, defaults to all')
+    parser.add_argument('--iterations', type=int, default=2000, help='operations per case for small payloads')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed throughput drop, 0.2 is 20%%')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file to compare to')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    args = parser.parse_args(argv)
+
+    # benchmarks must not be slowed down by log output
+    logging.disable(logging.CRITICAL)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    reference = reference_throughput(args.iterations)
+    results = {}
+    row = '{:<28} {:>12} {:>10} {:>10} {:>10} {:>10} {:>9}'
+    print(row.format('case', 'msgs/s', 'p50 us', 'p99 us', 'peak KiB', 'relative', 'vs base'))
+    for name in args.case or sorted(CASES):
+        for size in args.size or sorted(PAYLOAD_SIZES):
+            key = '{}[{}]'.format(name, size)
+            iterations = max(10, args.iterations // PAYLOAD_SIZES[size])
+            result = results[key] = run_case(name, size, iterations)
+            result['relative'] = float('{:.4g}'.format(result['msgs_per_sec'] / reference))
+
+            diff = ''
+            expected = baseline.get(key, {}).get('relative')
+            if expected:
+                diff = '{:+.1%}'.format(result['relative'] / expected - 1)
+            print(row.format(
+                key, result['msgs_per_sec'], result['p50_us'], result['p99_us'], result['peak_kib'],
+                result['relative'], diff
+            ))
+
+    if args.save_baseline:
+        baseline.update({key: {'relative': result['relative']} for key, result in results.items()})
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print('baseline saved to {}'.format(args.baseline))
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('throughput regressions: {}'.format(', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
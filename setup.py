@@ -9,7 +9,11 @@ def _read_requirements(requirements_filename):
 
 
 REQUIREMENTS = _read_requirements('requirements.txt')
-EXTRA_REQS = {'kafka': ['faust[statsd]<2,>=1.6', 'kafka-python<2,>=1']}
+EXTRA_REQS = {
+    'kafka': ['faust[statsd]<2,>=1.6', 'kafka-python<2,>=1'],
+    'batches': ['celery-batches<0.4,>=0.2'],
+    'numpy': ['numpy>=1.16,<2'],
+}
 
 setup(
     name=thunderstorm.__title__,
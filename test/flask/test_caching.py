@@ -0,0 +1,128 @@
+import flask
+import pytest
+
+from thunderstorm.flask.caching import conditional, ResponseCache
+
+
+@pytest.fixture
+def versioned_app():
+    app = flask.Flask('test_app')
+    app.calls = 0
+    app.version = 1
+    app.response_cache = ResponseCache()
+
+    @app.route('/foo', methods=['GET', 'POST'])
+    @conditional(lambda: app.version, cache=app.response_cache)
+    def foo():
+        app.calls += 1
+        return flask.jsonify({'calls': app.calls, 'page_size': flask.request.args.get('page_size')})
+
+    return app
+
+
+def test_conditional_serves_cached_body(versioned_app):
+    # arrange
+    client = versioned_app.test_client()
+
+    # act
+    first = client.get('/foo')
+    second = client.get('/foo')
+
+    # assert
+    assert versioned_app.calls == 1
+    assert second.get_json() == first.get_json() == {'calls': 1, 'page_size': None}
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert second.mimetype == 'application/json'
+    assert versioned_app.response_cache.info().hits == 1
+
+
+def test_conditional_returns_304_when_etag_matches(versioned_app):
+    # arrange
+    client = versioned_app.test_client()
+    etag = client.get('/foo').headers['ETag']
+
+    # act
+    resp = client.get('/foo', headers={'If-None-Match': etag})
+
+    # assert
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == etag
+    assert not resp.data
+    assert versioned_app.calls == 1
+
+
+def test_conditional_returns_304_when_weak_etag_matches(versioned_app):
+    # arrange
+    client = versioned_app.test_client()
+    etag = client.get('/foo').headers['ETag']
+
+    # act
+    resp = client.get('/foo', headers={'If-None-Match': 'W/' + etag})
+
+    # assert
+    assert resp.status_code == 304
+    assert versioned_app.calls == 1
+
+
+def test_conditional_calls_route_when_version_changes(versioned_app):
+    # arrange
+    client = versioned_app.test_client()
+    etag = client.get('/foo').headers['ETag']
+    versioned_app.version = 2
+
+    # act
+    resp = client.get('/foo', headers={'If-None-Match': etag})
+
+    # assert
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert resp.get_json()['calls'] == 2
+
+
+@pytest.mark.parametrize('other_request', [
+    {'path': '/foo?page_size=5'},
+    {'path': '/foo', 'headers': {'TS-Rewritten': 'type=static; source=/bar; target=/foo'}},
+])
+def test_conditional_etag_depends_on_url_and_rewriting(other_request, versioned_app):
+    # arrange
+    client = versioned_app.test_client()
+    etag = client.get('/foo').headers['ETag']
+
+    # act
+    resp = client.get(other_request['path'], headers=other_request.get('headers'))
+
+    # assert
+    assert resp.headers['ETag'] != etag
+    assert versioned_app.calls == 2
+
+
+def test_conditional_ignores_other_methods(versioned_app):
+    # arrange
+    client = versioned_app.test_client()
+
+    # act
+    client.post('/foo')
+    resp = client.post('/foo')
+
+    # assert
+    assert 'ETag' not in resp.headers
+    assert versioned_app.calls == 2
+
+
+def test_ResponseCache_evicts_least_recently_used_past_max_bytes():
+    # arrange
+    cache = ResponseCache(max_bytes=10)
+    cache.set('a', b'1234', 200, [])
+    cache.set('b', b'1234', 200, [])
+    cache.get('a')
+
+    # act
+    cache.set('c', b'1234', 200, [])
+    cache.set('d', b'12345678901', 200, [])
+
+    # assert
+    assert cache.get('b') is None
+    assert cache.get('d') is None
+    assert cache.get('a') == (b'1234', 200, [])
+    assert cache.info().currbytes == 8
+    assert cache.info().evictions == 1
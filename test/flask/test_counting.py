@@ -0,0 +1,155 @@
+from unittest.mock import MagicMock
+
+import pytest
+from marshmallow import fields, Schema
+
+from test.models import Random
+from thunderstorm.flask.counting import CachedCount, EstimatedCount, ExactCount, SkipCount, WindowCount
+from thunderstorm.flask.request_utils import make_paginated_response
+from thunderstorm.flask.schemas import PaginationSchema
+
+
+class RandomSchema(Schema):
+    uuid = fields.UUID()
+    name = fields.String()
+
+
+@pytest.fixture
+def m_query():
+    m_query = MagicMock()
+    m_query.limit.return_value = m_query
+    m_query.count.return_value = 50
+    m_query.statement.compile.return_value.params = {'name_1': 'foo'}
+    return m_query
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ExactCount_counts_with_ceiling(m_query):
+    # act
+    count = ExactCount()(m_query, ceiling=20)
+
+    # assert
+    assert count == 50
+    m_query.limit.assert_called_once_with(20)
+
+
+def test_SkipCount_returns_None(m_query):
+    # act/assert
+    assert SkipCount()(m_query) is None
+    m_query.count.assert_not_called()
+
+
+def test_CachedCount_counts_once_per_ttl(m_query):
+    # arrange
+    clock = FakeClock()
+    cached_count = CachedCount(ttl=10, clock=clock)
+
+    # act
+    counts = [cached_count(m_query), cached_count(m_query)]
+    clock.now = 11
+    counts.append(cached_count(m_query))
+
+    # assert
+    assert counts == [50, 50, 50]
+    assert m_query.count.call_count == 2
+    assert (cached_count.hits, cached_count.misses) == (1, 2)
+
+
+def test_CachedCount_keys_by_params_and_ceiling(m_query):
+    # arrange
+    cached_count = CachedCount()
+
+    # act
+    cached_count(m_query)
+    cached_count(m_query, ceiling=100)
+    m_query.statement.compile.return_value.params = {'name_1': 'bar'}
+    cached_count(m_query)
+
+    # assert
+    assert m_query.count.call_count == 3
+    assert len(cached_count) == 3
+
+
+def test_CachedCount_evicts_least_recently_used(m_query):
+    # arrange
+    cached_count = CachedCount(maxsize=2)
+
+    # act
+    for ceiling in (1, 2, 1, 3):
+        cached_count(m_query, ceiling=ceiling)
+
+    # assert
+    assert len(cached_count) == 2
+    assert [key[2] for key in cached_count._counts] == [1, 3]
+
+
+def test_EstimatedCount_falls_back_on_other_databases(m_query):
+    # arrange
+    m_query.session.get_bind.return_value.dialect.name = 'sqlite'
+
+    # act/assert
+    assert EstimatedCount()(m_query) == 50
+
+
+def test_EstimatedCount_falls_back_under_exact_below(db_session, fixtures):
+    # arrange
+    [fixtures.Random() for _ in range(10)]  # noqa
+
+    # act/assert
+    assert EstimatedCount(exact_below=1000)(db_session.query(Random)) == 10
+
+
+def test_EstimatedCount_uses_planner_estimate(db_session, fixtures):
+    # arrange
+    [fixtures.Random() for _ in range(10)]  # noqa
+    estimated_count = EstimatedCount(exact_below=0)
+
+    # act
+    estimate = estimated_count.estimate(db_session.query(Random))
+
+    # assert
+    assert estimated_count(db_session.query(Random), ceiling=5) == min(estimate, 5)
+
+
+@pytest.mark.parametrize('start, ceiling, num_rows, num_records', [
+    (0, None, 20, 45),
+    (40, None, 5, 45),
+    (0, 30, 20, 30),
+    (60, None, 0, 45),
+])
+def test_WindowCount_returns_page_and_total(start, ceiling, num_rows, num_records, db_session, fixtures):
+    # arrange
+    [fixtures.Random() for _ in range(45)]  # noqa
+    query = db_session.query(Random).order_by(Random.uuid)
+
+    # act
+    rows, total = WindowCount().page(query, start, 20, ceiling)
+
+    # assert
+    assert rows == query.offset(start).limit(20).all()
+    assert len(rows) == num_rows
+    assert total == num_records
+
+
+def test_WindowCount_keeps_columns_of_multi_column_queries(db_session, fixtures, flask_app):
+    # arrange
+    class RandomListSchema(PaginationSchema):
+        data = fields.List(fields.Nested(RandomSchema))
+
+    [fixtures.Random() for _ in range(5)]  # noqa
+    query = db_session.query(Random.uuid, Random.name).order_by(Random.uuid)
+
+    # act
+    with flask_app.test_request_context():
+        resp = make_paginated_response(query, '/foo', RandomListSchema, 1, 3, count_strategy=WindowCount())
+
+    # assert
+    assert resp['data'] == [{'uuid': str(row.uuid), 'name': row.name} for row in query.limit(3).all()]
+    assert resp['total_records'] == 5
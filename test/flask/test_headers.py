@@ -1,8 +1,13 @@
+import datetime
 from unittest.mock import patch
 
+import flask
 import pytest
 
-from thunderstorm.flask.headers import rewrite_path_with_header
+from thunderstorm.flask.headers import (
+    deprecated, deprecated_route_info, rewrite_links, rewrite_path_with_header, rewriter_for_header
+)
+from thunderstorm.flask.schemas import PaginationSchema
 
 
 @patch('thunderstorm.flask.headers.logger')
@@ -40,6 +45,112 @@ def test_deprecated_no_deadline(mock_logger, flask_app):
     )
 
 
+@patch('thunderstorm.flask.headers.statsd')
+@patch('thunderstorm.flask.headers.logger')
+def test_deprecated_rate_limits_logs(mock_logger, mock_statsd):
+    # arrange
+    app = flask.Flask('test_app')
+
+    @app.route('/limited')
+    @deprecated(deadline='2050-05-05', log_interval=3600)
+    def limited():
+        return 'ok'
+
+    client = app.test_client()
+
+    # act
+    responses = [client.get('/limited') for _ in range(5)]
+
+    # assert
+    assert all(resp.headers['Warning'] == responses[0].headers['Warning'] for resp in responses)
+    assert mock_logger.warning.call_count == 1
+    mock_statsd.incr.assert_called_once_with('deprecated_route.limited.calls', 1)
+    info = deprecated_route_info()['{}.{}'.format(limited.__module__, limited.__qualname__)]
+    assert (info.calls, info.logged, info.expired) == (5, 1, False)
+
+
+@patch('thunderstorm.flask.headers.statsd')
+@patch('thunderstorm.flask.headers.logger')
+def test_deprecated_counts_same_named_routes_of_blueprints_apart(mock_logger, mock_statsd):
+    # arrange
+    app = flask.Flask('test_app')
+    for version in ('v1', 'v2'):
+        blueprint = flask.Blueprint(version, __name__)
+
+        @blueprint.route('/devices')
+        @deprecated(log_interval=0)
+        def devices():
+            return 'ok'
+
+        app.register_blueprint(blueprint, url_prefix='/' + version)
+
+    client = app.test_client()
+
+    # act
+    client.get('/v1/devices')
+    client.get('/v2/devices')
+
+    # assert
+    assert [c[0] for c in mock_statsd.incr.call_args_list] == [
+        ('deprecated_route.v1.devices.calls', 1),
+        ('deprecated_route.v2.devices.calls', 1),
+    ]
+
+
+@patch('thunderstorm.flask.headers.statsd')
+@patch('thunderstorm.flask.headers.logger')
+def test_deprecated_logs_calls_since_last_log(mock_logger, mock_statsd):
+    # arrange
+    app = flask.Flask('test_app')
+
+    @app.route('/limited')
+    @deprecated(log_interval=3600)
+    def limited():
+        return 'ok'
+
+    client = app.test_client()
+
+    # act
+    with patch('thunderstorm.flask.headers.time.monotonic', return_value=0.0):
+        client.get('/limited')
+        client.get('/limited')
+        client.get('/limited')
+    with patch('thunderstorm.flask.headers.time.monotonic', return_value=3600.0):
+        client.get('/limited')
+
+    # assert
+    assert mock_logger.warning.call_args_list[1][0][0] == (
+        'Call to deprecated route: /limited (3 calls since the last log)'
+    )
+    assert mock_statsd.incr.call_args_list[1][0] == ('deprecated_route.limited.calls', 3)
+
+
+@patch('thunderstorm.flask.headers.statsd')
+@patch('thunderstorm.flask.headers.logger')
+def test_deprecated_switches_to_error_after_deadline(mock_logger, mock_statsd):
+    # arrange
+    app = flask.Flask('test_app')
+    deadline = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+
+    @app.route('/expiring')
+    @deprecated(deadline=deadline, log_interval=0)
+    def expiring():
+        return 'ok'
+
+    client = app.test_client()
+    client.get('/expiring')
+
+    # act
+    later = (deadline + datetime.timedelta(days=1)).replace(tzinfo=datetime.timezone.utc).timestamp()
+    with patch('thunderstorm.flask.headers.time.time', return_value=later):
+        client.get('/expiring')
+        client.get('/expiring')
+
+    # assert
+    assert mock_logger.warning.call_count == 1
+    assert mock_logger.error.call_count == 2
+
+
 @pytest.mark.parametrize('path,header,new_path', [
     (  # chops common suffix
         '/api/v3/device/dc9c0e76-3d99-11e8-8752-33401e43ad3b?page=1&dude=true',
@@ -94,3 +205,69 @@ def test_deprecated_no_deadline(mock_logger, flask_app):
 ])
 def test_rewrite_path_with_header(path, header, new_path):
     assert rewrite_path_with_header(path, header) == new_path
+
+
+def test_rewriter_for_header_is_cached():
+    # arrange
+    header = 'type=prefix; source=/api/v1/screen; target=/api/v3/screen'
+    rewriter_for_header.cache_clear()
+
+    # act
+    rewriters = [rewriter_for_header(header) for _ in range(3)]
+
+    # assert
+    assert rewriters[0] is rewriters[1] is rewriters[2]
+    assert rewriter_for_header.cache_info().misses == 1
+    assert rewriters[0]('/api/v3/device?page=2') == '/api/v1/device?page=2'
+
+
+@patch('thunderstorm.flask.headers.logger')
+def test_rewriter_for_invalid_header_warns_on_every_call(mock_logger):
+    # arrange
+    rewrite = rewriter_for_header('type=invalid')
+
+    # act
+    rewrite('/foo')
+    rewrite('/bar')
+
+    # assert
+    assert mock_logger.warning.call_count == 2
+
+
+def test_rewrite_links(flask_app):
+    # arrange
+    info = {'next_page': '/api/v3/device?page=2', 'prev_page': None, 'total_records': 30}
+    headers = {'TS-Rewritten': 'type=prefix; source=/api/v1/screen; target=/api/v3/screen'}
+
+    with flask_app.test_request_context(headers=headers):
+        # act
+        rewritten = rewrite_links(info, ('next_page', 'prev_page'))
+
+    # assert
+    assert rewritten == {'next_page': '/api/v1/device?page=2', 'prev_page': None, 'total_records': 30}
+    assert info['next_page'] == '/api/v3/device?page=2'
+
+
+def test_rewrite_links_without_header(flask_app):
+    # arrange
+    info = {'next_page': '/api/v3/device?page=2'}
+
+    with flask_app.test_request_context():
+        # act/assert
+        assert rewrite_links(info, ('next_page',)) is info
+
+
+def test_PaginationSchema_rewrites_links(flask_app):
+    # arrange
+    info = {'next_page': '/api/v3/device?page=3', 'prev_page': '/api/v3/device?page=1', 'total_records': 30}
+    headers = {'TS-Rewritten': 'type=prefix; source=/api/v1; target=/api/v3'}
+
+    with flask_app.test_request_context(headers=headers):
+        # act
+        dumped = PaginationSchema().dump(info)
+
+    # assert
+    dumped = getattr(dumped, 'data', dumped)  # TODO: @will-norris backwards compat - remove
+    assert dumped == {
+        'next_page': '/api/v1/device?page=3', 'prev_page': '/api/v1/device?page=1', 'total_records': 30
+    }
@@ -1,15 +1,23 @@
+import datetime
+import json
+import threading
+import uuid
 from unittest.mock import MagicMock, patch
 
 import pytest
 from marshmallow import fields, Schema
 
 from test.models import Random
+from thunderstorm.flask.counting import SkipCount
 from thunderstorm.flask.exceptions import DeserializationError
 from thunderstorm.flask.request_utils import (
     get_pagination_info, paginate, get_request_filters, get_request_pagination,
-    make_paginated_response
+    make_paginated_response, encode_cursor, decode_cursor, get_cursor_pagination_info,
+    get_request_cursor_pagination, paginate_by_cursor, make_cursor_paginated_response,
+    make_streaming_paginated_response, SchemaCache, schema_cache, load_request_filters,
+    load_request_pagination
 )
-from thunderstorm.flask.schemas import PaginationSchema
+from thunderstorm.flask.schemas import CursorPaginationSchema, PaginationSchema
 
 
 @pytest.mark.parametrize('page,page_size,num_records,ceiling,prev_page,next_page,url', [
@@ -21,6 +29,10 @@ from thunderstorm.flask.schemas import PaginationSchema
     (1, 20, 40, None, None, '/foo/bar?page_size=20&page=2', '/foo/bar?page_size=1000&page=50'),
     (1, 20, 40, 20, None, '/foo/bar?page_size=20&page=2', '/foo/bar?page_size=1000&page=50'),
     (1, 20, 20, 20, None, '/foo/bar?page_size=20&page=2', '/foo/bar?page_size=1000&page=50'),
+    (2, 20, 60, None, '/foo/bar?pages=3&page_size=20&page=1', '/foo/bar?pages=3&page_size=20&page=3',
+     '/foo/bar?pages=3&page=2'),
+    (1, 20, 40, None, None, '/foo/bar?name=a%20b&page_sizes&page_size=20&page=2',
+     '/foo/bar?name=a%20b&page_sizes&pag%65_size=5'),
 ])
 def test_get_pagination_info(page, page_size, num_records, ceiling, prev_page, next_page, url):
     res = get_pagination_info(page, page_size, num_records, url, ceiling=ceiling)
@@ -29,6 +41,57 @@ def test_get_pagination_info(page, page_size, num_records, ceiling, prev_page, n
     assert res['total_records'] == num_records
 
 
+@pytest.mark.parametrize('page,has_next,prev_page,next_page', [
+    (1, True, None, '/foo/bar?page_size=20&page=2'),
+    (2, False, '/foo/bar?page_size=20&page=1', None),
+])
+def test_get_pagination_info_with_unknown_total(page, has_next, prev_page, next_page):
+    res = get_pagination_info(page, 20, None, '/foo/bar', has_next=has_next)
+    assert res.get('prev_page') == prev_page
+    assert res.get('next_page') == next_page
+    assert res['total_records'] is None
+
+
+@pytest.mark.parametrize('num_rows,next_page', [
+    (21, '/foo/bar?page_size=20&page=3'),
+    (20, None),
+])
+def test_paginate_without_count_fetches_one_more_row(num_rows, next_page):
+    # arrange
+    m_query = MagicMock()
+    m_query.offset.return_value = m_query
+    m_query.limit.return_value = m_query
+    m_query.all.return_value = list(range(num_rows))
+
+    # act
+    rows, res_page_info = paginate(m_query, 2, 20, '/foo/bar', count_strategy=SkipCount())
+
+    # assert
+    assert rows == list(range(20))
+    assert res_page_info.get('next_page') == next_page
+    assert res_page_info['total_records'] is None
+    m_query.count.assert_not_called()
+    m_query.offset.assert_called_with(20)
+    m_query.limit.assert_called_with(21)
+
+
+def test_paginate_with_strategy_fetching_the_page():
+    # arrange
+    m_query = MagicMock()
+    m_strategy = MagicMock()
+    m_strategy.page.return_value = (list(range(20)), 45)
+
+    # act
+    rows, res_page_info = paginate(m_query, 2, 20, '/foo/bar', ceiling=100, count_strategy=m_strategy)
+
+    # assert
+    assert rows == list(range(20))
+    assert res_page_info['next_page'] == '/foo/bar?page_size=20&page=3'
+    assert res_page_info['total_records'] == 45
+    m_strategy.page.assert_called_once_with(m_query, 20, 20, 100)
+    m_query.count.assert_not_called()
+
+
 @pytest.mark.parametrize('page,page_size,num_records,prev_page,next_page,url', [
     (1, 20, 40, None, '/foo/bar?page_size=20&page=2', '/foo/bar',),
     (2, 20, 60, '/foo/bar?page_size=20&page=1', '/foo/bar?page_size=20&page=3', '/foo/bar',),
@@ -144,6 +207,98 @@ def test_make_response_success(mock_query, TestSchemaList, flask_app):
         }
 
 
+@pytest.fixture
+def stream_query():
+    query = MagicMock()
+    query.count.return_value = 50
+    query.offset.return_value = query
+    query.limit.return_value = query
+    query.yield_per.side_effect = lambda n: query.limit.call_args[0][0] * [{'int_1': 1, 'int_2': 2}]
+    return query
+
+
+@pytest.mark.parametrize('yield_per', [1, 7, 20, 100])
+def test_make_streaming_paginated_response_matches_make_paginated_response(
+    yield_per, mock_query, stream_query, TestSchemaList, flask_app
+):
+    with flask_app.test_request_context():
+        expected = make_paginated_response(mock_query, '/some/fake/path', TestSchemaList, 1, 20)
+
+        # act
+        resp = make_streaming_paginated_response(
+            stream_query, '/some/fake/path', TestSchemaList, 1, 20, yield_per=yield_per
+        )
+        chunks = list(resp.response)
+
+    # assert
+    assert resp.mimetype == 'application/json'
+    assert json.loads(''.join(chunks)) == expected
+    stream_query.yield_per.assert_called_once_with(yield_per)
+
+
+def test_make_streaming_paginated_response_without_count(stream_query, TestSchemaList, flask_app):
+    with flask_app.test_request_context():
+        # act
+        resp = make_streaming_paginated_response(
+            stream_query, '/some/fake/path', TestSchemaList, 1, 20, count_strategy=SkipCount()
+        )
+        body = json.loads(''.join(resp.response))
+
+    # assert
+    assert len(body.pop('data')) == 20
+    assert body == {'next_page': '/some/fake/path?page_size=20&page=2', 'prev_page': None, 'total_records': None}
+    stream_query.count.assert_not_called()
+    stream_query.limit.assert_called_with(21)
+
+
+class UnitSchema(Schema):
+    int_1 = fields.Integer()
+    int_2 = fields.Integer()
+    int_3 = fields.Integer(load_only=True)
+    unit = fields.Method('get_unit')
+
+    def get_unit(self, obj):
+        return self.context.get('unit', 'none')
+
+
+@pytest.mark.parametrize('data,exclude', [
+    (fields.Nested(UnitSchema, many=True), ()),
+    (fields.Nested(UnitSchema, many=True, only=('int_1', 'unit')), ()),
+    (fields.Nested(UnitSchema, many=True, exclude=('int_2',)), ()),
+    (fields.Nested(UnitSchema(context={'unit': 'kg'}), many=True), ()),
+    (fields.Nested(UnitSchema, many=True), ('data.int_2',)),
+    (fields.List(fields.Nested(UnitSchema, exclude=('int_1',))), ()),
+])
+def test_make_streaming_paginated_response_dumps_rows_like_make_paginated_response(
+    data, exclude, mock_query, stream_query, flask_app
+):
+    # arrange
+    Meta = type('Meta', (), {'exclude': exclude})
+    TestSchemaNested = type('TestSchemaNested', (PaginationSchema,), {'data': data, 'Meta': Meta})
+
+    with flask_app.test_request_context():
+        expected = make_paginated_response(mock_query, '/some/fake/path', TestSchemaNested, 1, 20)
+
+        # act
+        resp = make_streaming_paginated_response(stream_query, '/some/fake/path', TestSchemaNested, 1, 20)
+        body = json.loads(''.join(resp.response))
+
+    # assert
+    assert body == expected
+    assert body['data'][0] != {}
+
+
+def test_make_streaming_paginated_response_raises_TypeError_for_non_list_data(stream_query, TestSchema, flask_app):
+    # arrange
+    class TestSchemaSingle(PaginationSchema):
+        data = fields.Nested(TestSchema)
+
+    with flask_app.test_request_context():
+        # act/assert
+        with pytest.raises(TypeError):
+            make_streaming_paginated_response(stream_query, '/some/fake/path', TestSchemaSingle, 1, 20)
+
+
 @pytest.mark.parametrize('total_records, ceiling, result', [
     (100, 150, 100),
     (100, 15, 15),
@@ -189,3 +344,205 @@ def test_make_paginated_response_with_ceiling(total_records, ceiling, result, db
         'total_records': result,
         'prev_page': None
     }
+
+
+def test_encode_cursor_round_trips_values():
+    # arrange
+    values = [
+        uuid.uuid4(), datetime.datetime(2020, 1, 1, 12, 30), datetime.date(2020, 1, 2), 'name', 5, 1.5, None
+    ]
+
+    # act
+    cursor = encode_cursor(values)
+
+    # assert
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == values
+
+
+def test_encode_cursor_round_trips_aware_datetimes():
+    # arrange
+    values = [
+        datetime.datetime(2020, 1, 1, 12, 30, 15, 250, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2020, 1, 1, 12, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=-5))),
+    ]
+
+    # act
+    result = decode_cursor(encode_cursor(values))
+
+    # assert
+    assert result == values
+    assert [value.utcoffset() for value in result] == [value.utcoffset() for value in values]
+
+
+@pytest.mark.parametrize('cursor', ['notacursor', 'e30', 'W3siZm9vIjoxfV0', 'WzFd0'])
+def test_decode_cursor_raises_exc_when_invalid(cursor, TestException):
+    # act/assert
+    with pytest.raises(TestException):
+        decode_cursor(cursor, exc=TestException)
+
+
+@pytest.mark.parametrize('next_cursor,url,next_page', [
+    (None, '/foo/bar', None),
+    ('abc', '/foo/bar', '/foo/bar?page_size=20&cursor=abc'),
+    ('abc', '/foo/bar?page_size=5&cursor=old', '/foo/bar?page_size=20&cursor=abc'),
+    ('abc', '/foo/bar?id=5&pages=2&cursor=old', '/foo/bar?id=5&pages=2&page_size=20&cursor=abc'),
+])
+def test_get_cursor_pagination_info(next_cursor, url, next_page):
+    res = get_cursor_pagination_info(next_cursor, 20, url)
+    assert res.get('next_page') == next_page
+
+
+def test_get_request_cursor_pagination_success_with_dict():
+    # act/assert
+    assert get_request_cursor_pagination({'page_size': 5}) == {'cursor': None, 'page_size': 5}
+
+
+@patch('thunderstorm.flask.request_utils.request')
+def test_get_request_cursor_pagination_raises_exc_when_request_args_invalid(mock_request, TestException):
+    # arrange
+    mock_request.args = {'page_size': 1001}
+
+    # act/assert
+    with pytest.raises(TestException):
+        get_request_cursor_pagination(exc=TestException)
+
+
+def test_paginate_by_cursor_walks_every_page_once(db_session, fixtures):
+    # arrange
+    [fixtures.Random() for _ in range(45)]  # noqa
+    order_by = [Random.name, Random.uuid.desc()]
+    expected = db_session.query(Random).order_by(*order_by).all()
+
+    # act
+    rows, cursor, pages = [], None, 0
+    while True:
+        page, page_info = paginate_by_cursor(db_session.query(Random), order_by, 20, cursor, '/foo/bar')
+        rows += page
+        pages += 1
+        if not page_info.get('next_page'):
+            break
+        cursor = page_info['next_page'].rsplit('cursor=', 1)[1]
+
+    # assert
+    assert pages == 3
+    assert rows == expected
+
+
+def test_make_cursor_paginated_response(db_session, fixtures, flask_app):
+    # arrange
+    [fixtures.Random() for _ in range(30)]  # noqa
+
+    class ApiSchema(CursorPaginationSchema):
+        class RandomSchema(Schema):
+            uuid = fields.UUID()
+            name = fields.String()
+
+        data = fields.List(fields.Nested(RandomSchema))
+
+    # act
+    with flask_app.test_request_context():
+        resp = make_cursor_paginated_response(db_session.query(Random), '/foo/bar', ApiSchema, [Random.uuid], 20)
+
+    # assert
+    last = db_session.query(Random).order_by(Random.uuid).all()[19]
+    assert len(resp['data']) == 20
+    assert resp['next_page'] == '/foo/bar?page_size=20&cursor={}'.format(encode_cursor([last.uuid]))
+
+
+def test_SchemaCache_returns_one_instance_per_class_and_options(TestSchema):
+    # arrange
+    cache = SchemaCache()
+
+    # act
+    schemas = [cache(TestSchema), cache(TestSchema), cache(TestSchema, many=True), cache(TestSchema, only=['int_1'])]
+
+    # assert
+    assert schemas[0] is schemas[1]
+    assert schemas[2] is not schemas[0] and schemas[2].many
+    assert set(schemas[3].fields) == {'int_1'}
+    assert cache(TestSchema, only=('int_1',)) is schemas[3]
+    assert cache.info() == (2, 3, 0, 1024, 3)
+
+
+def test_SchemaCache_does_not_cache_unhashable_options(TestSchema):
+    # arrange
+    cache = SchemaCache()
+
+    # act
+    schemas = [cache(TestSchema, context={'a': 1}) for _ in range(2)]
+
+    # assert
+    assert schemas[0] is not schemas[1]
+    assert cache.info().uncached == 2
+    assert len(cache) == 0
+
+
+def test_SchemaCache_evicts_oldest(TestSchema):
+    # arrange
+    cache = SchemaCache(maxsize=2)
+    first = cache(TestSchema)
+
+    # act
+    cache(TestSchema, many=True)
+    cache(TestSchema, only=['int_1'])
+
+    # assert
+    assert len(cache) == 2
+    assert cache(TestSchema) is not first
+
+
+def test_SchemaCache_is_thread_safe(TestSchema):
+    # arrange
+    cache = SchemaCache()
+    schemas = []
+
+    def get_schemas():
+        schemas.extend(cache(TestSchema) for _ in range(100))
+
+    threads = [threading.Thread(target=get_schemas) for _ in range(8)]
+
+    # act
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # assert
+    assert len({id(schema) for schema in schemas}) == 1
+    assert cache.info().misses == 1
+
+
+def test_get_request_filters_reuses_schema(TestSchema, TestException, flask_app):
+    # arrange
+    with flask_app.test_request_context('/?int_1=1&int_2=2'):
+        get_request_filters(TestSchema, TestException)
+        hits = schema_cache.hits
+
+        # act
+        get_request_filters(TestSchema, TestException)
+
+    # assert
+    assert schema_cache.hits == hits + 1
+
+
+def test_load_request_filters_without_flask(TestSchema, TestException):
+    # act/assert
+    assert load_request_filters(TestSchema, {'int_1': '1', 'int_2': '2'}, TestException) == {'int_1': 1, 'int_2': 2}
+    with pytest.raises(TestException):
+        load_request_filters(TestSchema, {'int_1': 'notinteger'}, TestException)
+
+
+@pytest.mark.parametrize('args,version,expected', [
+    ({'page': '2'}, 1, {'page': 2, 'page_size': 20}),
+    ({'page_num': '3', 'page_size': '500'}, 2, {'page_num': 3, 'page_size': 500}),
+])
+def test_load_request_pagination_without_flask(args, version, expected):
+    # act/assert
+    assert load_request_pagination(args, version=version) == expected
+
+
+def test_load_request_pagination_raises_exc(TestException):
+    # act/assert
+    with pytest.raises(TestException):
+        load_request_pagination({'page_size': '1000'}, exc=TestException)
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from thunderstorm.asgi import RequestContextMiddleware
+from thunderstorm.flask.headers import get_rewritten_header, rewrite_path
+from thunderstorm.flask.schemas import PaginationSchema
+from thunderstorm.logging import get_request_id
+
+
+def make_app(seen):
+    async def app(scope, receive, send):
+        await asyncio.sleep(0)
+        seen.append({
+            'request_id': get_request_id(),
+            'rewritten': get_rewritten_header(),
+            'next_page': rewrite_path('/api/v3/device?page=2'),
+            'pagination': PaginationSchema().dump({'next_page': '/api/v3/device?page=2'}),
+        })
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'ok'})
+
+    return app
+
+
+async def call(app, headers):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({'type': 'http', 'headers': headers}, receive, send)
+    return sent
+
+
+@pytest.mark.asyncio
+async def test_RequestContextMiddleware_sets_request_context():
+    # arrange
+    seen = []
+    app = RequestContextMiddleware(make_app(seen))
+    headers = [
+        (b'ts-request-id', b'abc123'),
+        (b'ts-rewritten', b'type=prefix; source=/api/v1; target=/api/v3'),
+    ]
+
+    # act
+    sent = await call(app, headers)
+
+    # assert
+    assert seen[0]['request_id'] == 'abc123'
+    assert seen[0]['next_page'] == '/api/v1/device?page=2'
+    assert seen[0]['pagination']['next_page'] == '/api/v1/device?page=2'
+    assert (b'ts-request-id', b'abc123') in sent[0]['headers']
+    assert (b'content-type', b'text/plain') in sent[0]['headers']
+    assert get_rewritten_header() is None
+
+
+@pytest.mark.asyncio
+async def test_RequestContextMiddleware_keeps_concurrent_requests_apart():
+    # arrange
+    seen = []
+    app = RequestContextMiddleware(make_app(seen))
+
+    # act
+    sent = await asyncio.gather(*[call(app, [(b'ts-request-id', str(i).encode())]) for i in range(10)])
+
+    # assert
+    assert sorted(s['request_id'] for s in seen) == sorted(str(i) for i in range(10))
+    assert all(s['next_page'] == '/api/v3/device?page=2' for s in seen)
+    for i, messages in enumerate(sent):
+        assert (b'ts-request-id', str(i).encode()) in messages[0]['headers']
+
+
+@pytest.mark.asyncio
+async def test_RequestContextMiddleware_generates_request_id():
+    # arrange
+    seen = []
+    app = RequestContextMiddleware(make_app(seen))
+
+    # act
+    sent = await call(app, [])
+
+    # assert
+    request_id = seen[0]['request_id']
+    assert len(request_id) == 32
+    assert (b'ts-request-id', request_id.encode()) in sent[0]['headers']
+
+
+@pytest.mark.asyncio
+async def test_RequestContextMiddleware_passes_other_scopes_through():
+    # arrange
+    scopes = []
+
+    async def app(scope, receive, send):
+        scopes.append(scope)
+
+    # act
+    await RequestContextMiddleware(app)({'type': 'lifespan'}, None, None)
+
+    # assert
+    assert scopes == [{'type': 'lifespan'}]
@@ -5,7 +5,8 @@ from unittest.mock import patch, MagicMock
 from faust import App as faust_app
 
 from thunderstorm.kafka_messaging import (
-    TSKafka, TSKafkaSendException, TSKafkaConnectException
+    TSKafka, TSKafkaSendException, TSKafkaConnectException, TSPrometheusMonitor, TSStatsdMonitor,
+    _envelope_schema
 )
 from thunderstorm.shared import SchemaError
 
@@ -110,6 +111,20 @@ def test_TSKafka_send_ts_event_if_send_raises_error_throw_TSKafkaSendException_w
     mock_get_kafka_producer.assert_called_once()
 
 
+def test_TSKafka_send_ts_event_records_sent_count_with_prometheus_monitor(kafka_app, TestEvent):
+    # arrange
+    monitor = TSPrometheusMonitor(prefix='test')
+    kafka_app.monitor = monitor
+
+    # act
+    with patch.object(kafka_app, 'get_kafka_producer', return_value=MagicMock()):
+        kafka_app.send_ts_event({'int_1': 3, 'int_2': 6}, TestEvent)
+
+    # assert
+    assert monitor.registry.get('test_faust_stream_test_topic_messages_sent').value == 1
+    assert 'test_faust_stream_test_topic_messages_sent_total 1' in monitor.registry.render()
+
+
 def test_TSKafka_get_kafka_producer_raises_TSKafkaConnectException_if_no_real_brokers(kafka_app):  # noqa
     # act/assert
     with pytest.raises(TSKafkaConnectException):
@@ -208,3 +223,37 @@ async def test_TSKafka_ts_event_with_compress(kafka_app, TestEvent):
 
     # assert
     assert agent.results[event.message.offset] == message.pop('data')
+
+
+def test_envelope_schema_is_cached_per_event_schema_and_compression(TestEvent):
+    assert _envelope_schema(TestEvent.schema) is _envelope_schema(TestEvent.schema)
+    assert _envelope_schema(TestEvent.schema) is not _envelope_schema(TestEvent.schema, True)
+
+
+@pytest.mark.parametrize('shortlabel,label', [
+    ('Stream: <Topic: pos-week.fetch>', 'pos-week_fetch'),
+    ('Stream: <Topic: foo>', 'foo'),
+])
+def test_TSStatsdMonitor_stream_label(shortlabel, label):
+    # arrange
+    monitor = TSStatsdMonitor()
+
+    # act
+    result = monitor._stream_label(MagicMock(shortlabel=shortlabel))
+
+    # assert
+    assert result == label
+
+
+def test_TSStatsdMonitor_stream_label_is_computed_once_per_stream():
+    # arrange
+    monitor = TSStatsdMonitor()
+    stream = MagicMock(shortlabel='Stream: <Topic: pos-week.fetch>')
+
+    # act
+    with patch('faust.sensors.statsd.StatsdMonitor._stream_label', return_value='topic_pos-week.fetch') as mock_label:
+        results = [monitor._stream_label(stream), monitor._stream_label(stream)]
+
+    # assert
+    assert results == ['pos-week_fetch', 'pos-week_fetch']
+    mock_label.assert_called_once_with(stream=stream)
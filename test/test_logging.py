@@ -0,0 +1,31 @@
+from celery import Celery
+
+from thunderstorm.logging import get_context_request_id, get_request_id, set_request_id, TS_REQUEST_ID
+from thunderstorm.logging.celery import _REQUEST_ID_TOKENS
+
+
+def test_celery_tasks_do_not_leak_request_ids():
+    # arrange
+    app = Celery('test_logging', set_as_current=False)
+    request_ids = []
+
+    @app.task
+    def leaking_task():
+        # set without reset, as a helper run by the task might
+        set_request_id('leaked')
+        request_ids.append(get_request_id())
+
+    @app.task
+    def next_task():
+        request_ids.append(get_request_id())
+
+    # act
+    leaking_task.apply(headers={TS_REQUEST_ID: 'first'})
+    next_task.apply(headers={TS_REQUEST_ID: 'second'})
+    next_task.apply()
+
+    # assert
+    assert request_ids[:2] == ['leaked', 'second']
+    assert request_ids[2] not in ('leaked', 'second')
+    assert get_context_request_id() is None
+    assert _REQUEST_ID_TOKENS == {}
@@ -1,13 +1,19 @@
+import json
 from unittest.mock import patch, Mock
 from uuid import uuid4
 
 from celery import Task
+from celery.signals import celeryd_after_setup
+import marshmallow
 from marshmallow import Schema, fields
 import pytest
 
 from thunderstorm.messaging import (
-    ts_task_name, ts_task, send_ts_task, SchemaError
+    ts_task_name, ts_task, send_ts_task, send_ts_tasks, SchemaError, TSMessage, LazyTSMessage
 )
+from thunderstorm.registry import registry, TRANSPORT_CELERY
+from thunderstorm.routing import HashShardRouting, OverflowRouting, PriorityRouting
+from thunderstorm.shared import compress_payload, decompress_payload
 
 
 @pytest.mark.parametrize('event_name,task_name', [
@@ -187,3 +193,571 @@ def test_send_ts_task_fails_on_many_when_expecting_one(celery):
 
     # assert
     assert not mock_send_task.called
+
+
+def test_send_ts_task_dump_only_does_not_load(celery):
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        send_ts_task('foo.bar', FooSchema(), {'bar': 'foo'}, validation='dump')
+
+    # assert
+    mock_send_task.assert_called_once_with(
+        'handle_foo_bar', ({'data': {'bar': 'foo'}},),
+        exchange='ts.messaging',
+        routing_key='foo.bar'
+    )
+
+
+@pytest.mark.parametrize('validation,sent_loads', [('full', 1), ('dump', 0)])
+def test_send_ts_task_uses_validation_policy_from_config(celery, validation, sent_loads):
+    # arrange
+    celery.conf.TS_TASK_VALIDATION = validation
+    schema = FooSchema()
+    received = []
+
+    @ts_task('foo.validation', schema=schema)
+    def my_task(message):
+        received.append(message.data)
+
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task, \
+            patch.object(schema, 'load', wraps=schema.load) as mock_load:
+        send_ts_task('foo.validation', schema, {'foo': 'bar'})
+        loads_on_send = mock_load.call_count
+        my_task(mock_send_task.call_args[0][1][0])
+
+    # assert
+    assert loads_on_send == sent_loads
+    assert mock_load.call_count == sent_loads + 1
+    assert received == [{'foo': 'bar'}]
+
+
+@pytest.mark.parametrize('sample_rate,validated', [(0, False), (1, True)])
+def test_send_ts_task_sampled_validation(celery, sample_rate, validated):
+    # arrange
+    celery.conf.TS_TASK_VALIDATION_SAMPLE_RATE = sample_rate
+    schema = FooSchema()
+
+    # act
+    with patch.object(celery, 'send_task'), patch.object(schema, 'load', wraps=schema.load) as mock_load:
+        send_ts_task('foo.bar', schema, {'foo': 'bar'}, validation='sampled')
+
+    # assert
+    assert mock_load.called is validated
+
+
+def test_send_ts_task_raises_ValueError_on_unknown_validation_policy(celery):
+    with pytest.raises(ValueError):
+        with patch.object(celery, 'send_task'):
+            send_ts_task('foo.bar', FooSchema(), {'foo': 'bar'}, validation='nope')
+
+
+@patch('thunderstorm.messaging.statsd')
+def test_send_ts_task_times_each_stage(mock_statsd, celery):
+    # arrange
+    celery.conf.TS_TASK_TIMING_SAMPLE_RATE = 1
+    mock_pipe = mock_statsd.pipeline.return_value.__enter__.return_value
+
+    # act
+    with patch.object(celery, 'send_task'):
+        send_ts_task('foo.bar', FooSchema(), {'foo': 'bar'})
+
+    # assert
+    assert [c[0][0] for c in mock_pipe.timing.call_args_list] == [
+        'tasks.handle_foo_bar.send_ts_task.dump',
+        'tasks.handle_foo_bar.send_ts_task.validate',
+        'tasks.handle_foo_bar.send_ts_task.publish',
+    ]
+
+
+def test_send_ts_tasks_sends_one_task_per_payload_with_one_producer(celery):
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        results = send_ts_tasks('foo.bar', FooSchema(), [{'foo': 'bar'}, {'foo': 'baz'}])
+
+    # assert
+    assert len(results) == 2
+    assert [c[0] for c in mock_send_task.call_args_list] == [
+        ('handle_foo_bar', ({'data': {'foo': 'bar'}},)),
+        ('handle_foo_bar', ({'data': {'foo': 'baz'}},)),
+    ]
+    producers = {id(c[1].pop('producer')) for c in mock_send_task.call_args_list}
+    assert len(producers) == 1
+    assert mock_send_task.call_args[1] == {'exchange': 'ts.messaging', 'routing_key': 'foo.bar'}
+
+
+def test_send_ts_tasks_sends_nothing_if_one_payload_is_invalid(celery):
+    # assert
+    with pytest.raises(SchemaError):
+        # act
+        with patch.object(celery, 'send_task') as mock_send_task:
+            send_ts_tasks('foo.bar', FooSchema(), [{'foo': 'bar'}, {'bar': 'baz'}])
+
+    # assert
+    assert not mock_send_task.called
+
+
+def test_send_ts_tasks_raises_ValueError_for_many_schema(celery):
+    with pytest.raises(ValueError):
+        send_ts_tasks('foo.bar', FooSchema(many=True), [{'foo': 'bar'}])
+
+
+def test_send_ts_tasks_accepts_payloads_like_send_ts_task(celery):
+    # arrange
+    schema = FooSchema(partial=True)
+    payloads = [{'bar': 'bar'}, {'bar': 'baz'}]
+
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        for payload in payloads:
+            send_ts_task('foo.partial', schema, payload)
+        send_ts_tasks('foo.partial', schema, payloads)
+
+    # assert
+    calls = [c[0] for c in mock_send_task.call_args_list]
+    assert calls[2:] == calls[:2] == [
+        ('handle_foo_partial', ({'data': {'bar': 'bar'}},)),
+        ('handle_foo_partial', ({'data': {'bar': 'baz'}},)),
+    ]
+
+
+def test_send_ts_tasks_in_transaction_commits(celery):
+    # arrange
+    mock_channel = Mock()
+
+    # act
+    with patch.object(celery, 'connection_for_write') as mock_connection_for_write, \
+            patch.object(celery, 'send_task') as mock_send_task:
+        mock_connection_for_write.return_value.__enter__.return_value.channel.return_value = mock_channel
+        send_ts_tasks('foo.bar', FooSchema(), [{'foo': 'bar'}, {'foo': 'baz'}], transaction=True)
+
+    # assert
+    assert mock_send_task.call_count == 2
+    mock_channel.tx_select.assert_called_once_with()
+    mock_channel.tx_commit.assert_called_once_with()
+    assert not mock_channel.tx_rollback.called
+    mock_channel.close.assert_called_once_with()
+
+
+def test_send_ts_tasks_in_transaction_rolls_back_on_error(celery, TestException):
+    # arrange
+    mock_channel = Mock()
+
+    # act
+    with patch.object(celery, 'connection_for_write') as mock_connection_for_write, \
+            patch.object(celery, 'send_task', side_effect=TestException('boom')):
+        mock_connection_for_write.return_value.__enter__.return_value.channel.return_value = mock_channel
+        with pytest.raises(TestException):
+            send_ts_tasks('foo.bar', FooSchema(), [{'foo': 'bar'}], transaction=True)
+
+    # assert
+    mock_channel.tx_rollback.assert_called_once_with()
+    assert not mock_channel.tx_commit.called
+
+
+def _batch_requests(*messages):
+    from celery_batches import SimpleRequest
+    return [
+        SimpleRequest(str(uuid4()), 'handle_foo_batch', (message,), {}, None, 'localhost')
+        for message in messages
+    ]
+
+
+def test_ts_task_batch_mode_calls_task_with_list_of_messages(celery):
+    pytest.importorskip('celery_batches')
+
+    # arrange
+    some_uuid = uuid4()
+    received = []
+
+    @ts_task('foo.batch.list', schema=FooSchema(), batch_size=2)
+    def my_task(messages):
+        received.extend(messages)
+
+    # act
+    my_task(_batch_requests(
+        {'data': {'foo': 'bar', 'baz': str(some_uuid)}, 'request_id': 1},
+        {'data': {'foo': 'baz'}, 'request_id': 2},
+    ))
+
+    # assert
+    assert my_task.flush_every == 2
+    assert [m.data for m in received] == [{'foo': 'bar', 'baz': some_uuid}, {'foo': 'baz'}]
+    assert [m.metadata for m in received] == [{'request_id': 1}, {'request_id': 2}]
+
+
+@patch('thunderstorm.messaging.statsd')
+def test_ts_task_batch_mode_reports_schema_errors_per_message(mock_statsd, celery):
+    pytest.importorskip('celery_batches')
+
+    # arrange
+    received = []
+
+    @ts_task('foo.batch.errors', schema=FooSchema(), batch_size=3)
+    def my_task(messages):
+        received.extend(messages)
+
+    requests = _batch_requests(
+        {'data': {'foo': 'bar'}},
+        {'data': {'bar': 'missing foo'}},
+        {'data': {'foo': 'baz', 'baz': 'not_a_uuid'}},
+    )
+
+    # act
+    with patch.object(celery, 'backend') as mock_backend:
+        my_task(requests)
+
+    # assert
+    assert [m.data for m in received] == [{'foo': 'bar'}]
+    assert mock_statsd.incr.call_count == 2
+    failed = [c[0][0] for c in mock_backend.mark_as_failure.call_args_list]
+    assert failed == [requests[1].id, requests[2].id]
+    assert all(isinstance(c[0][1], SchemaError) for c in mock_backend.mark_as_failure.call_args_list)
+    mock_backend.mark_as_done.assert_called_once_with(requests[0].id, None)
+
+
+@patch('thunderstorm.messaging.statsd')
+def test_ts_task_batch_mode_delivers_batch_with_corrupt_payload(mock_statsd, celery):
+    pytest.importorskip('celery_batches')
+
+    # arrange
+    received = []
+
+    @ts_task('foo.batch.corrupt', schema=FooSchema(), batch_size=3)
+    def my_task(messages):
+        received.extend(messages)
+
+    requests = _batch_requests(
+        {'data': {'foo': 'bar'}},
+        {'data': 'not zlib data', 'compressed': 'zlib'},
+        {'data': compress_payload(json.dumps({'foo': 'baz'}).encode()), 'compressed': 'zlib'},
+    )
+
+    # act
+    with patch.object(celery, 'backend') as mock_backend:
+        my_task(requests)
+
+    # assert
+    assert [m.data for m in received] == [{'foo': 'bar'}, {'foo': 'baz'}]
+    mock_statsd.incr.assert_called_once_with('tasks.handle_foo_batch_corrupt.ts_task.errors.schema')
+    mock_backend.mark_as_failure.assert_called_once()
+    assert mock_backend.mark_as_failure.call_args[0][0] == requests[1].id
+    assert isinstance(mock_backend.mark_as_failure.call_args[0][1], SchemaError)
+    assert [c[0][0] for c in mock_backend.mark_as_done.call_args_list] == [requests[0].id, requests[2].id]
+    handle = registry.get('foo.batch.corrupt', TRANSPORT_CELERY)
+    assert (handle.received, handle.errors) == (3, 1)
+
+
+def test_ts_task_batch_mode_stores_result_per_message(celery):
+    pytest.importorskip('celery_batches')
+
+    # arrange
+    @ts_task('foo.batch.results', schema=FooSchema(), batch_interval=5)
+    def my_task(messages):
+        return [m['foo'] for m in messages]
+
+    requests = _batch_requests({'data': {'foo': 'bar'}}, {'data': {'foo': 'baz'}})
+
+    # act
+    with patch.object(celery, 'backend') as mock_backend:
+        my_task(requests)
+
+    # assert
+    assert my_task.flush_interval == 5
+    assert mock_backend.mark_as_done.call_args_list == [
+        ((requests[0].id, 'bar'),), ((requests[1].id, 'baz'),)
+    ]
+
+
+@pytest.mark.skipif(not hasattr(marshmallow, 'EXCLUDE'), reason='unknown is a marshmallow 3 option')
+def test_ts_task_batch_mode_keeps_schema_options(celery):
+    pytest.importorskip('celery_batches')
+
+    # arrange
+    schema = FooSchema(unknown=marshmallow.EXCLUDE)
+    data = {'foo': 'bar', 'extra': 'unknown field'}
+    single, batch = [], []
+
+    @ts_task('foo.single.options', schema=schema)
+    def single_task(message):
+        single.append(message.data)
+
+    @ts_task('foo.batch.options', schema=schema, batch_size=2)
+    def batch_task(messages):
+        batch.extend(m.data for m in messages)
+
+    # act
+    single_task({'data': dict(data)})
+    batch_task(_batch_requests({'data': dict(data)}))
+
+    # assert
+    assert batch == single == [{'foo': 'bar'}]
+
+
+def test_ts_task_batch_mode_raises_ValueError_for_many_schema():
+    pytest.importorskip('celery_batches')
+
+    with pytest.raises(ValueError):
+        ts_task('foo.bar', schema=FooSchema(many=True), batch_size=10)
+
+
+def test_ts_message_has_no_instance_dict():
+    message = TSMessage({'foo': 'bar'}, {'request_id': 123})
+
+    assert not hasattr(message, '__dict__')
+    assert message == {'foo': 'bar'}
+
+
+class ItemSchema(Schema):
+    uuid = fields.UUID(required=True)
+
+
+class ContainerSchema(Schema):
+    name = fields.String(required=True)
+    item = fields.Nested(ItemSchema, required=True)
+    items = fields.List(fields.Nested(ItemSchema))
+
+
+def test_ts_task_lazy_mode_deserializes_nested_fields_on_access(celery):
+    # arrange
+    some_uuid = uuid4()
+    received = []
+
+    @ts_task('foo.lazy', schema=ContainerSchema(), lazy=True)
+    def my_task(message):
+        received.append(message)
+
+    # act
+    my_task({
+        'data': {'name': 'foo', 'item': {'uuid': str(some_uuid)}, 'items': [{'uuid': 'not_a_uuid'}]},
+        'request_id': 123
+    })
+
+    # assert
+    message = received[0]
+    assert isinstance(message, LazyTSMessage)
+    assert message.metadata == {'request_id': 123}
+    assert message['name'] == 'foo'
+    assert message['item'] == {'uuid': some_uuid}
+    assert message['item'] is message['item']
+    with pytest.raises(SchemaError):
+        message['items']
+
+
+def test_ts_task_lazy_mode_data_loads_all_fields(celery):
+    # arrange
+    some_uuid = uuid4()
+    received = []
+
+    @ts_task('foo.lazy.data', schema=ContainerSchema(), lazy=True)
+    def my_task(message):
+        received.append(message.data)
+
+    # act
+    my_task({'data': {'name': 'foo', 'item': {'uuid': str(some_uuid)}, 'items': []}})
+
+    # assert
+    assert received == [{'name': 'foo', 'item': {'uuid': some_uuid}, 'items': []}]
+
+
+@pytest.mark.skipif(not hasattr(marshmallow, 'EXCLUDE'), reason='unknown is a marshmallow 3 option')
+def test_ts_task_lazy_mode_keeps_schema_options(celery):
+    # arrange
+    some_uuid = uuid4()
+    received = []
+    data = {'name': 'foo', 'item': {'uuid': str(some_uuid)}, 'extra': 'unknown field'}
+
+    @ts_task('foo.lazy.options', schema=ContainerSchema(unknown=marshmallow.EXCLUDE), lazy=True)
+    def my_task(message):
+        received.append(message.data)
+
+    # act
+    my_task({'data': data})
+
+    # assert
+    assert received == [{'name': 'foo', 'item': {'uuid': some_uuid}}]
+
+
+@pytest.mark.parametrize('data', [
+    {'item': {'uuid': str(uuid4())}},
+    {'name': 'foo'},
+    ['not', 'a', 'dict'],
+    {'name': 'foo', 'item': 'not a dict'},
+    {'name': 'foo', 'item': {}},
+    {'name': 'foo', 'item': {'uuid': str(uuid4())}, 'items': [{'uuid': str(uuid4())}, {}]},
+    {'name': 'foo', 'item': {'uuid': str(uuid4())}, 'items': {'uuid': str(uuid4())}},
+])
+def test_ts_task_lazy_mode_fails_on_schema_error_up_front(data):
+    mock_task = Mock()
+    my_task = ts_task('foo.lazy.error', schema=ContainerSchema(), lazy=True)(mock_task)
+
+    with pytest.raises(SchemaError):
+        my_task({'data': data})
+
+    assert not mock_task.called
+
+
+def test_ts_task_lazy_mode_checks_required_nested_keys_before_task_runs(celery):
+    # arrange
+    names = []
+
+    @ts_task('foo.lazy.required', schema=ContainerSchema(), lazy=True)
+    def my_task(message):
+        # the task never reads the nested fields
+        names.append(message['name'])
+
+    # act
+    with pytest.raises(SchemaError) as exc_info:
+        my_task({'data': {'name': 'foo', 'item': {'uuid': str(uuid4())}, 'items': [{'name': 'no uuid'}]}})
+
+    # assert
+    assert names == []
+    assert exc_info.value.errors == {'items': {0: {'uuid': ['Missing data for required field.']}}}
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'bz2', 'lzma'])
+def test_send_ts_task_compresses_payload_over_threshold(celery, codec):
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        send_ts_task('foo.bar', FooSchema(), {'foo': 'bar' * 100}, compression=codec, compression_threshold=100)
+
+    # assert
+    event = mock_send_task.call_args[0][1][0]
+    assert event['compressed'] == codec
+    assert decompress_payload(event['data'], codec) == {'foo': 'bar' * 100}
+
+
+def test_send_ts_task_compresses_payload_with_uuid_in_dict_field(celery):
+    # arrange
+    class DictSchema(Schema):
+        attributes = fields.Dict()
+
+    some_uuid = uuid4()
+
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        send_ts_task('foo.dict', DictSchema(), {'attributes': {'uuid': some_uuid}}, compression='zlib',
+                     compression_threshold=0)
+
+    # assert
+    event = mock_send_task.call_args[0][1][0]
+    assert decompress_payload(event['data'], event['compressed']) == {'attributes': {'uuid': str(some_uuid)}}
+
+
+def test_send_ts_task_does_not_compress_payload_under_threshold(celery):
+    # arrange
+    celery.conf.TS_TASK_COMPRESSION = 'zlib'
+
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        send_ts_task('foo.bar', FooSchema(), {'foo': 'bar'})
+
+    # assert
+    assert mock_send_task.call_args[0][1] == ({'data': {'foo': 'bar'}},)
+
+
+def test_send_ts_task_raises_ValueError_on_unknown_codec(celery):
+    with pytest.raises(ValueError):
+        send_ts_task('foo.bar', FooSchema(), {'foo': 'bar'}, compression='snappy')
+
+
+def test_send_ts_tasks_compresses_each_payload(celery):
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        send_ts_tasks('foo.bar', FooSchema(), [{'foo': 'bar'}, {'foo': 'baz'}], compression='zlib', compression_threshold=0)
+
+    # assert
+    events = [c[0][1][0] for c in mock_send_task.call_args_list]
+    assert [decompress_payload(e['data'], e['compressed']) for e in events] == [{'foo': 'bar'}, {'foo': 'baz'}]
+
+
+def test_ts_task_decompresses_payload(celery):
+    # arrange
+    some_uuid = uuid4()
+    received = []
+
+    @ts_task('foo.compressed', schema=FooSchema())
+    def my_task(message):
+        received.append(message)
+
+    data = compress_payload(json.dumps({'foo': 'bar', 'baz': str(some_uuid)}).encode(), 'lzma')
+
+    # act
+    my_task({'data': data, 'compressed': 'lzma', 'request_id': 123})
+
+    # assert
+    assert received[0].data == {'foo': 'bar', 'baz': some_uuid}
+    assert received[0].metadata == {'request_id': 123}
+
+
+def test_ts_task_raises_SchemaError_on_corrupt_compressed_payload():
+    mock_task = Mock()
+    my_task = ts_task('foo.compressed.corrupt', schema=FooSchema())(mock_task)
+
+    with pytest.raises(SchemaError):
+        my_task({'data': 'not compressed', 'compressed': 'zlib'})
+
+    assert not mock_task.called
+
+
+def test_send_ts_task_uses_routing_policy(celery):
+    # arrange
+    routing = HashShardRouting('foo', shards=4)
+
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        send_ts_task('foo.bar', FooSchema(), {'foo': 'bar'}, routing=routing)
+
+    # assert
+    assert mock_send_task.call_args[1] == {
+        'exchange': 'ts.messaging',
+        'routing_key': 'foo.bar.shard.{}'.format(routing.shard({'foo': 'bar'})),
+    }
+
+
+def test_send_ts_task_uses_routing_policy_from_config(celery):
+    # arrange
+    celery.conf.TS_TASK_ROUTING = {'foo.bar': PriorityRouting({'foo.bar': 9})}
+
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        send_ts_task('foo.bar', FooSchema(), {'foo': 'bar'})
+        send_ts_task('foo.bar', FooSchema(), {'foo': 'bar'}, priority=1)
+
+    # assert
+    assert [c[1] for c in mock_send_task.call_args_list] == [
+        {'exchange': 'ts.messaging', 'routing_key': 'foo.bar', 'priority': 9},
+        {'exchange': 'ts.messaging', 'routing_key': 'foo.bar', 'priority': 1},
+    ]
+
+
+def test_send_ts_tasks_routes_each_payload(celery):
+    # arrange
+    routing = HashShardRouting('foo', shards=64)
+    payloads = [{'foo': 'bar'}, {'foo': 'baz'}]
+
+    # act
+    with patch.object(celery, 'send_task') as mock_send_task:
+        send_ts_tasks('foo.bar', FooSchema(), payloads, routing=routing)
+
+    # assert
+    assert [c[1]['routing_key'] for c in mock_send_task.call_args_list] == [
+        'foo.bar.shard.{}'.format(routing.shard(payload)) for payload in payloads
+    ]
+
+
+def test_worker_consumes_queues_of_routed_ts_tasks(celery):
+    # arrange
+    ts_task('foo.routed', schema=FooSchema(), routing=HashShardRouting('foo', shards=2))(Mock())
+    ts_task('foo.routed.config', schema=FooSchema())(Mock())
+    celery.conf.TS_TASK_ROUTING = {'foo.routed.config': OverflowRouting(100)}
+    worker = Mock(app=celery)
+
+    # act
+    with patch.object(celery.amqp.queues, 'select_add') as mock_select_add:
+        celeryd_after_setup.send(sender='worker', instance=worker, conf=celery.conf)
+
+    # assert
+    assert {c[0][0].name for c in mock_select_add.call_args_list} >= {
+        'foo.routed.shard.0', 'foo.routed.shard.1', 'foo.routed.config.overflow'
+    }
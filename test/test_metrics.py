@@ -0,0 +1,87 @@
+from urllib.request import urlopen
+
+import pytest
+
+from thunderstorm.metrics import (
+    MetricsClient, MetricsRegistry, metric_name, start_http_server
+)
+
+
+@pytest.mark.parametrize('name,prefix,expected', [
+    ('messages_received', '', 'messages_received'),
+    ('topic.pos-week.messages_received', 'x.faust', 'x_faust_topic_pos_week_messages_received'),
+    ('0.offset', '', '_0_offset'),
+])
+def test_metric_name(name, prefix, expected):
+    assert metric_name(name, prefix) == expected
+
+
+def test_histogram_keeps_fixed_buckets():
+    # arrange
+    registry = MetricsRegistry()
+    histogram = registry.histogram('latency_seconds', buckets=(0.1, 1.0))
+
+    # act
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    # assert
+    assert histogram.counts == [1, 2, 1]
+    assert dict(histogram.samples()) == {
+        'latency_seconds_bucket{le="0.1"}': 1,
+        'latency_seconds_bucket{le="1.0"}': 3,
+        'latency_seconds_bucket{le="+Inf"}': 4,
+        'latency_seconds_sum': 6.05,
+        'latency_seconds_count': 4,
+    }
+
+
+def test_registry_raises_ValueError_on_type_mismatch():
+    registry = MetricsRegistry()
+    registry.counter('foo')
+
+    with pytest.raises(ValueError):
+        registry.gauge('foo')
+
+
+def test_metrics_client_records_statsd_calls():
+    # arrange
+    registry = MetricsRegistry()
+    client = MetricsClient(registry, prefix='x.faust', gauge_stats=('messages_active',))
+
+    # act
+    client.incr('stream.foo.messages.sent')
+    client.incr('stream.foo.messages.sent', 2)
+    client.incr('messages_active')
+    client.decr('messages_active')
+    client.gauge('read_offset.foo.0', 42)
+    client.timing('send_latency', 20)
+
+    # assert
+    assert registry.get('x_faust_stream_foo_messages_sent').value == 3
+    assert registry.get('x_faust_messages_active').value == 0
+    assert registry.get('x_faust_read_offset_foo_0').value == 42
+    assert registry.get('x_faust_send_latency_seconds').sum == 0.02
+
+
+def test_start_http_server_serves_registry():
+    # arrange
+    registry = MetricsRegistry()
+    registry.counter('messages_received', 'Messages received').inc(5)
+    server = start_http_server(registry, port=0)
+
+    # act
+    try:
+        with urlopen('http://127.0.0.1:{}/'.format(server.server_port)) as resp:
+            body = resp.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # assert
+    assert body == (
+        '# HELP messages_received Messages received\n'
+        '# TYPE messages_received counter\n'
+        'messages_received_total 5\n'
+        '# EOF\n'
+    )
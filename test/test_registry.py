@@ -0,0 +1,130 @@
+from unittest.mock import patch
+
+import marshmallow
+import pytest
+from marshmallow import Schema, fields
+
+from thunderstorm.messaging import send_ts_task, ts_task
+from thunderstorm.registry import EventRegistry, TRANSPORT_CELERY, TRANSPORT_KAFKA, registry
+
+
+class FooSchema(Schema):
+    foo = fields.String(required=True)
+
+
+class BarSchema(Schema):
+    bar = fields.String(required=True)
+
+
+def test_register_returns_same_handle_for_same_schema():
+    # arrange
+    events = EventRegistry()
+    schema = FooSchema()
+
+    # act
+    handle = events.register('foo.bar', schema, TRANSPORT_CELERY)
+
+    # assert
+    assert events.register('foo.bar', schema, TRANSPORT_CELERY) is handle
+    assert handle.task_name == 'handle_foo_bar'
+    assert handle.schema is schema
+    assert len(events) == 1
+
+
+def test_register_instantiates_schema_class_once():
+    # arrange
+    events = EventRegistry()
+
+    # act
+    handle = events.register('foo.bar', FooSchema, TRANSPORT_KAFKA)
+
+    # assert
+    assert isinstance(handle.schema, FooSchema)
+    assert events.register('foo.bar', FooSchema, TRANSPORT_KAFKA).schema is handle.schema
+    assert events.get('foo.bar', TRANSPORT_CELERY) is None
+
+
+def test_register_with_new_schema_keeps_counters():
+    # arrange
+    events = EventRegistry()
+    handle = events.register('foo.bar', FooSchema(), TRANSPORT_CELERY)
+    handle.sent = 3
+    schema = BarSchema()
+
+    # act
+    new_handle = events.register('foo.bar', schema, TRANSPORT_CELERY)
+
+    # assert
+    assert new_handle is handle
+    assert handle.schema is schema
+    assert handle.sent == 3
+
+
+def test_send_ts_task_with_fresh_schemas_does_not_replace_schema(celery):
+    # arrange
+    registry.register('foo.fresh', FooSchema(), TRANSPORT_CELERY)
+
+    # act
+    with patch.object(celery, 'send_task'), \
+            patch('thunderstorm.registry.EventHandle.set_schema') as mock_set_schema:
+        send_ts_task('foo.fresh', FooSchema(), {'foo': 'bar'})
+        send_ts_task('foo.fresh', FooSchema(), {'foo': 'baz'})
+
+    # assert
+    assert not mock_set_schema.called
+    assert registry.get('foo.fresh', TRANSPORT_CELERY).sent == 2
+
+
+@pytest.mark.skipif(not hasattr(marshmallow, 'EXCLUDE'), reason='unknown is a marshmallow 3 option')
+def test_ts_task_validates_with_its_own_schema_instance(celery):
+    # arrange
+    received = []
+    with patch.object(celery, 'send_task'):
+        send_ts_task('foo.instance', FooSchema(), {'foo': 'bar'})
+
+    @ts_task('foo.instance', schema=FooSchema(unknown=marshmallow.EXCLUDE))
+    def my_task(message):
+        received.append(message)
+
+    # act
+    my_task({'data': {'foo': 'bar', 'extra': 'unknown field'}})
+
+    # assert
+    assert received == [{'foo': 'bar'}]
+
+
+def test_validate_returns_data_and_errors():
+    handle = EventRegistry().register('foo.bar', FooSchema(), TRANSPORT_CELERY)
+
+    assert handle.validate({'foo': 'bar'}) == ({'foo': 'bar'}, None)
+    assert handle.validate({})[1] == {'foo': ['Missing data for required field.']}
+
+
+def test_report_lists_events_with_counters():
+    # arrange
+    events = EventRegistry()
+    events.register('foo.bar', FooSchema(), TRANSPORT_CELERY).sent = 5
+    events.register('foo.baz', FooSchema, TRANSPORT_KAFKA).received = 7
+
+    # act
+    lines = events.report().splitlines()
+
+    # assert
+    assert len(lines) == 3
+    assert lines[1].split()[:7] == ['foo.bar', 'celery', 'handle_foo_bar', 'FooSchema', '5', '0', '0']
+    assert lines[2].split()[:7] == ['foo.baz', 'kafka', 'handle_foo_baz', 'FooSchema', '0', '7', '0']
+
+
+def test_messaging_counts_sent_and_received_tasks(celery):
+    # arrange
+    schema = FooSchema()
+    my_task = ts_task('foo.registry', schema=schema)(lambda message: None)
+    handle = registry.get('foo.registry', TRANSPORT_CELERY)
+
+    # act
+    with patch.object(celery, 'send_task'):
+        send_ts_task('foo.registry', schema, {'foo': 'bar'})
+    my_task({'data': {'foo': 'bar'}})
+
+    # assert
+    assert (handle.sent, handle.received, handle.errors) == (1, 1, 0)
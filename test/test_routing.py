@@ -0,0 +1,77 @@
+from unittest.mock import Mock
+
+import pytest
+
+from thunderstorm.routing import HashShardRouting, OverflowRouting, PriorityRouting, RoutingPolicy
+
+
+def test_routing_policy_keeps_default_route():
+    routing = RoutingPolicy()
+
+    assert routing.route('foo.bar', {}, Mock()) == {}
+    assert routing.queues('foo.bar') == []
+
+
+def test_hash_shard_routing_routes_same_key_to_same_shard():
+    # arrange
+    routing = HashShardRouting('uuid', shards=8)
+
+    # act
+    routes = [routing.route('foo.bar', {'uuid': 'abc', 'n': n}, Mock()) for n in range(3)]
+
+    # assert
+    assert len({r['routing_key'] for r in routes}) == 1
+    assert routes[0]['routing_key'].startswith('foo.bar.shard.')
+
+
+def test_hash_shard_routing_declares_a_queue_per_shard():
+    # act
+    queues = HashShardRouting('uuid', shards=3).queues('foo.bar')
+
+    # assert
+    assert [q.name for q in queues] == ['foo.bar.shard.0', 'foo.bar.shard.1', 'foo.bar.shard.2']
+    assert all(q.exchange.name == 'ts.messaging' and q.routing_key == q.name for q in queues)
+
+
+def test_hash_shard_routing_raises_ValueError_without_shards():
+    with pytest.raises(ValueError):
+        HashShardRouting('uuid', shards=0)
+
+
+def test_priority_routing_sets_priority_per_event():
+    routing = PriorityRouting({'foo.bar': 7}, default=1)
+
+    assert routing.route('foo.bar', {}, Mock()) == {'priority': 7}
+    assert routing.route('foo.baz', {}, Mock()) == {'priority': 1}
+    assert PriorityRouting({}).route('foo.baz', {}, Mock()) == {}
+
+
+def test_overflow_routing_spills_over_when_queue_is_deep():
+    # arrange
+    now = [0]
+    routing = OverflowRouting(10, check_interval=5, clock=lambda: now[0])
+    routing.queue_depth = Mock(side_effect=[10, 0])
+
+    # act
+    first = routing.route('foo.bar', {}, Mock())
+    now[0] = 1
+    cached = routing.route('foo.bar', {}, Mock())
+    now[0] = 6
+    rechecked = routing.route('foo.bar', {}, Mock())
+
+    # assert
+    assert first == cached == {'routing_key': 'foo.bar.overflow'}
+    assert rechecked == {}
+    assert routing.queue_depth.call_count == 2
+
+
+def test_overflow_routing_routes_normally_if_depth_is_unknown():
+    # arrange
+    routing = OverflowRouting(1)
+    routing.queue_depth = Mock(side_effect=ConnectionError('no broker'))
+
+    # act
+    route = routing.route('foo.bar', {}, Mock())
+
+    # assert
+    assert route == {}
@@ -0,0 +1,101 @@
+import json
+import sys
+
+import pytest
+
+from thunderstorm.shared import (
+    NameCache, SchemaError, name_cache_info, payload_digest, stat_name, topic_name, truncate_payload, ts_task_name
+)
+
+
+def test_name_cache_computes_each_name_once():
+    # arrange
+    calls = []
+
+    def upper(name):
+        calls.append(name)
+        return name.upper()
+
+    cache = NameCache(upper, 'test_upper')
+
+    # act
+    names = [cache('foo'), cache('foo'), cache('bar')]
+
+    # assert
+    assert names == ['FOO', 'FOO', 'BAR']
+    assert calls == ['foo', 'bar']
+    assert cache.info() == (1, 2, 0, 4096, 2)
+
+
+def test_name_cache_evicts_oldest_name_when_full():
+    # arrange
+    cache = NameCache(str.upper, 'test_bounded', maxsize=2)
+
+    # act
+    for name in ['foo', 'bar', 'baz']:
+        cache(name)
+
+    # assert
+    assert len(cache) == 2
+    assert cache.info().evictions == 1
+    assert name_cache_info()['test_bounded'].currsize == 2
+
+
+def test_name_cache_interns_names():
+    cache = NameCache(lambda name: name + '_suffix', 'test_interned')
+
+    assert cache('foo') is sys.intern('foo' + '_suffix')
+
+
+@pytest.mark.parametrize('func,args,expected', [
+    (ts_task_name, ('foo.bar-baz',), 'handle_foo_bar_baz'),
+    (topic_name, ('pos-week.fetch',), 'pos-week_fetch'),
+    (stat_name, ('read_offset.{}.{}', 'pos-week_fetch', 3), 'read_offset.pos-week_fetch.3'),
+])
+def test_normalized_names(func, args, expected):
+    assert func(*args) == expected
+
+
+def test_truncate_payload_keeps_small_payloads():
+    data = {'foo': 'bar', 'items': [1, 2.5, None, True]}
+
+    assert truncate_payload(data, 1024) == data
+
+
+def test_truncate_payload_cuts_large_payloads():
+    # arrange
+    data = {'items': [{'name': 'x' * 100} for _ in range(10000)], 'blob': b'y' * 10 ** 6}
+
+    # act
+    truncated = truncate_payload(data, 512)
+
+    # assert
+    assert len(json.dumps(truncated)) < 1024
+    assert truncated['items'][-1] == '... 9995 more'
+    assert truncated['...'] == '1 more'
+
+
+def test_payload_digest_is_stable():
+    # act
+    size, digest = payload_digest({'foo': 'bar', 'baz': 1})
+
+    # assert
+    assert (size, digest) == payload_digest({'baz': 1, 'foo': 'bar'})
+    assert size == len(json.dumps({'baz': 1, 'foo': 'bar'}, sort_keys=True))
+    assert digest != payload_digest({'foo': 'baz', 'baz': 1})[1]
+
+
+def test_schema_error_renders_bounded_message_once():
+    # arrange
+    data = {'items': ['x' * 1000] * 1000}
+    error = SchemaError('bad', errors={'items': ['Not a valid list.']}, data=data)
+
+    # act
+    message = str(error)
+
+    # assert
+    assert message.startswith("bad: {'items': ['Not a valid list.']} with {'items': ['")
+    assert len(message) < 2 * SchemaError.max_bytes
+    assert error.summary() is error.summary()
+    assert error.log_extra()['data']['digest'] == payload_digest(data)[1]
+    assert error.log_extra()['data']['size'] > 10 ** 6
@@ -0,0 +1,282 @@
+import binascii
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+
+from thunderstorm.utils import metronome
+from thunderstorm.utils.metronome import Metronome, MetronomeIndex, crc32_many, skew_report, slot_histogram
+
+numpy = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def uuids():
+    return [uuid4() for _ in range(500)]
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_crc32_many_matches_crc32(uuids, use_numpy):
+    with patch.object(metronome, 'numpy', numpy if use_numpy else None):
+        crcs = crc32_many(uuids)
+
+    assert list(crcs) == [binascii.crc32(u.bytes) for u in uuids]
+
+
+def test_crc32_many_accepts_byte_buffers_and_arrays(uuids):
+    # arrange
+    expected = [binascii.crc32(u.bytes) for u in uuids]
+    raw = numpy.array([u.bytes for u in uuids], dtype='S16')
+
+    # act / assert
+    assert list(crc32_many([u.bytes for u in uuids])) == expected
+    assert list(crc32_many(raw)) == expected
+    assert list(crc32_many(raw.view(numpy.uint8).reshape(-1, 16))) == expected
+
+
+def test_crc32_many_raises_ValueError_for_other_ids():
+    with pytest.raises(ValueError):
+        crc32_many(['not a uuid'])
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_beat_many_returns_uuids_beat_it_returns_True_for(uuids, use_numpy):
+    # arrange
+    m = Metronome(5, 4)
+
+    # act
+    with patch.object(metronome, 'numpy', numpy if use_numpy else None):
+        due = m.beat_many(uuids)
+        mask = m.beat_many(uuids, mask=True, remainders=m.remainders(uuids))
+
+    # assert
+    assert due == [u for u in uuids if m.beat_it(u)]
+    assert list(mask) == [m.beat_it(u) for u in uuids]
+
+
+def test_beat_many_returns_array_subset_for_array(uuids):
+    # arrange
+    m = Metronome(5, 4)
+    raw = numpy.array([u.bytes for u in uuids], dtype='S16')
+
+    # act
+    due = m.beat_many(raw)
+
+    # assert
+    assert isinstance(due, numpy.ndarray)
+    assert list(due) == [u.bytes for u in uuids if m.beat_it(u)]
+
+
+def test_index_due_returns_uuids_due_this_tick(uuids):
+    # arrange
+    m = Metronome(5, 4)
+
+    # act
+    index = MetronomeIndex(m, uuids)
+
+    # assert
+    assert len(index) == len(uuids)
+    assert index.due() == {u for u in uuids if m.beat_it(u)}
+
+
+def test_index_insert_and_remove(uuids):
+    # arrange
+    m = Metronome(5, 4)
+    index = MetronomeIndex(m, uuids[1:])
+
+    # act
+    index.add(uuids[0].bytes)
+    index.remove(uuids[1])
+    index.discard(uuids[1])
+
+    # assert
+    assert uuids[0] in index
+    assert uuids[1] not in index
+    assert len(index) == len(uuids) - 1
+    with pytest.raises(KeyError):
+        index.remove(uuids[1])
+
+
+@pytest.mark.parametrize('beat_times_every_day', [4, 3])
+def test_index_save_and_load(tmp_path, uuids, beat_times_every_day):
+    # arrange
+    path = str(tmp_path / 'index')
+    MetronomeIndex(Metronome(5, 4), uuids).save(path)
+    m = Metronome(5, beat_times_every_day)
+
+    # act
+    index = MetronomeIndex.load(path, m)
+
+    # assert
+    assert set(index) == set(uuids)
+    assert index.due() == {u for u in uuids if m.beat_it(u)}
+
+
+def test_index_load_raises_ValueError_for_other_files(tmp_path):
+    path = tmp_path / 'index'
+    path.write_bytes(b'TSMI')
+
+    with pytest.raises(ValueError):
+        MetronomeIndex.load(str(path), Metronome(5, 4))
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+def test_metronome_without_clock_keeps_remainder():
+    # arrange
+    with patch('thunderstorm.utils.metronome.time.time', return_value=600):
+        m = Metronome(5, 4)
+
+    # act / assert
+    with patch('thunderstorm.utils.metronome.time.time', return_value=900):
+        assert m.now_remainder == 2
+
+
+def test_metronome_with_clock_follows_clock():
+    # arrange
+    clock = FakeClock(600)
+    m = Metronome(5, 4, clock=clock)
+
+    # act
+    remainders = [m.now_remainder]
+    clock.now = 899
+    remainders.append(m.now_remainder)
+    clock.now = 900
+    remainders.append(m.now_remainder)
+    clock.now = 6 * 60 * 60 + 600
+    remainders.append(m.now_remainder)
+
+    # assert
+    assert remainders == [2, 2, 3, 2]
+
+
+def test_metronome_ticks_yields_each_slot_on_its_tick():
+    # arrange
+    clock = FakeClock(650)
+    m = Metronome(5, 4, clock=clock)
+
+    # act
+    ticks = m.ticks(sleep=clock.sleep)
+    remainders = [next(ticks) for _ in range(3)]
+
+    # assert
+    assert remainders == [2, 3, 4]
+    assert clock.sleeps == [250, 300]
+    assert clock.now == 1200
+
+
+def test_metronome_ticks_raises_ValueError_without_clock():
+    with pytest.raises(ValueError):
+        next(Metronome(5, 4).ticks())
+
+
+@pytest.mark.asyncio
+async def test_metronome_aticks_yields_each_slot_on_its_tick():
+    # arrange
+    clock = FakeClock(650)
+    m = Metronome(5, 4, clock=clock)
+    remainders = []
+
+    # act
+    async for remainder in m.aticks(sleep=clock.async_sleep):
+        remainders.append(remainder)
+        if len(remainders) == 3:
+            break
+
+    # assert
+    assert remainders == [2, 3, 4]
+    assert clock.now == 1200
+
+
+@pytest.mark.parametrize('tolerance', [0, 0.05, 0.2])
+def test_balanced_index_keeps_slot_load_within_tolerance(uuids, tolerance):
+    # arrange
+    m = Metronome(60, 4)
+
+    # act
+    index = MetronomeIndex(m, uuids[:250], tolerance=tolerance)
+    for uuid in uuids[250:]:
+        index.add(uuid)
+
+    # assert
+    assert len(index) == len(uuids)
+    assert max(index.histogram()) <= index.capacity()
+    assert set(index) == set(uuids)
+
+
+def test_balanced_index_remove_and_rebalance(uuids):
+    # arrange
+    m = Metronome(60, 4)
+    index = MetronomeIndex(m, uuids, tolerance=0.05)
+    slot = index.slot(uuids[0])
+
+    # act
+    for uuid in uuids[:400]:
+        index.remove(uuid)
+    index.rebalance()
+
+    # assert
+    assert uuids[0] not in index and uuids[0] not in index.bucket(slot)
+    assert len(index) == 100
+    assert max(index.histogram()) <= index.capacity()
+
+
+def test_balanced_index_save_and_load_keeps_assignment(tmp_path, uuids):
+    # arrange
+    path = str(tmp_path / 'index')
+    m = Metronome(60, 4)
+    index = MetronomeIndex(m, uuids, tolerance=0)
+    index.save(path)
+
+    # act
+    loaded = MetronomeIndex.load(path, m, tolerance=0)
+
+    # assert
+    assert loaded.histogram() == index.histogram()
+    assert all(loaded.slot(u) == index.slot(u) for u in uuids)
+
+
+def test_slot_histogram_and_skew_report(uuids):
+    # arrange
+    m = Metronome(60, 4)
+
+    # act
+    counts = slot_histogram(m, uuids)
+    balanced = slot_histogram(m, uuids, tolerance=0)
+    report = skew_report(counts)
+
+    # assert
+    assert counts == [sum(1 for u in uuids if m.remainders([u])[0] == slot) for slot in range(6)]
+    assert sum(balanced) == 500 and max(balanced) == 84
+    assert report['entities'] == 500 and report['slots'] == 6
+    assert report['skew'] == pytest.approx(max(counts) / (500 / 6) - 1)
+    assert skew_report(balanced)['skew'] == pytest.approx(84 / (500 / 6) - 1)
+
+
+def test_metronome_cli_prints_report(tmp_path, capsys, uuids):
+    # arrange
+    path = tmp_path / 'uuids.txt'
+    path.write_text('\n'.join(str(u) for u in uuids))
+
+    # act
+    status = metronome.main(['--tick-time', '60', '--beat-times', '4', str(path)])
+
+    # assert
+    lines = capsys.readouterr().out.splitlines()
+    assert status == 0
+    assert lines[0].startswith('slots 6  entities 500')
+    assert len(lines) == 7
@@ -0,0 +1,66 @@
+"""Thunderstorm request context for ASGI apps
+
+Flask keeps the request in thread locals, which asyncio tasks handling
+requests concurrently in one thread do not get. This middleware puts what
+the framework neutral helpers need, the request ID and the TS-Rewritten
+header, in context variables instead, and returns the request ID in the
+TS-Request-ID response header like thunderstorm.logging.flask does.
+
+Usage:
+    >>> from starlette.applications import Starlette
+    >>> from thunderstorm.asgi import RequestContextMiddleware
+    >>>
+    >>> app = RequestContextMiddleware(Starlette())
+
+With the middleware in place:
+    - get_request_id() returns the ID of the request, for log filters
+    - rewrite_path(), rewrite_links() and the pagination schemas rewrite
+      links with the request's TS-Rewritten header
+    - load_request_pagination(), load_request_filters() and
+      get_request_cursor_pagination() take the query params explicitly
+"""
+from thunderstorm.flask.headers import reset_rewritten_header, set_rewritten_header, TS_REWRITTEN
+from thunderstorm.logging import request_id_from_headers, reset_request_id, set_request_id, TS_REQUEST_ID
+
+__all__ = ['RequestContextMiddleware']
+
+_REQUEST_ID_HEADER = TS_REQUEST_ID.lower().encode('latin-1')
+_REWRITTEN_HEADER = TS_REWRITTEN.lower().encode('latin-1')
+
+
+class RequestContextMiddleware(object):
+    """ASGI middleware setting the Thunderstorm request context"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.app(scope, receive, send)
+
+        headers = _headers(scope)
+        request_id = request_id_from_headers(headers)
+        rewritten = headers.get(TS_REWRITTEN.lower())
+        response_header = (_REQUEST_ID_HEADER, request_id.encode('latin-1'))
+
+        async def send_with_request_id(message):
+            if message['type'] == 'http.response.start':
+                message = dict(message, headers=list(message.get('headers', [])) + [response_header])
+            await send(message)
+
+        request_id_token = set_request_id(request_id)
+        rewritten_token = set_rewritten_header(rewritten)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            reset_rewritten_header(rewritten_token)
+            reset_request_id(request_id_token)
+
+
+def _headers(scope):
+    """Return the Thunderstorm headers of an ASGI scope by lowercase name"""
+    return {
+        name.decode('latin-1'): value.decode('latin-1')
+        for name, value in scope.get('headers', ())
+        if name in (_REQUEST_ID_HEADER, _REWRITTEN_HEADER)
+    }
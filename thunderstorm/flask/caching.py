@@ -0,0 +1,143 @@
+import collections
+import functools
+import hashlib
+import logging
+import threading
+
+from flask import make_response, request, Response
+
+from thunderstorm.flask.headers import TS_REWRITTEN
+
+
+logger = logging.getLogger(__name__)
+
+ResponseCacheInfo = collections.namedtuple(
+    'ResponseCacheInfo', ['hits', 'misses', 'evictions', 'max_bytes', 'currbytes', 'currsize']
+)
+
+
+class ResponseCache(object):
+    """LRU cache of serialized response bodies, capped in bytes
+
+    Responses are cached by ETag. When adding a response would take the
+    cache over max_bytes the least recently used responses are evicted,
+    a response bigger than max_bytes on its own is not cached.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.currbytes = 0
+        self._responses = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        """Return the (body, status, headers) cached for the ETag, or None"""
+        with self._lock:
+            cached = self._responses.get(etag)
+            if cached is None:
+                self.misses += 1
+                return None
+            self._responses.move_to_end(etag)
+            self.hits += 1
+            return cached
+
+    def set(self, etag, body, status, headers):
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._responses.pop(etag, None)
+            if previous is not None:
+                self.currbytes -= len(previous[0])
+            while self._responses and self.currbytes + len(body) > self.max_bytes:
+                _, evicted = self._responses.popitem(last=False)
+                self.currbytes -= len(evicted[0])
+                self.evictions += 1
+            self._responses[etag] = (body, status, headers)
+            self.currbytes += len(body)
+
+    def __len__(self):
+        return len(self._responses)
+
+    def info(self):
+        return ResponseCacheInfo(
+            self.hits, self.misses, self.evictions, self.max_bytes, self.currbytes, len(self._responses)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+            self.currbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+# responses of the routes decorated without a cache of their own
+response_cache = ResponseCache()
+
+
+def conditional(version_key, *, cache=None):
+    """Serve a Flask GET route conditionally with an ETag
+
+    The version_key hook is called with the route's arguments and returns
+    a cheap key of the version of the data behind the response, e.g. the
+    max updated_at and the count of the listed rows. The ETag is derived
+    from it, the URL and the TS-Rewritten header, which changes the links.
+    A request with a matching If-None-Match, compared weakly so that tags
+    marked weak by proxies match too, gets a 304 Not Modified,
+    otherwise the serialized body is served from the cache or the route
+    is called and its body cached. The key must change with anything else
+    the body depends on, e.g. the user. When the hook returns None the
+    route is called as usual.
+
+    Example:
+        @app.route('/foo/bar')
+        @conditional(lambda: db.session.query(func.max(Foo.updated_at), func.count(Foo.id)).one())
+        def my_route():
+
+    Args:
+        version_key (callable): Hook returning the version of the data
+        cache (ResponseCache): Cache of the bodies, defaults to response_cache
+    """
+    if not callable(version_key):
+        raise TypeError('Non-callable version_key supplied to decorator')
+
+    def decorator(route):
+        @functools.wraps(route)
+        def decorated_route(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return route(*args, **kwargs)
+
+            version = version_key(*args, **kwargs)
+            if version is None:
+                return route(*args, **kwargs)
+
+            etag = _etag(version)
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+                resp.set_etag(etag)
+                return resp
+
+            responses = response_cache if cache is None else cache
+            cached = responses.get(etag)
+            if cached is not None:
+                body, status, headers = cached
+                return Response(body, status=status, headers=headers)
+
+            resp = make_response(route(*args, **kwargs))
+            if resp.status_code == 200 and not resp.is_streamed:
+                resp.set_etag(etag)
+                headers = [(name, value) for name, value in resp.headers if name != 'Content-Length']
+                responses.set(etag, resp.get_data(), resp.status_code, headers)
+            return resp
+
+        return decorated_route
+
+    return decorator
+
+
+def _etag(version):
+    key = '{}\0{}\0{}'.format(request.full_path, request.headers.get(TS_REWRITTEN, ''), version)
+    return hashlib.blake2b(key.encode('utf-8', 'replace'), digest_size=16).hexdigest()
@@ -0,0 +1,194 @@
+"""Strategies for counting the records of a paginated query
+
+Paginating a query runs a count query before fetching the page, which on
+big tables can cost more than the page itself. A count strategy decides
+how the total is obtained, pass one as ``count_strategy`` to paginate or
+make_paginated_response:
+
+    >>> from thunderstorm.flask.counting import CachedCount
+    >>>
+    >>> random_count = CachedCount(ttl=300)
+    >>> paginate(query, page, page_size, url_path, count_strategy=random_count)
+
+A strategy is called with the query and the ceiling and returns the total
+number of records, at most the ceiling, or None when the total is unknown.
+When it is unknown the page is fetched with one extra row to tell whether
+there is a next page. A strategy with a page method, like WindowCount,
+fetches the page and counts the records in the same statement.
+
+Unlike the rest of thunderstorm.flask this module needs sqlalchemy.
+"""
+import collections
+import functools
+import json
+import threading
+import time
+
+from sqlalchemy import case, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+__all__ = ['CachedCount', 'EstimatedCount', 'ExactCount', 'SkipCount', 'WindowCount']
+
+
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a select statement"""
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain, 'postgresql')
+def _compile_explain(element, compiler, **kwargs):
+    return 'EXPLAIN (FORMAT JSON) {}'.format(compiler.process(element.statement, **kwargs))
+
+
+class ExactCount(object):
+    """Count the records with a count query, the default"""
+
+    def __call__(self, query, ceiling=None):
+        return query.limit(ceiling).count() if ceiling else query.count()
+
+
+class SkipCount(object):
+    """Do not count the records, next pages are found by fetching one more row"""
+
+    def __call__(self, query, ceiling=None):
+        return None
+
+
+class CachedCount(object):
+    """Cache the counts of another strategy for ttl seconds
+
+    Counts are cached by the SQL and parameters of the query, so the same
+    listing with the same filters is counted once per ttl. The cache holds
+    at most maxsize counts, the least recently used are evicted first.
+    """
+
+    def __init__(self, ttl=60, maxsize=1024, strategy=None, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.strategy = strategy or ExactCount()
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._counts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query, ceiling=None):
+        """Return the cache key of a query, its compiled SQL and parameters"""
+        compiled = query.statement.compile()
+        params = json.dumps(compiled.params, sort_keys=True, default=repr)
+        return str(compiled), params, ceiling
+
+    def __call__(self, query, ceiling=None):
+        key = self.key(query, ceiling)
+        now = self.clock()
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is not None and cached[1] > now:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        count = self.strategy(query, ceiling)
+        with self._lock:
+            self._counts[key] = (count, now + self.ttl)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+        return count
+
+    def __len__(self):
+        return len(self._counts)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self.hits = self.misses = 0
+
+
+class EstimatedCount(object):
+    """Use the PostgreSQL planner's row estimate instead of counting
+
+    The estimate is read from EXPLAIN, which does not run the query. It is
+    only as good as the table statistics, so an estimate under exact_below
+    is counted with the fallback strategy instead, as are queries on other
+    databases.
+    """
+
+    def __init__(self, exact_below=1000, fallback=None):
+        self.exact_below = exact_below
+        self.fallback = fallback or ExactCount()
+
+    def estimate(self, query):
+        """Return the planner's estimate of the rows of the query
+
+        Returns:
+            int: The estimate, or None if the database is not PostgreSQL
+        """
+        bind = query.session.get_bind()
+        if bind.dialect.name != 'postgresql':
+            return None
+
+        plan = query.session.execute(_Explain(query.statement), bind=bind).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def __call__(self, query, ceiling=None):
+        estimate = self.estimate(query)
+        if estimate is None or estimate < self.exact_below:
+            return self.fallback(query, ceiling)
+        return min(estimate, ceiling) if ceiling else estimate
+
+
+class WindowCount(object):
+    """Count the records with count(*) OVER () in the query of the page
+
+    The page and the total come back in one round trip, the total in a
+    column of every row. This saves the separate count query, not the
+    work of counting: the database still scans every row matching the
+    query to compute the window, the ceiling only caps the total reported.
+    The window counts the rows before the offset and limit are applied, so
+    it is not suited to DISTINCT queries. A page past the last one has no
+    rows to carry the total, so it is counted with the fallback strategy.
+
+    Rows of multi-column queries are returned as named tuples with the
+    column names of the query, so they dump like the query's own rows.
+    """
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback or ExactCount()
+
+    def page(self, query, start, page_size, ceiling=None):
+        """Return the rows of the page and the total number of records
+
+        Returns:
+            tuple: (list of rows, int)
+        """
+        single_entity = len(query.column_descriptions) == 1
+        total = func.count().over()
+        if ceiling:
+            total = case([(total > ceiling, ceiling)], else_=total)
+
+        rows = query.add_columns(total.label('ts_total_records')).offset(start).limit(page_size).all()
+        if not rows:
+            return [], self.fallback(query, ceiling) if start else 0
+
+        num_records = rows[0][-1]
+        if single_entity:
+            return [row[0] for row in rows], num_records
+        row_type = _row_type(tuple(column['name'] for column in query.column_descriptions))
+        return [row_type(*row[:-1]) for row in rows], num_records
+
+    def __call__(self, query, ceiling=None):
+        return self.fallback(query, ceiling)
+
+
+@functools.lru_cache(maxsize=256)
+def _row_type(names):
+    """Return a named tuple class of rows with the column names of a query"""
+    return collections.namedtuple('Row', names, rename=True)
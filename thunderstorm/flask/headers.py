@@ -1,16 +1,26 @@
+import collections
+import contextvars
 import datetime
 import functools
 import logging
+import time
 from urllib.parse import urlparse
 
 from dateutil import parser
-from flask import request, make_response
+from flask import has_request_context, request, make_response
+from statsd.defaults.env import statsd
+
+from thunderstorm.shared import stat_name
 
 
 logger = logging.getLogger(__name__)
 
+TS_REWRITTEN = 'TS-Rewritten'
+# TS-Rewritten header of the current request outside Flask, see thunderstorm.asgi
+_REWRITTEN = contextvars.ContextVar('ts_rewritten', default=None)
+
 
-def deprecated(route=None, *, deadline=None):
+def deprecated(route=None, *, deadline=None, log_interval=60.0):
     """Mark a Flask route deprecated
 
     Log a warning on access to the route and add a Warning HTTP header
@@ -22,6 +32,11 @@ def deprecated(route=None, *, deadline=None):
     Warning header as per RFC7234
     https://tools.ietf.org/html/rfc7234#section-5.5
 
+    The header is built once, when the route is decorated. Logging is rate
+    limited to one message per route every log_interval seconds, counting
+    the calls in between, and the calls are counted in statsd, as
+    ``deprecated_route.<endpoint>.calls``, and in deprecated_route_info().
+
     Example:
         @app.route('/foo/bar')
         @deprecated(deadline='2018-08-10')
@@ -30,22 +45,21 @@ def deprecated(route=None, *, deadline=None):
     Args:
         route (callable): Flask route to decorate
         deadline (datetime or str): when this route will be disabled
+        log_interval (float): minimum seconds between two logs of the route
     """
     if deadline is not None and not isinstance(deadline, datetime.datetime):
         deadline = parser.parse(deadline)
 
     def decorator(route):
+        state = DeprecatedRoute(route, deadline, log_interval)
+
         @functools.wraps(route)
         def decorated_route(*args, **kwargs):
-            message = 'Call to deprecated route: {}'.format(request.path)
-            if deadline and deadline < datetime.datetime.utcnow():
-                logger.error(message)
-            else:
-                logger.warning(message)
+            state.called()
 
             resp = make_response(route(*args, **kwargs))
 
-            resp.headers['Warning'] = warning_header(deadline=deadline)
+            resp.headers['Warning'] = state.header
 
             return resp
 
@@ -59,6 +73,76 @@ def deprecated(route=None, *, deadline=None):
         raise TypeError('Non-callable supplied to decorator')
 
 
+# deprecated routes by name, see deprecated_route_info
+DEPRECATED_ROUTES = {}
+
+DeprecatedRouteInfo = collections.namedtuple('DeprecatedRouteInfo', ['calls', 'logged', 'expired', 'deadline'])
+
+
+class DeprecatedRoute(object):
+    """Counters and log rate limit of a deprecated route
+
+    The deadline is turned into a timestamp once. Calls compare it to the
+    time until it has passed, then log as error without comparing. The
+    counters are for reporting, they are incremented without a lock.
+    """
+    __slots__ = (
+        'name', 'deadline', 'header', 'log_interval', 'expires_at', 'expired',
+        'calls', 'logged', 'unlogged', 'next_log_at'
+    )
+
+    def __init__(self, route, deadline, log_interval):
+        self.name = '{}.{}'.format(route.__module__, route.__qualname__)
+        self.deadline = deadline
+        self.header = warning_header(deadline=deadline)
+        self.log_interval = log_interval
+        self.expires_at = None
+        self.expired = False
+        if deadline:
+            # deadlines are naive UTC datetimes, as compared to utcnow before
+            utc_deadline = deadline if deadline.tzinfo else deadline.replace(tzinfo=datetime.timezone.utc)
+            self.expires_at = utc_deadline.timestamp()
+            self.expired = self.expires_at <= time.time()
+        self.calls = 0
+        self.logged = 0
+        self.unlogged = 0
+        self.next_log_at = 0.0
+        DEPRECATED_ROUTES[self.name] = self
+
+    def called(self):
+        self.calls += 1
+        self.unlogged += 1
+
+        now = time.monotonic()
+        if now < self.next_log_at:
+            return
+        self.next_log_at = now + self.log_interval
+
+        if not self.expired and self.expires_at is not None and self.expires_at <= time.time():
+            self.expired = True
+
+        calls, self.unlogged = self.unlogged, 0
+        self.logged += 1
+        # view functions of different blueprints may share a name, their endpoints differ
+        statsd.incr(stat_name('deprecated_route.{}.calls', request.endpoint), calls)
+
+        message = 'Call to deprecated route: {}'.format(request.path)
+        if calls > 1:
+            message = '{} ({} calls since the last log)'.format(message, calls)
+        if self.expired:
+            logger.error(message)
+        else:
+            logger.warning(message)
+
+    def info(self):
+        return DeprecatedRouteInfo(self.calls, self.logged, self.expired, self.deadline)
+
+
+def deprecated_route_info():
+    """Return the DeprecatedRouteInfo of every deprecated route by route name"""
+    return {name: route.info() for name, route in DEPRECATED_ROUTES.items()}
+
+
 def warning_header(deadline):
     message = 'Deprecated route'
     if deadline:
@@ -67,16 +151,74 @@ def warning_header(deadline):
     return '299 - "{}"'.format(message)
 
 
+def set_rewritten_header(header):
+    """Set the TS-Rewritten header of the request of the current context
+
+    For requests not handled by Flask, e.g. by an ASGI app. Reset it with
+    the returned token once the request is handled.
+
+    Returns:
+        contextvars.Token
+    """
+    return _REWRITTEN.set(header)
+
+
+def reset_rewritten_header(token):
+    _REWRITTEN.reset(token)
+
+
+def get_rewritten_header():
+    """Return the TS-Rewritten header of the current request, or None"""
+    if has_request_context():
+        return request.headers.get(TS_REWRITTEN)
+    return _REWRITTEN.get()
+
+
 def rewrite_path(path):
     """Rewrite a path based on API gateway's rewriting
 
     """
-    if 'TS-Rewritten' in request.headers:
-        return rewrite_path_with_header(path, request.headers['TS-Rewritten'])
+    header = get_rewritten_header()
+    if header is not None:
+        return rewriter_for_header(header)(path)
 
     return path
 
 
+def rewrite_links(obj, fields):
+    """Rewrite the links of a dict based on API gateway's rewriting
+
+    See rewrite_links_with_header, with the header of the current request.
+    """
+    return rewrite_links_with_header(obj, fields, get_rewritten_header())
+
+
+def rewrite_links_with_header(obj, fields, header):
+    """Rewrite the links of a dict based on API gateway's rewriting
+
+    The header is compiled once for all the links. Links which are missing
+    or empty are left as they are.
+
+    Args:
+        obj (dict): Dict containing the links, e.g. pagination info
+        fields (iterable): Keys of the links
+        header (str): TS-Rewritten header, None if the request has none
+
+    Returns:
+        dict: A copy of obj with the links rewritten, or obj if there is
+            nothing to rewrite
+    """
+    if header is None:
+        return obj
+
+    rewrite = rewriter_for_header(header)
+    rewritten = dict(obj)
+    for field in fields:
+        if rewritten.get(field):
+            rewritten[field] = rewrite(rewritten[field])
+    return rewritten
+
+
 def rewrite_path_with_header(path, header):
     """Rewrite a path based on API gateway's rewriting
 
@@ -84,29 +226,54 @@ def rewrite_path_with_header(path, header):
     'type=<type>; source=<origin_path>; target=<target_path>'
     and a path and returns the path rewritten for the other side of the proxy.
     """
+    return rewriter_for_header(header)(path)
+
+
+@functools.lru_cache(maxsize=256)
+def rewriter_for_header(header):
+    """Return a function rewriting paths based on a TS-Rewritten header
+
+    The gateway sends the same few headers over and over, so each one is
+    parsed once and compiled into a function, the last 256 are kept.
+    """
     try:
         rewritten = _parse_rewritten_header(header)
         if rewritten['type'] == 'transparent':
-            return path
+            return _rewrite_transparent
         elif rewritten['type'] == 'static':
-            query = urlparse(path).query
-            if query:
-                return '{}?{}'.format(rewritten['source'], query)
-            return rewritten['source']
+            return functools.partial(_rewrite_static, rewritten['source'])
         elif rewritten['type'] == 'prefix':
             # TODO @robyoung fix this quick hack
             source, target = _chop_common_suffix(
                 rewritten['source'], rewritten['target']
             )
-            if path.startswith(target):
-                return source + path[len(target):]
-            else:
-                raise ValueError
+            return functools.partial(_rewrite_prefix, source, target, header)
         else:
             raise ValueError
     except Exception:
-        logger.warning('Invalid TS-Rewritten header "{}"'.format(header))
-        return path
+        return functools.partial(_rewrite_invalid, header)
+
+
+def _rewrite_transparent(path):
+    return path
+
+
+def _rewrite_static(source, path):
+    query = urlparse(path).query
+    if query:
+        return '{}?{}'.format(source, query)
+    return source
+
+
+def _rewrite_prefix(source, target, header, path):
+    if path.startswith(target):
+        return source + path[len(target):]
+    return _rewrite_invalid(header, path)
+
+
+def _rewrite_invalid(header, path):
+    logger.warning('Invalid TS-Rewritten header "{}"'.format(header))
+    return path
 
 
 def _parse_rewritten_header(header):
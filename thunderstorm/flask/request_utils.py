@@ -1,17 +1,108 @@
+import base64
+import binascii
+import collections
+import datetime
+import decimal
+import json
 import math
-from urllib.parse import urlparse
+import threading
+import uuid
+from urllib.parse import unquote_plus, urlencode, urlparse
 
-from flask import request
+from dateutil.parser import isoparse
+from flask import json as flask_json, request, Response, stream_with_context
+from marshmallow import fields
 from marshmallow.exceptions import ValidationError
 
 from thunderstorm.flask.exceptions import DeserializationError, SerializationError
-from thunderstorm.flask.schemas import PaginationRequestSchema, PaginationRequestSchemaV2
+from thunderstorm.flask.schemas import (
+    CursorPaginationRequestSchema, PaginationRequestSchema, PaginationRequestSchemaV2
+)
 
 import marshmallow  # TODO: @will-norris backwards compat - remove
 MARSHMALLOW_2 = int(marshmallow.__version__[0]) < 3
 
+SchemaCacheInfo = collections.namedtuple('SchemaCacheInfo', ['hits', 'misses', 'uncached', 'maxsize', 'currsize'])
 
-def make_paginated_response(query, url_path, schema, page, page_size, ceiling=None):
+
+class SchemaCache(object):
+    """Cache of schema instances by schema class and options
+
+    Instantiating a schema binds and copies its declared fields, which is
+    repeated on every request for the same schema. Instances are created
+    once per class and options, e.g. many or only, and shared afterwards,
+    between threads too as marshmallow 3 loading and dumping does not change
+    them. When
+    maxsize instances are cached the oldest one is evicted. Options which
+    cannot be hashed, like a context dict, get a fresh instance every time.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, schema, **options):
+        """
+        Return the instance of a schema class with the options.
+
+        Args:
+            schema (marshmallow.Schema): Subclass of marshmallow.Schema
+            **options: Keyword arguments of the schema
+
+        Returns:
+            marshmallow.Schema: The shared instance
+        """
+        try:
+            key = (schema, frozenset((name, _freeze(value)) for name, value in options.items()))
+            instance = self._schemas.get(key)
+        except TypeError:
+            self.uncached += 1
+            return schema(**options)
+
+        if instance is not None:
+            self.hits += 1
+            return instance
+
+        with self._lock:
+            instance = self._schemas.get(key)
+            if instance is None:
+                self.misses += 1
+                if len(self._schemas) >= self.maxsize:
+                    self._schemas.pop(next(iter(self._schemas)))
+                instance = self._schemas[key] = schema(**options)
+            else:
+                self.hits += 1
+        return instance
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def info(self):
+        return SchemaCacheInfo(self.hits, self.misses, self.uncached, self.maxsize, len(self._schemas))
+
+    def clear(self):
+        with self._lock:
+            self._schemas.clear()
+            self.hits = self.misses = self.uncached = 0
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
+# schema instances of the request_utils functions
+schema_cache = SchemaCache()
+
+
+def make_paginated_response(query, url_path, schema, page, page_size, ceiling=None, count_strategy=None):
     """
     Take a sqlalchemy query and paginate it based on the args provided.
 
@@ -24,6 +115,8 @@ def make_paginated_response(query, url_path, schema, page, page_size, ceiling=No
         page (int): Page number of the results page to return
         page_size (int): Number of results to return per page
         ceiling (int): Limit to the count query
+        count_strategy (callable): How to count the records, one of the
+            strategies in thunderstorm.flask.counting, an exact count by default
 
     Returns:
         dict: The structure of which conforms to the thunderstorm API
@@ -32,22 +125,108 @@ def make_paginated_response(query, url_path, schema, page, page_size, ceiling=No
     Raises:
         SerializationError: If serialization of the pagination info fails for any reason
     """
-    start = (page - 1) * page_size
-    num_records = query.limit(ceiling).count() if ceiling else query.count()
-
-    pagination_info = get_pagination_info(page, page_size, num_records, url_path, ceiling=ceiling)
-    query = query.offset(start).limit(page_size)
+    query, pagination_info = _paginate(query, page, page_size, url_path, ceiling, 1, count_strategy)
 
     # TODO: @will-norris backwards compat - remove
     if MARSHMALLOW_2:
-        return schema().dump({'data': query, **pagination_info}).data
+        return schema_cache(schema).dump({'data': query, **pagination_info}).data
     else:
         try:
-            return schema().dump({'data': query, **pagination_info})
+            return schema_cache(schema).dump({'data': query, **pagination_info})
         except ValidationError as vex:
             raise SerializationError(('Error serializing pagination info: {}'.format(vex.messages)))
 
 
+def make_streaming_paginated_response(query, url_path, schema, page, page_size, ceiling=None,
+                                      count_strategy=None, yield_per=100):
+    """
+    Take a sqlalchemy query and stream the page of it based on the args provided.
+
+    The rows are fetched yield_per at a time and dumped one by one into a
+    chunked JSON body, with the pagination info at the end, so only a chunk
+    of the page is in memory at once. The body is the same as the one of
+    make_paginated_response once parsed. Must be called in a request context,
+    which is kept until the body is sent so the query's session is still open.
+
+    Args:
+        query (sqlalchemy Query object): Query you wish to paginate
+        url_path (str): url_path that the request was sent to
+        schema (Schema): Subclass of marshmallow.Schema, with the rows in a
+            data field of nested schemas
+        page (int): Page number of the results page to return
+        page_size (int): Number of results to return per page
+        ceiling (int): Limit to the count query
+        count_strategy (callable): How to count the records, one of the
+            strategies in thunderstorm.flask.counting, an exact count by default
+        yield_per (int): Number of rows to fetch and write at a time
+
+    Returns:
+        flask.Response: Streamed JSON response. Errors dumping rows are raised
+            while the body is sent
+    """
+    start = (page - 1) * page_size
+    num_records = _count(query, ceiling, count_strategy)
+    # when the total is unknown one more row tells whether there is a next page
+    limit = page_size if num_records is not None else page_size + 1
+    rows = query.offset(start).limit(limit).yield_per(yield_per)
+
+    data_schema = _data_schema(schema)
+    info_schema = schema_cache(schema, exclude=('data',))
+
+    def generate():
+        yield '{"data": ['
+        chunk, written, has_next = [], 0, False
+        for row in rows:
+            if written == page_size:
+                has_next = True
+                break
+            chunk.append(flask_json.dumps(_dump(data_schema, row, many=False)))
+            written += 1
+            if len(chunk) == yield_per:
+                yield ('' if written == len(chunk) else ',') + ','.join(chunk)
+                chunk = []
+        if chunk:
+            yield ('' if written == len(chunk) else ',') + ','.join(chunk)
+
+        pagination_info = get_pagination_info(
+            page, page_size, num_records, url_path, ceiling=ceiling, has_next=has_next
+        )
+        info = flask_json.dumps(_dump(info_schema, pagination_info))
+        yield ']}' if info == '{}' else '], ' + info[1:]
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def _data_schema(schema):
+    """
+    Return the schema instance of the rows in the data field of a response schema.
+
+    The data field is either a Nested field with many=True or a List of a
+    Nested field. The field's own schema is returned, with the options,
+    e.g. exclude or context, make_paginated_response dumps the rows with,
+    so rows must be dumped one by one with many=False.
+
+    Raises:
+        TypeError: If the data field is not a list of nested schemas
+    """
+    data = schema_cache(schema).fields['data']
+    if isinstance(data, fields.Nested) and data.many:
+        return data.schema
+    if isinstance(data, fields.List):
+        # TODO: @will-norris backwards compat - remove
+        inner = data.container if MARSHMALLOW_2 else data.inner
+        if isinstance(inner, fields.Nested):
+            return inner.schema
+    raise TypeError('The data field of {} is not a list of nested schemas'.format(schema.__name__))
+
+
+def _dump(schema, obj, many=None):
+    # TODO: @will-norris backwards compat - remove
+    if MARSHMALLOW_2:
+        return schema.dump(obj, many=many).data
+    return schema.dump(obj, many=many)
+
+
 def get_request_pagination(params=None, exc=DeserializationError, version=1):
     """
     Get pagination params from a dict. Modifies the dict passed to it.
@@ -63,23 +242,40 @@ def get_request_pagination(params=None, exc=DeserializationError, version=1):
         KeyError: If either page or page_size are missing
         exc or DeserializationError: If there are any marshmallow validation errors
     """
-    schema = PaginationRequestSchemaV2 if version == 2 else PaginationRequestSchema
     if params:
         if version == 2:
             return {'page_num': params.pop('page_num'), 'page_size': params.pop('page_size')}
         return {'page': params.pop('page'), 'page_size': params.pop('page_size')}
 
-    params = request.args
+    return load_request_pagination(request.args, exc=exc, version=version)
+
+
+def load_request_pagination(args, exc=DeserializationError, version=1):
+    """
+    Deserialize pagination params from the query params of a request.
+
+    Takes the query params explicitly, so it works with any framework.
+
+    Args:
+        args (Mapping): Query params of the request
+        exc (Exception subclass): Custom exception to raise if validation of
+            query params fails, falls back to DeserializationError if none is provided
+        version (int): the version of paginating
+
+    Raises:
+        exc or DeserializationError: If there are any marshmallow validation errors
+    """
+    schema = PaginationRequestSchemaV2 if version == 2 else PaginationRequestSchema
 
     # TODO: @will-norris backwards compat - remove
     if MARSHMALLOW_2:
-        data, errors = schema().load(params)
+        data, errors = schema_cache(schema).load(args)
         if errors:
             raise exc('Error deserializing pagination options: {}'.format(errors))
         return data
     else:
         try:
-            return schema().load(params)
+            return schema_cache(schema).load(args)
         except ValidationError as vex:
             raise exc('Error deserializing pagination options: {}'.format(vex.messages))
 
@@ -95,82 +291,92 @@ def get_request_filters(schema, exc):
     Raises:
         exc: If there are any marshmallow validation errors deserializing request.args
     """
+    return load_request_filters(schema, request.args, exc)
+
+
+def load_request_filters(schema, args, exc):
+    """Deserialize the query params of a request and raise exc if there are any errors
+
+    Takes the query params explicitly, so it works with any framework.
+
+    Args:
+        schema (marshmallow.Schema): Subclass of marshmallow.schema
+        args (Mapping): Query params of the request
+        exc (Exception): Exception subclass to raise if there are deserialization errors
+
+    Raises:
+        exc: If there are any marshmallow validation errors deserializing args
+    """
     # TODO: @will-norris backwards compat - remove
     if MARSHMALLOW_2:
-        data, errors = schema().load(request.args)
+        data, errors = schema_cache(schema).load(args)
         if errors:
             raise exc('Error deserializing filters provided: {}'.format(errors))
         return data
     else:
         try:
-            return schema().load(request.args)
+            return schema_cache(schema).load(args)
         except ValidationError as vex:
             raise exc('Error deserializing filters provided: {}'.format(vex.messages))
 
 
-def _strip_query(url_path):
+# query params replaced in the pagination links
+PAGINATION_KEYS = frozenset(('page', 'page_size'))
+CURSOR_PAGINATION_KEYS = frozenset(('cursor', 'page_size'))
+
+
+def _link_base(url_path, page_size, keys=PAGINATION_KEYS):
     """
-    Strip out query params page and page_size from the query params
+    Build the base of the pagination links of a URL, parsed once.
+
+    Query params are removed by their exact name, so e.g. pages is kept.
 
     Args:
         url_path (str): Path of the URL the request was made to
+        page_size (int): Number of results to display per page
+        keys (frozenset): Query params to remove, exactly these names
 
     Returns:
-        str: query params string without page and page_size
+        str: url path with the other query params and page_size
     """
-    query = urlparse(url_path).query
+    url = urlparse(url_path)
+    # the other params are kept as they were encoded
+    query = [
+        param for param in url.query.split('&')
+        if param and _query_key(param) not in keys
+    ]
+    query.append('page_size={}'.format(page_size))
+    return '{}?{}'.format(url.path, '&'.join(query))
 
-    if query:
-        # remove page and page_size
-        query = [
-            params for params in query.split('&')
-            if not params.startswith(('page', 'page_size'))
-        ]
-        # rejoin query params
-        query = '&'.join(query)
 
-    return query
+def _query_key(param):
+    key = param.partition('=')[0]
+    if '%' in key or '+' in key:
+        return unquote_plus(key)
+    return key
 
 
-def get_pagination_info(page, page_size, num_records, url_path='', ceiling=None, version=1):
+def get_pagination_info(page, page_size, num_records, url_path='', ceiling=None, version=1, has_next=None):
     """
     Utility function for creating a dict of pagination information.
 
     Args:
         page (int): Requested page number of results
         page_size (int): Number of results to display per page
-        num_records (int): Total number of records in the db for the given query
+        num_records (int): Total number of records in the db for the given query,
+            None if it is unknown
         url_path (str): Path of the URL the request was made to
         ceiling (int): Limit to the count query
         version (int): the version of paginate, default is 1
+        has_next (bool): Whether there is a next page, used when num_records is unknown
 
 
     Returns:
         dict: Dict containining pagination information. The structure of this
             dict should match the PaginationSchema in schemas.py
     """
-    # get query args if exist strip out page_size and page query args
-    query = _strip_query(url_path)
-
-    # strip url to be just the path
-    url_path = urlparse(url_path).path
-
-    # if num_records is equal ceiling assume there is more
-    if page < num_records / page_size or (ceiling and num_records == ceiling):
-        next_page = page + 1
-    else:
-        next_page = None
-    prev_page = page - 1 if page != 1 else None
-
-    pagination_info = {}
-
-    if query:
-        base_url = '{}?{}&page_size={}'.format(url_path, query, page_size)
-    else:
-        base_url = '{}?page_size={}'.format(url_path, page_size)
-
     if version == 2:
-        total_page = math.ceil(num_records / page_size)
+        total_page = math.ceil(num_records / page_size) if num_records is not None else None
         pagination_info = {
             'pageInfo':
                 {
@@ -181,10 +387,25 @@ def get_pagination_info(page, page_size, num_records, url_path='', ceiling=None,
                 }
         }
         return pagination_info
-    if next_page:
-        pagination_info['next_page'] = '{}&page={}'.format(base_url, next_page)
-    if prev_page:
-        pagination_info['prev_page'] = '{}&page={}'.format(base_url, prev_page)
+
+    if num_records is None:
+        next_page = page + 1 if has_next else None
+    # if num_records is equal ceiling assume there is more
+    elif page < num_records / page_size or (ceiling and num_records == ceiling):
+        next_page = page + 1
+    else:
+        next_page = None
+    prev_page = page - 1 if page != 1 else None
+
+    pagination_info = {}
+
+    if next_page or prev_page:
+        # the links only differ by page
+        base_url = _link_base(url_path, page_size)
+        if next_page:
+            pagination_info['next_page'] = '{}&page={}'.format(base_url, next_page)
+        if prev_page:
+            pagination_info['prev_page'] = '{}&page={}'.format(base_url, prev_page)
 
     pagination_info['total_records'] = num_records
 
@@ -192,7 +413,7 @@ def get_pagination_info(page, page_size, num_records, url_path='', ceiling=None,
 
 
 # TODO: @will-norris Deprecate in favour of make_paginated_response
-def paginate(query, page, page_size, url_path='', ceiling=None, version=1):
+def paginate(query, page, page_size, url_path='', ceiling=None, version=1, count_strategy=None):
     """
     Take a sqlalchemy query and paginate it based on the args provided.
 
@@ -205,13 +426,275 @@ def paginate(query, page, page_size, url_path='', ceiling=None, version=1):
             Query parameters are stripped out by the get_pagination_info func.
         ceiling (int): Limit to the count query
         version (int): the version of paginate, default is 1
+        count_strategy (callable): How to count the records, one of the
+            strategies in thunderstorm.flask.counting, an exact count by default
 
     Returns:
-        tuple: (Paginated Query object applied to it, dict of pagination info)
+        tuple: (Paginated Query object applied to it, dict of pagination info).
+            When the strategy does not count the records the page is fetched
+            with one more row to find the next page, and returned as a list,
+            as it is when the strategy fetches the page itself
     """
+    return _paginate(query, page, page_size, url_path, ceiling, version, count_strategy)
+
+
+def _count(query, ceiling, count_strategy):
+    if count_strategy is None:
+        return query.limit(ceiling).count() if ceiling else query.count()
+    return count_strategy(query, ceiling)
+
+
+def _paginate(query, page, page_size, url_path, ceiling, version, count_strategy):
     start = (page - 1) * page_size
-    num_records = query.limit(ceiling).count() if ceiling else query.count()
+    if hasattr(count_strategy, 'page'):
+        rows, num_records = count_strategy.page(query, start, page_size, ceiling)
+        pagination_info = get_pagination_info(
+            page, page_size, num_records, url_path, ceiling=ceiling, version=version
+        )
+        return rows, pagination_info
+
+    num_records = _count(query, ceiling, count_strategy)
+    if num_records is not None:
+        pagination_info = get_pagination_info(
+            page, page_size, num_records, url_path, ceiling=ceiling, version=version
+        )
+        return query.offset(start).limit(page_size), pagination_info
+
+    rows = query.offset(start).limit(page_size + 1).all()
+    pagination_info = get_pagination_info(
+        page, page_size, None, url_path, ceiling=ceiling, version=version, has_next=len(rows) > page_size
+    )
+    return rows[:page_size], pagination_info
+
+
+# cursor values are tagged with their type so they compare like the column values
+_CURSOR_TYPES = {
+    'uuid': (uuid.UUID, str, uuid.UUID),
+    # fromisoformat is not available on python 3.6
+    'datetime': (datetime.datetime, datetime.datetime.isoformat, isoparse),
+    'date': (datetime.date, datetime.date.isoformat, lambda value: datetime.datetime.strptime(value, '%Y-%m-%d').date()),
+    'decimal': (decimal.Decimal, str, decimal.Decimal),
+}
+
+
+def encode_cursor(values):
+    """
+    Encode the key of the last row of a page into an opaque cursor.
 
-    pagination_info = get_pagination_info(page, page_size, num_records, url_path, ceiling=ceiling, version=version)
+    Args:
+        values (list): Values of the order by columns of the row. Strings,
+            numbers, booleans, UUIDs, datetimes, dates and decimals are supported
 
-    return query.offset(start).limit(page_size), pagination_info
+    Returns:
+        str: URL safe cursor
+    """
+    tagged = []
+    for value in values:
+        for tag, (type_, dump, _) in _CURSOR_TYPES.items():
+            # datetime is a date subclass so it is checked first
+            if isinstance(value, type_):
+                value = {tag: dump(value)}
+                break
+        tagged.append(value)
+
+    raw = json.dumps(tagged, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, exc=DeserializationError):
+    """
+    Decode a cursor made by encode_cursor.
+
+    Args:
+        cursor (str): The cursor
+        exc (Exception subclass): Custom exception to raise if the cursor is
+            invalid, falls back to DeserializationError if none is provided
+
+    Returns:
+        list: Values of the order by columns of the last row of the previous page
+
+    Raises:
+        exc or DeserializationError: If the cursor cannot be decoded
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        tagged = json.loads(raw.decode())
+        if not isinstance(tagged, list):
+            raise ValueError('expected a list')
+
+        values = []
+        for value in tagged:
+            if isinstance(value, dict):
+                (tag, dumped), = value.items()
+                value = _CURSOR_TYPES[tag][2](dumped)
+            values.append(value)
+        return values
+    except (binascii.Error, KeyError, TypeError, ValueError, decimal.InvalidOperation) as ex:
+        raise exc('Error deserializing cursor: {}'.format(ex))
+
+
+def _order_columns(order_by):
+    """
+    Split order by clauses into (column, descending) pairs.
+    """
+    # sqlalchemy is only a requirement of the services paginating queries
+    from sqlalchemy.sql import operators
+    from sqlalchemy.sql.elements import UnaryExpression
+
+    columns = []
+    for clause in order_by:
+        if isinstance(clause, UnaryExpression) and clause.modifier in (operators.desc_op, operators.asc_op):
+            columns.append((clause.element, clause.modifier is operators.desc_op))
+        else:
+            columns.append((clause, False))
+    return columns
+
+
+def _keyset_filter(columns, values):
+    """
+    Build the filter selecting the rows after the given key.
+
+    For columns (a, b) ascending this is ``a > :a OR (a = :a AND b > :b)``,
+    which works for any mix of directions.
+    """
+    from sqlalchemy import and_, or_
+
+    clauses = []
+    for i, (column, descending) in enumerate(columns):
+        after = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[c == v for (c, _), v in zip(columns[:i], values)], after))
+    return or_(*clauses)
+
+
+def get_cursor_pagination_info(next_cursor, page_size, url_path=''):
+    """
+    Utility function for creating a dict of cursor pagination information.
+
+    Args:
+        next_cursor (str): Cursor of the next page, None on the last page
+        page_size (int): Number of results to display per page
+        url_path (str): Path of the URL the request was made to
+
+    Returns:
+        dict: Dict containing pagination information. The structure of this
+            dict should match the CursorPaginationSchema in schemas.py
+    """
+    if not next_cursor:
+        return {}
+
+    base_url = _link_base(url_path, page_size, CURSOR_PAGINATION_KEYS)
+    return {'next_page': '{}&{}'.format(base_url, urlencode({'cursor': next_cursor}))}
+
+
+def paginate_by_cursor(query, order_by, page_size, cursor=None, url_path='', exc=DeserializationError):
+    """
+    Take a sqlalchemy query and return the page after the cursor.
+
+    Rather than skipping rows with an offset the page is selected by the
+    key of the last row of the previous page, so every page costs the same
+    given an index on the order by columns. The order by columns must be
+    unique together and not nullable, e.g. (created_at, id).
+
+    Args:
+        query (sqlalchemy Query object): Query you wish to paginate
+        order_by (list): Columns to order by, optionally with .desc()
+        page_size (int): Number of results to return per page
+        cursor (str): Cursor from the previous page, None for the first page
+        url_path (str): url_path that the request was sent to, its query
+            parameters other than cursor and page_size are kept in the links
+        exc (Exception subclass): Custom exception to raise if the cursor is
+            invalid, falls back to DeserializationError if none is provided
+
+    Returns:
+        tuple: (list of rows of the page, dict of pagination info)
+
+    Raises:
+        exc or DeserializationError: If the cursor is invalid
+    """
+    columns = _order_columns(order_by)
+    query = query.order_by(*order_by)
+
+    if cursor:
+        values = decode_cursor(cursor, exc=exc)
+        if len(values) != len(columns):
+            raise exc('Error deserializing cursor: expected {} values'.format(len(columns)))
+        query = query.filter(_keyset_filter(columns, values))
+
+    # fetch one more row to know if there is a next page
+    rows = query.limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column, _ in columns])
+
+    return rows, get_cursor_pagination_info(next_cursor, page_size, url_path)
+
+
+def make_cursor_paginated_response(query, url_path, schema, order_by, page_size, cursor=None,
+                                   exc=DeserializationError):
+    """
+    Take a sqlalchemy query and paginate it by cursor based on the args provided.
+
+    Args:
+        query (sqlalchemy Query object): Query you wish to paginate
+        url_path (str): url_path that the request was sent to
+        schema (Schema): Subclass of marshmallow.Schema, with its pagination
+            info described by CursorPaginationSchema
+        order_by (list): Unique columns to order by, optionally with .desc()
+        page_size (int): Number of results to return per page
+        cursor (str): Cursor from the previous page, None for the first page
+        exc (Exception subclass): Custom exception to raise if the cursor is
+            invalid, falls back to DeserializationError if none is provided
+
+    Returns:
+        dict: The structure of which conforms to the thunderstorm API
+            spec response structure
+
+    Raises:
+        exc or DeserializationError: If the cursor is invalid
+        SerializationError: If serialization of the pagination info fails for any reason
+    """
+    rows, pagination_info = paginate_by_cursor(
+        query, order_by, page_size, cursor=cursor, url_path=url_path, exc=exc
+    )
+
+    # TODO: @will-norris backwards compat - remove
+    if MARSHMALLOW_2:
+        return schema_cache(schema).dump({'data': rows, **pagination_info}).data
+    else:
+        try:
+            return schema_cache(schema).dump({'data': rows, **pagination_info})
+        except ValidationError as vex:
+            raise SerializationError(('Error serializing pagination info: {}'.format(vex.messages)))
+
+
+def get_request_cursor_pagination(params=None, exc=DeserializationError):
+    """
+    Get cursor pagination params from a dict or flask's request.args.
+
+    Args:
+        params (dict): Dictionary with cursor and page_size keys, when not
+            provided request.args is used
+        exc (Exception subclass): Custom exception to raise if validation of
+            query params fails, falls back to DeserializationError if none is provided
+
+    Returns:
+        dict: with cursor and page_size keys
+
+    Raises:
+        exc or DeserializationError: If there are any marshmallow validation errors
+    """
+    if params is None:
+        params = request.args
+
+    # TODO: @will-norris backwards compat - remove
+    if MARSHMALLOW_2:
+        data, errors = schema_cache(CursorPaginationRequestSchema).load(params)
+        if errors:
+            raise exc('Error deserializing pagination options: {}'.format(errors))
+        return data
+    else:
+        try:
+            return schema_cache(CursorPaginationRequestSchema).load(params)
+        except ValidationError as vex:
+            raise exc('Error deserializing pagination options: {}'.format(vex.messages))
@@ -1,7 +1,7 @@
-from marshmallow import Schema, fields
+from marshmallow import fields, pre_dump, Schema
 from marshmallow.validate import Range
 
-from thunderstorm.flask.headers import rewrite_path
+from thunderstorm.flask.headers import rewrite_links
 
 
 class PaginationSchema(Schema):
@@ -9,15 +9,19 @@ class PaginationSchema(Schema):
     Schema for describing the structure of the dict containing pagination info.
     """
     next_page = fields.Function(
-        lambda obj: rewrite_path(obj['next_page']) if obj.get('next_page') else None,
+        lambda obj: obj.get('next_page') or None,
         required=False, dump_only=True, default=None, description='Next page uri'
     )
     prev_page = fields.Function(
-        lambda obj: rewrite_path(obj['prev_page']) if obj.get('prev_page') else None,
+        lambda obj: obj.get('prev_page') or None,
         required=False, dump_only=True, default=None, description='Previous page uri'
     )
     total_records = fields.Integer(required=False, dump_only=True, description='Total number of entries')
 
+    @pre_dump
+    def rewrite_links(self, obj, **kwargs):
+        return rewrite_links(obj, ('next_page', 'prev_page'))
+
 
 class PaginationRequestSchema(Schema):
     """
@@ -62,3 +66,32 @@ class PaginationSchemaV2(PaginationRequestSchemaV2):
     """
     items = fields.Integer(required=True, dump_only=True, description='Total number of entries')
     total_page = fields.Integer(required=True, dump_only=True, description='Total number of pages')
+
+
+class CursorPaginationRequestSchema(Schema):
+    """
+    Validate cursor pagination params on listing endpoints.
+    """
+    cursor = fields.String(
+        missing=None,
+        description='Opaque token from the next_page link of the previous page, omit for the first page'
+    )
+    page_size = fields.Integer(
+        validate=Range(min=1, max=1000),
+        missing=20,
+        description='Number of resources per page to display in the result. Defaults to 20'
+    )
+
+
+class CursorPaginationSchema(Schema):
+    """
+    Schema for describing the structure of the dict containing cursor pagination info.
+    """
+    next_page = fields.Function(
+        lambda obj: obj.get('next_page') or None,
+        required=False, dump_only=True, default=None, description='Next page uri'
+    )
+
+    @pre_dump
+    def rewrite_links(self, obj, **kwargs):
+        return rewrite_links(obj, ('next_page',))
@@ -1,8 +1,6 @@
-import base64
 import collections
+import functools
 import logging
-import zlib
-import json
 from typing import Any
 
 import faust
@@ -12,10 +10,13 @@ from faust.sensors.statsd import StatsdMonitor
 from faust.types import StreamT, TP, Message
 from kafka import KafkaProducer
 from kafka.errors import MessageSizeTooLargeError
+from kombu.utils import json as kombu_json
 from marshmallow import Schema, fields
 from marshmallow.exceptions import ValidationError
 from thunderstorm.logging import get_request_id
-from thunderstorm.shared import SchemaError, ts_task_name
+from thunderstorm.metrics import DEFAULT_BUCKETS, MetricsClient, MetricsRegistry, start_http_server
+from thunderstorm.registry import TRANSPORT_KAFKA, registry
+from thunderstorm.shared import compress_payload, decompress_payload, SchemaError, stat_name, topic_name
 from thunderstorm.logging.kafka import KafkaRequestIDFilter
 from thunderstorm.logging import get_log_level, ts_json_handler, ts_stream_handler
 
@@ -27,6 +28,31 @@ MARSHMALLOW_2 = int(marshmallow.__version__[0]) < 3
 Event = collections.namedtuple('Event', ['topic', 'schema'])
 
 
+@functools.lru_cache(maxsize=256)
+def _envelope_schema(schema, compression=False):
+    """Return the schema instance of the message envelope wrapping an event
+
+    Building the envelope schema class is expensive compared to using it, so
+    one instance is kept per event schema and compression setting.
+
+    Args:
+        schema (marshmallow.Schema): The event schema class
+        compression (boolean): Whether the data is compressed
+
+    Returns:
+        marshmallow.Schema: the envelope schema instance
+    """
+    class TSMessageSchema(Schema):
+        if compression:
+            data = fields.String(required=True)
+        else:
+            data = fields.Nested(schema)
+        trace_id = fields.String(required=False, default=None)
+        compressed = fields.Boolean(required=False, default=False)
+
+    return TSMessageSchema()
+
+
 class TSMessageSizeTooLargeError(MessageSizeTooLargeError):
     pass
 
@@ -49,24 +75,75 @@ class TSStatsdMonitor(StatsdMonitor):
         **kwargs: Any
     ) -> None:
         super().__init__(host=host, port=port, prefix=f'{prefix}.faust', rate=rate, **kwargs)
+        # stream labels by stream shortlabel, an app has a fixed set of streams
+        self._stream_labels = {}
 
     def _stream_label(self, stream: StreamT) -> str:
         """
         Enhance original _stream_label function
         it converts "topic_pos-week.fetch" -> "pos-week_fetch"
+
+        Labels are computed once per stream shortlabel
         """
-        label = super()._stream_label(stream=stream)
-        return label.replace('topic_', '').replace('.', '_')
+        try:
+            return self._stream_labels[stream.shortlabel]
+        except KeyError:
+            label = super()._stream_label(stream=stream)
+            label = self._stream_labels[stream.shortlabel] = label.replace('topic_', '').replace('.', '_')
+            return label
 
     def on_message_in(self, tp: TP, offset: int, message: Message) -> None:
         """Call before message is delegated to streams."""
         super(Monitor, self).on_message_in(tp, offset, message)
 
-        topic = tp.topic.replace('.', '_')
+        topic = topic_name(tp.topic)
         self.client.incr('messages_received', rate=self.rate)
         self.client.incr('messages_active', rate=self.rate)
-        self.client.incr(f'topic.{topic}.messages_received', rate=self.rate)
-        self.client.gauge(f'read_offset.{topic}.{tp.partition}', offset)
+        self.client.incr(stat_name('topic.{}.messages_received', topic), rate=self.rate)
+        self.client.gauge(stat_name('read_offset.{}.{}', topic, tp.partition), offset)
+
+
+class TSPrometheusMonitor(TSStatsdMonitor):
+    """
+    Keep the TSStatsdMonitor metrics in process and serve them for scraping
+
+    Every metric TSStatsdMonitor sends to statsd, as well as the ones sent by
+    ts_event and send_ts_event through `monitor.client`, is recorded in a
+    MetricsRegistry and served in the OpenMetrics text format on
+    http://<host>:<port>/ while the app is running.
+
+    Example:
+        app = TSKafka(..., monitor=TSPrometheusMonitor(port=9102))
+    """
+    # statsd counters which are decremented as well, exposed as gauges
+    GAUGE_STATS = ('messages_active', 'events_active', 'rebalances', 'rebalances_recovering')
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 9102,
+        prefix: str = 'x.faust',
+        buckets: tuple = DEFAULT_BUCKETS,
+        registry: MetricsRegistry = None,
+        **kwargs: Any
+    ) -> None:
+        self.registry = registry or MetricsRegistry(buckets=buckets)
+        self.server = None
+        super().__init__(host=host, port=port, prefix=prefix, **kwargs)
+
+    def _new_statsd_client(self) -> MetricsClient:
+        return MetricsClient(self.registry, prefix=self.prefix, gauge_stats=self.GAUGE_STATS)
+
+    async def on_start(self) -> None:
+        await super().on_start()
+        self.server = start_http_server(self.registry, host=self.host, port=self.port)
+
+    async def on_stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        await super().on_stop()
 
 
 class TSKafka(faust.App):
@@ -154,15 +231,7 @@ class TSKafka(faust.App):
         if compression:
             data = self._compress(data, event.schema)
 
-        class TSMessageSchema(Schema):
-            if compression:
-                data = fields.String(required=True)
-            else:
-                data = fields.Nested(event.schema)
-            trace_id = fields.String(required=False, default=None)
-            compressed = fields.Boolean(required=False, default=False)
-
-        schema = TSMessageSchema()
+        schema = _envelope_schema(event.schema, compression)
 
         # Marshmallow 2 compatibility - remove when no longer needed
         trace_id = get_request_id()
@@ -172,8 +241,9 @@ class TSKafka(faust.App):
 
             if errors:
                 error_msg = 'Error serializing queue message data.'
-                logging.error(error_msg, extra={'errors': errors, 'data': data, 'trace_id': trace_id})
-                raise SchemaError(error_msg, errors=errors, data=data)
+                schema_error = SchemaError(error_msg, errors=errors, data=data)
+                logging.error(error_msg, extra=dict(schema_error.log_extra(), trace_id=trace_id))
+                raise schema_error
             else:
                 data = serialized_data
 
@@ -181,22 +251,25 @@ class TSKafka(faust.App):
 
             if errors:
                 error_msg = f'Outbound schema validation error for event {event.topic}'
-                logging.error(error_msg, extra={'errors': errors, 'data': data})
-                raise SchemaError(error_msg, errors=errors, data=data)
+                schema_error = SchemaError(error_msg, errors=errors, data=data)
+                logging.error(error_msg, extra=schema_error.log_extra())
+                raise schema_error
         else:
             try:
                 data = schema.dumps(dumps_data)
             except ValidationError as vex:
                 error_msg = 'Error serializing queue message data'
-                logging.error(error_msg, extra={'errors': vex.messages, 'data': data, 'trace_id': trace_id})
-                raise SchemaError(error_msg, errors=vex.messages, data=data)
+                schema_error = SchemaError(error_msg, errors=vex.messages, data=data)
+                logging.error(error_msg, extra=dict(schema_error.log_extra(), trace_id=trace_id))
+                raise schema_error
 
             try:
                 schema.loads(data)
             except ValidationError as vex:
                 error_msg = f'Outbound schema validation error for event {event.topic}'
-                logging.error(error_msg, extra={'errors': vex.messages, 'data': data})
-                raise SchemaError(error_msg, errors=vex.messages, data=data)
+                schema_error = SchemaError(error_msg, errors=vex.messages, data=data)
+                logging.error(error_msg, extra=schema_error.log_extra())
+                raise schema_error
 
         return data.encode('utf-8')
 
@@ -214,16 +287,17 @@ class TSKafka(faust.App):
             to a particular resource get routed to the same partition. A value of
             None will cause messages to randomly sent to different partitions
         """
+        handle = registry.register(event.topic, event.schema, TRANSPORT_KAFKA)
         serialized = self.validate_data(data, event, compression)
-        topic_name = event.topic.replace('.', '_')
 
         if not self.kafka_producer:
             self.kafka_producer = self.get_kafka_producer()
 
         try:
             self.kafka_producer.send(event.topic, value=serialized, key=key)  # send takes raw bytes
+            handle.sent += 1
             if hasattr(self.monitor, 'client'):
-                self.monitor.client.incr(f'stream.{topic_name}.messages.sent')
+                self.monitor.client.incr(stat_name('stream.{}.messages.sent', topic_name(event.topic)))
         except MessageSizeTooLargeError as msex:
             raise TSMessageSizeTooLargeError(
                 f"The message is bytes when serialized which is larger than"
@@ -267,37 +341,31 @@ class TSKafka(faust.App):
             A decorator function
         """
         topic = event.topic
-        schema = event.schema()
-        topic_name = topic.replace('.', '_')
+        handle = registry.register(topic, event.schema, TRANSPORT_KAFKA)
+        validate = handle.validator(event.schema)
+        schema_errors = stat_name('stream.{}.schema.errors', topic_name(topic))
+        execution_errors = stat_name('stream.{}.execution.errors', topic_name(topic))
+        critical_errors = stat_name('stream.{}.critical.errors', topic_name(topic))
 
         def decorator(func):
             async def event_handler(stream):
                 # stream handling done in here, no need to do it inside the func
                 async for message in stream:
+                    handle.received += 1
                     ts_message = message.pop('data') or message
                     compression = message.pop('compressed', False)
                     if compression:
-                        ts_message = zlib.decompress(base64.b64decode(ts_message.encode()))
-                        load_func = schema.loads
-                    else:
-                        load_func = schema.load
-                    if MARSHMALLOW_2:
-                        deserialized_data, errors = load_func(ts_message)
-                        if errors:
-                            if hasattr(self.monitor, 'client'):
-                                self.monitor.client.incr(f'stream.{topic_name}.schema.errors')
-                            error_msg = f'Inbound schema validation error for event {topic}'
-                            logging.error(error_msg, extra={'errors': errors, 'data': ts_message})
-                            raise SchemaError(error_msg, errors=errors, data=ts_message)
-                    else:
-                        try:
-                            deserialized_data = load_func(ts_message)
-                        except ValidationError as vex:
-                            if hasattr(self.monitor, 'client'):
-                                self.monitor.client.incr(f'stream.{topic_name}.schema.errors')
-                            error_msg = f'Inbound schema validation error for event {topic}'
-                            logging.error(error_msg, extra={'errors': vex.messages, 'data': ts_message})
-                            raise SchemaError(error_msg, errors=vex.messages, data=ts_message)
+                        ts_message = decompress_payload(ts_message, compression)
+
+                    deserialized_data, errors = validate(ts_message)
+                    if errors:
+                        handle.errors += 1
+                        if hasattr(self.monitor, 'client'):
+                            self.monitor.client.incr(schema_errors)
+                        error_msg = f'Inbound schema validation error for event {topic}'
+                        schema_error = SchemaError(error_msg, errors=errors, data=ts_message)
+                        logging.error(error_msg, extra=schema_error.log_extra())
+                        raise schema_error
 
                     logging.debug(f'received ts_event on {topic}')
 
@@ -305,20 +373,20 @@ class TSKafka(faust.App):
                         yield await func(deserialized_data)
                     except catch_exc as ex:
                         if hasattr(self.monitor, 'client'):
-                            self.monitor.client.incr(f'stream.{topic_name}.execution.errors')
+                            self.monitor.client.incr(execution_errors)
                         logging.error(ex)
                         if self.sentry:
                             sentry_sdk.capture_exception(ex)
                         yield
                     except Exception as ex:  # catch all exceptions to avoid worker failure and restart
                         if hasattr(self.monitor, 'client'):
-                            self.monitor.client.incr(f'stream.{topic_name}.critical.errors')
+                            self.monitor.client.incr(critical_errors)
                         logging.critical(ex)
                         if self.sentry:
                             sentry_sdk.capture_exception(ex)
                         yield
 
-            return self.agent(topic, name=f'thunderstorm.messaging.{ts_task_name(topic)}')(event_handler)
+            return self.agent(topic, name=f'thunderstorm.messaging.{handle.task_name}')(event_handler)
 
         return decorator
 
@@ -326,7 +394,7 @@ class TSKafka(faust.App):
     @classmethod
     def _compress(cls, data, schema):
         if MARSHMALLOW_2:
-            compress_data = zlib.compress(json.dumps(data).encode())
+            raw = kombu_json.dumps(data)
         else:
-            compress_data = zlib.compress(schema().dumps(data).encode())
-        return base64.b64encode(compress_data).decode()
+            raw = schema().dumps(data)
+        return compress_payload(raw.encode())
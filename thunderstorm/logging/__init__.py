@@ -1,20 +1,25 @@
 import uuid
 import logging
 import datetime
+import contextvars
 from pythonjsonlogger.jsonlogger import JsonFormatter as BaseJSONFormatter
 """ You probably do not want to use this directly.
 See:
     thunderstorm.logging.flask
     thunderstorm.logging.celery
     thunderstorm.logging.kafka
+    thunderstorm.asgi
 """
 
 __all__ = [
-    'get_request_id', 'ts_json_handler', 'ts_stream_handler', 'JSONFormatter'
+    'get_request_id', 'request_id_from_headers', 'reset_request_id', 'set_request_id',
+    'ts_json_handler', 'ts_stream_handler', 'JSONFormatter'
 ]
 
 
 _REQUEST_ID_GETTERS = []
+# request ID of the current context, a thread or an asyncio task
+_REQUEST_ID = contextvars.ContextVar('ts_request_id', default=None)
 TS_REQUEST_ID = 'TS-Request-ID'
 TS_LOGGER_FORMAT_STR = '%(asctime)s %(levelname)s %(traceId)s %(process)d {}'.format(
     '%(thread)d %(pathname)s:%(lineno)d %(message)s'
@@ -48,13 +53,49 @@ def gen_trace_id():
     return _trace_id.replace('-', '')
 
 
+def request_id_from_headers(headers):
+    """Return the request ID sent in the headers of a request or a new one
+
+    Args:
+        headers (Mapping): Request headers, with case insensitive keys or
+            lowercase ones
+
+    Returns:
+        str: the request ID
+    """
+    return headers.get(TS_REQUEST_ID) or headers.get(TS_REQUEST_ID.lower()) or gen_trace_id()
+
+
+def set_request_id(request_id):
+    """Set the request ID of the current context
+
+    Unlike thread locals this works for asyncio tasks handling requests
+    concurrently in one thread. Reset it with the returned token once the
+    request is handled.
+
+    Returns:
+        contextvars.Token
+    """
+    return _REQUEST_ID.set(request_id)
+
+
+def reset_request_id(token):
+    _REQUEST_ID.reset(token)
+
+
+def get_context_request_id():
+    """Return the request ID set for the current context, or None"""
+    return _REQUEST_ID.get()
+
+
 def get_request_id():
     """Return the current request ID
 
     Return the current request ID from whichever ID getters have been
     registered. An ID getter is registered when it's module is included.
     For example; if the ``thunderstorm.logging.flask`` module is imported
-    the ``get_flask_request_id`` is registered.
+    the ``get_flask_request_id`` is registered. The ID set with
+    ``set_request_id`` for the current context is returned first.
 
     Returns:
         str the current request ID
@@ -67,6 +108,9 @@ def get_request_id():
     return gen_trace_id()
 
 
+_register_id_getter(get_context_request_id)
+
+
 def ts_json_handler(ts_log_type, ts_service, ts_filter):
     """Create an json handler"""
     stream_handler = logging.StreamHandler()
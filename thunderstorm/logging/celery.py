@@ -10,16 +10,19 @@ Usage:
 import celery
 import logging
 from celery import Task as CeleryTask
-from celery.signals import setup_logging
+from celery.signals import setup_logging, task_postrun, task_prerun
 from celery._state import get_current_task
 
 from . import (
-    _register_id_getter, get_log_level, get_request_id,
-    setup_ts_logger, ts_json_handler, ts_stream_handler, TS_REQUEST_ID
+    _register_id_getter, get_log_level, get_request_id, reset_request_id,
+    set_request_id, setup_ts_logger, ts_json_handler, ts_stream_handler, TS_REQUEST_ID
 )
 
 __all__ = ['init_app', 'TSCeleryTask']
 
+# tokens of the request IDs set for the running tasks by task ID
+_REQUEST_ID_TOKENS = {}
+
 
 class TSCeleryTask(CeleryTask):
     """Celery Task that adds request ID header
@@ -103,4 +106,26 @@ def init_app(
     setup_logging.connect(_setup_logger(), weak=False)
 
 
+@task_prerun.connect
+def _set_task_request_id(task_id=None, task=None, **kwargs):
+    """Set the request ID of the task for its context
+
+    Worker threads, and on python 3.6 the contextvars backport, do not give
+    each task a context of its own, so a request ID set while a task runs
+    would be seen by the next task of the thread. The request ID is set
+    before every task, None if it was sent without one, and reset after it.
+    """
+    request = task.request
+    # workers merge the message headers into the request, eager tasks keep them apart
+    request_id = request.get(TS_REQUEST_ID) or (request.headers or {}).get(TS_REQUEST_ID)
+    _REQUEST_ID_TOKENS[task_id] = set_request_id(request_id)
+
+
+@task_postrun.connect
+def _reset_task_request_id(task_id=None, **kwargs):
+    token = _REQUEST_ID_TOKENS.pop(task_id, None)
+    if token is not None:
+        reset_request_id(token)
+
+
 _register_id_getter(get_celery_request_id)
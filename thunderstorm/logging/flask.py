@@ -12,8 +12,8 @@ from flask import g, request, Flask
 from flask.ctx import has_request_context
 
 from . import (
-    _register_id_getter, get_log_level, get_request_id,
-    setup_ts_logger, ts_json_handler, ts_stream_handler, TS_REQUEST_ID
+    _register_id_getter, get_log_level, get_request_id, request_id_from_headers, reset_request_id,
+    set_request_id, setup_ts_logger, ts_json_handler, ts_stream_handler, TS_REQUEST_ID
 )
 
 __all__ = ['init_app']
@@ -77,7 +77,14 @@ def init_app(
 
     @flask_app.before_request
     def before_request():
-        g.request_id = get_request_id()
+        g.request_id = request_id_from_headers(request.headers)
+        # for the helpers which do not know about Flask
+        g.request_id_token = set_request_id(g.request_id)
+
+    @flask_app.teardown_request
+    def teardown_request(exc):
+        if 'request_id_token' in g:
+            reset_request_id(g.pop('request_id_token'))
 
     @flask_app.after_request
     def after_request(response):
@@ -1,21 +1,66 @@
 """Thunderstorm messaging helpers"""
 import collections
-
+import inspect
+import lzma
+import random
+import time
+import weakref
+import zlib
+
+from celery.backends.base import DisabledBackend
+from celery.signals import celeryd_after_setup
 from celery.utils.log import get_task_logger
 from celery import current_app, shared_task
+from kombu.utils import json as kombu_json
+from marshmallow import fields
 from marshmallow.exceptions import ValidationError
 from statsd.defaults.env import statsd
 
-from thunderstorm.shared import SchemaError, ts_task_name
+from thunderstorm.registry import TRANSPORT_CELERY, registry
+from thunderstorm.shared import (  # noqa: F401 - ts_task_name is part of this module's API
+    COMPRESSION_CODECS, SchemaError, compress_payload, decompress_payload, stat_name, ts_task_name
+)
+
 
+try:
+    from celery_batches import Batches
+except ImportError:  # pragma: no cover
+    Batches = None
 
 import marshmallow  # TODO: @will-norris backwards compat - remove
 MARSHMALLOW_2 = int(marshmallow.__version__[0]) < 3
 
 logger = get_task_logger(__name__)
 
+# send_ts_task validation policies
+VALIDATION_FULL = 'full'
+VALIDATION_DUMP_ONLY = 'dump'
+VALIDATION_SAMPLED = 'sampled'
+VALIDATION_POLICIES = (VALIDATION_FULL, VALIDATION_DUMP_ONLY, VALIDATION_SAMPLED)
+DEFAULT_VALIDATION_SAMPLE_RATE = 0.01
+DEFAULT_TIMING_SAMPLE_RATE = 0.1
+# payloads are only compressed from this size in bytes of their JSON encoding
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+# schemas given to lazy ts_tasks, split into eager and nested fields
+_LAZY_SCHEMAS = weakref.WeakKeyDictionary()
+
+# many=True copies of the schemas given to send_ts_tasks
+_MANY_SCHEMAS = weakref.WeakKeyDictionary()
+
+# send_ts_task options read from the config of each Celery app
+_SEND_OPTIONS = weakref.WeakKeyDictionary()
+_SendOptions = collections.namedtuple('SendOptions', [
+    'validation', 'validation_rate', 'timing_rate', 'compression', 'compression_threshold', 'routing'
+])
+
+# routing policy given to each ts_task by event name, None if not given
+_TS_TASK_ROUTING = {}
+
 
 class TSMessage(collections.abc.Mapping):
+    __slots__ = ('data', 'metadata')
+
     def __init__(self, data, metadata):
         self.data = data
         self.metadata = metadata
@@ -30,7 +75,61 @@ class TSMessage(collections.abc.Mapping):
         return iter(self.data)
 
 
-def ts_task(event_name, schema, bind=False, **options):
+class LazyTSMessage(TSMessage):
+    """TSMessage deserializing its nested fields on first access
+
+    Fields which are not nested are loaded when the message is received.
+    Nested fields are only checked then to be objects, or lists of objects,
+    with their required keys, and are kept raw until they are read. They
+    are then deserialized once and cached. Reading ``data`` loads all
+    remaining fields. The field validators and the hooks of a nested schema,
+    e.g. post_load or validates_schema, run when its field is loaded, so a
+    nested field never read is never fully validated.
+    """
+    __slots__ = ('_loaded', '_raw', '_lazy_fields')
+
+    def __init__(self, loaded, raw, lazy_fields, metadata):
+        self._loaded = loaded
+        self._raw = raw
+        self._lazy_fields = lazy_fields
+        self.metadata = metadata
+
+    @property
+    def data(self):
+        for key in list(self._raw):
+            self._load_field(key)
+        return self._loaded
+
+    def _load_field(self, key):
+        raw = self._raw[key]
+        try:
+            value = self._lazy_fields[key].deserialize(raw, key, self._raw)
+        except ValidationError as vex:
+            error_msg = 'inbound schema validation error for field {}'.format(key)
+            raise SchemaError(error_msg, errors={key: vex.messages}, data=raw)
+
+        self._loaded[key] = value
+        del self._raw[key]
+        return value
+
+    def __getitem__(self, key):
+        try:
+            return self._loaded[key]
+        except KeyError:
+            if key in self._raw:
+                return self._load_field(key)
+            raise
+
+    def __len__(self):
+        return len(self._loaded) + len(self._raw)
+
+    def __iter__(self):
+        return iter(list(self._loaded) + list(self._raw))
+
+
+def ts_task(
+    event_name, schema, bind=False, batch_size=None, batch_interval=None, lazy=False, routing=None, **options
+):
     """Decorator for Thunderstorm messaging tasks
 
     The task name is derived from the event name.
@@ -42,17 +141,64 @@ def ts_task(event_name, schema, bind=False, **options):
         def handle_domain_action_request(message):
             # do something with validated message
 
+    Batch mode:
+        If batch_size or batch_interval is given, messages are buffered on
+        the worker and the task is called with a list of messages once
+        batch_size messages are buffered or batch_interval seconds have
+        passed. The buffered messages are validated in a single many=True
+        load, messages failing validation are reported one by one and left
+        out of the list. This requires ``pip install thunderstorm-library[batches]``
+        and ``worker_prefetch_multiplier`` set high enough for the worker to
+        buffer batch_size messages, see celery_batches.Batches.
+
+        @ts_task('domain.action.request', schema=DomainActionRequestSchema(), batch_size=100)
+        def handle_domain_action_requests(messages):
+            # do something with the list of validated messages
+
+    Lazy mode:
+        With lazy=True the task receives a LazyTSMessage. Fields which are
+        not nested are validated and loaded before the task is called, and
+        nested fields are checked to be objects, or lists of objects, with
+        their required keys, at any depth. Nested field values are
+        deserialized when first read, raising SchemaError if they are
+        invalid, and then cached. Schema level hooks (validates_schema, post_load...) of the
+        task's schema are not run in lazy mode, and those of the nested
+        schemas run only when their field is accessed, not up front.
+
+    Routing:
+        If the event has a routing policy, given with routing or in the
+        ``TS_TASK_ROUTING`` Celery config, the worker also consumes the
+        queues the policy routes tasks to (shards, overflow queue...).
+        See thunderstorm.routing.
+
     Args:
         event_name (str): The event name (this is also the routing key)
         schema (marshmallow.Schema): The schema instance expected by this task
         bind (bool): if the task is bound
+        batch_size (int): Flush buffered messages to the task after this many
+        batch_interval (float): Flush buffered messages after this many seconds
+        lazy (bool): Deserialize nested fields on first access
+        routing (thunderstorm.routing.RoutingPolicy): Routing policy of the event
         options (dict): extra options to be passed to the shared_task decorator
 
+    Raises:
+        ImportError: If batch mode is used without celery_batches installed
+        ValueError: If batch or lazy mode is used with a many=True schema
+
     Returns:
         A decorator function
     """
+    _TS_TASK_ROUTING[event_name] = routing
+
+    if batch_size is not None or batch_interval is not None:
+        return _ts_batch_task(event_name, schema, bind, batch_size, batch_interval, **options)
+    if lazy and schema.many:
+        raise ValueError('ts_task lazy mode expects the schema of a single message')
+
     def decorator(task_func):
-        task_name = ts_task_name(event_name)
+        handle = registry.register(event_name, schema, TRANSPORT_CELERY)
+        task_name = handle.task_name
+        validate = handle.validator(schema)
 
         def task_handler(*args):
             """
@@ -78,45 +224,377 @@ def ts_task(event_name, schema, bind=False, **options):
                 raise NotImplementedError('Maximum 2 parameters allowed for ts_task decorator')
 
         def _task_handler(self=None, message=None):
-            ts_message = TSMessage(message.pop('data'), message)
-
-            # TODO: @will-norris backwards compat - remove
-            if MARSHMALLOW_2:
-                deserialized_data, errors = schema.load(ts_message)
-                if errors:
-                    statsd.incr('tasks.{}.ts_task.errors.schema'.format(task_name))
-                    error_msg = 'inbound schema validation error for event {}'.format(event_name)
-                    logger.error(error_msg, extra={'errors': errors, 'data': ts_message})
-                    raise SchemaError(error_msg, errors=errors, data=ts_message)
-                else:
-                    logger.info('received ts_task on {}'.format(event_name))
-                    ts_message.data = deserialized_data
-                    # passing task_func instead of passing self - @will-norris
-                    return task_func(self, ts_message) if bind else task_func(ts_message)
-            else:
-                try:
-                    deserialized_data = schema.load(ts_message)
-                except ValidationError as vex:
-                    statsd.incr('tasks.{}.ts_task.errors.schema'.format(task_name))
-                    error_msg = 'inbound schema validation error for event {}'.format(event_name)
-                    logger.error(error_msg, extra={'errors': vex.messages, 'data': ts_message})
-                    raise SchemaError(error_msg, errors=vex.messages, data=ts_message)
-                else:
-                    logger.info('received ts_task on {}'.format(event_name))
-                    ts_message.data = deserialized_data
-                    # passing task_func instead of passing self - @will-norris
-                    return task_func(self, ts_message) if bind else task_func(ts_message)
+            if lazy:
+                return _lazy_task_handler(self=self, message=message)
+
+            handle.received += 1
+            ts_message = TSMessage(_unwrap(message, event_name), message)
+
+            deserialized_data, errors = validate(ts_message)
+            if errors:
+                handle.errors += 1
+                statsd.incr(stat_name('tasks.{}.ts_task.errors.schema', task_name))
+                error_msg = 'inbound schema validation error for event {}'.format(event_name)
+                schema_error = SchemaError(error_msg, errors=errors, data=ts_message)
+                logger.error(error_msg, extra=schema_error.log_extra())
+                raise schema_error
+
+            logger.info('received ts_task on {}'.format(event_name))
+            ts_message.data = deserialized_data
+            # passing task_func instead of passing self - @will-norris
+            return task_func(self, ts_message) if bind else task_func(ts_message)
+
+        def _lazy_task_handler(self=None, message=None):
+            handle.received += 1
+            ts_message, errors = _load_lazy(schema, _unwrap(message, event_name), message)
+            if errors:
+                handle.errors += 1
+                statsd.incr(stat_name('tasks.{}.ts_task.errors.schema', task_name))
+                error_msg = 'inbound schema validation error for event {}'.format(event_name)
+                schema_error = SchemaError(error_msg, errors=errors, data=ts_message)
+                logger.error(error_msg, extra=schema_error.log_extra())
+                raise schema_error
+
+            logger.info('received ts_task on {}'.format(event_name))
+            return task_func(self, ts_message) if bind else task_func(ts_message)
 
         return shared_task(bind=bind, name=task_name, **options)(task_handler)
 
     return decorator
 
 
-def send_ts_task(event_name, schema, data, **kwargs):
+@celeryd_after_setup.connect
+def _consume_routed_queues(sender, instance, **kwargs):
+    """Make the worker consume the queues of the ts_tasks' routing policies"""
+    app = instance.app
+    configured = _send_options(app).routing
+    for event_name, routing in _TS_TASK_ROUTING.items():
+        routing = routing or configured.get(event_name)
+        if routing is None:
+            continue
+        for queue in routing.queues(event_name):
+            app.amqp.queues.select_add(queue)
+
+
+def _is_nested(field):
+    """Return True for Nested fields and lists of Nested fields"""
+    # marshmallow 3 names the list item field inner, marshmallow 2 container
+    inner = getattr(field, 'inner', None) or getattr(field, 'container', None)
+    return isinstance(field, fields.Nested) or (
+        isinstance(field, fields.List) and isinstance(inner, fields.Nested)
+    )
+
+
+# the constructor options of marshmallow schemas, kept as attributes of the same name
+_SCHEMA_OPTIONS = tuple(
+    name for name, param in inspect.signature(marshmallow.Schema.__init__).parameters.items()
+    if name != 'self' and param.kind not in (param.VAR_POSITIONAL, param.VAR_KEYWORD)
+)
+
+
+def _copy_schema(schema, **overrides):
+    """Return a new instance of a schema with every option of the instance, e.g. unknown, but the overrides"""
+    options = {name: getattr(schema, name) for name in _SCHEMA_OPTIONS if hasattr(schema, name)}
+    options.update(overrides)
+    return schema.__class__(**options)
+
+
+def _lazy_schema(schema):
+    """Split a schema into one for its eagerly loaded fields and its nested fields
+
+    Returns:
+        tuple: (schema without nested fields, {name: (input key, nested field)})
+    """
+    split = _LAZY_SCHEMAS.get(schema)
+    if split is None:
+        nested = {
+            name: (_input_key(name, field), field)
+            for name, field in schema.fields.items()
+            if _is_nested(field) and not field.dump_only
+        }
+        eager_schema = _copy_schema(schema, exclude=set(schema.exclude) | set(nested))
+        split = _LAZY_SCHEMAS[schema] = (eager_schema, nested)
+    return split
+
+
+def _input_key(name, field):
+    """Return the key of a field in the loaded data"""
+    # TODO: @will-norris backwards compat - remove, marshmallow 2 names data_key load_from
+    return getattr(field, 'data_key', None) or getattr(field, 'load_from', None) or name
+
+
+def _is_partial(schema, name):
+    partial = getattr(schema, 'partial', None)
+    return partial is True or bool(partial) and name in partial
+
+
+def _required_errors(schema, data):
+    """Return the errors of raw data which is not an object with the required keys of a schema
+
+    Only the keys are checked, at any depth of nested fields, not their values.
+    """
+    if not isinstance(data, collections.abc.Mapping):
+        return {'_schema': ['Invalid input type.']}
+
+    errors = {}
+    for name, field in schema.fields.items():
+        if field.dump_only:
+            continue
+        key = _input_key(name, field)
+        if key not in data:
+            if field.required and not _is_partial(schema, name):
+                errors[name] = ['Missing data for required field.']
+        elif _is_nested(field):
+            nested_errors = _nested_errors(field, data[key])
+            if nested_errors:
+                errors[name] = nested_errors
+    return errors
+
+
+def _nested_errors(field, value):
+    """Return the errors of the raw value of a nested field, see _required_errors, or None"""
+    if value is None:
+        return None if field.allow_none else ['Field may not be null.']
+
+    if isinstance(field, fields.Nested):
+        nested, many = field, field.many
+    else:
+        # TODO: @will-norris backwards compat - remove, marshmallow 2 names inner container
+        nested, many = getattr(field, 'inner', None) or field.container, True
+
+    if not many:
+        return _required_errors(nested.schema, value) or None
+    if not isinstance(value, (list, tuple)):
+        return ['Not a valid list.']
+    errors = {}
+    for index, item in enumerate(value):
+        item_errors = _required_errors(nested.schema, item)
+        if item_errors:
+            errors[index] = item_errors
+    return errors or None
+
+
+def _load_lazy(schema, data, metadata):
+    """Load the eager part of a payload into a LazyTSMessage
+
+    Returns:
+        tuple: (LazyTSMessage or TSMessage of the raw data, errors or None)
+    """
+    if not isinstance(data, collections.abc.Mapping):
+        return TSMessage(data, metadata), {'_schema': ['Invalid input type.']}
+
+    eager_schema, nested = _lazy_schema(schema)
+    raw, lazy_fields, errors = {}, {}, {}
+    for name, (key, field) in nested.items():
+        if key in data:
+            nested_errors = _nested_errors(field, data[key])
+            if nested_errors:
+                errors[name] = nested_errors
+            raw[name] = data[key]
+            lazy_fields[name] = field
+        elif field.required and not _is_partial(schema, name):
+            errors[name] = ['Missing data for required field.']
+
+    nested_keys = {key for key, _ in nested.values()}
+    loaded, eager_errors = _load(eager_schema, {k: v for k, v in data.items() if k not in nested_keys})
+    if eager_errors:
+        errors.update(eager_errors)
+    if errors:
+        return TSMessage(data, metadata), errors
+
+    return LazyTSMessage(loaded, raw, lazy_fields, metadata), None
+
+
+def _envelope(data, codec, threshold):
+    """Wrap dumped data in the message envelope, compressing it if large enough
+
+    The data is encoded like kombu encodes uncompressed messages, so UUIDs,
+    datetimes and decimals, e.g. in a Dict field, are serialized either way.
+    """
+    if codec:
+        raw = kombu_json.dumps(data).encode()
+        if len(raw) >= threshold:
+            return {'data': compress_payload(raw, codec), 'compressed': codec}
+    return {'data': data}
+
+
+def _unwrap(message, event_name):
+    """Pop the data out of a message envelope, decompressing it if needed"""
+    data = message.pop('data')
+    codec = message.pop('compressed', None)
+    if not codec:
+        return data
+
+    try:
+        return decompress_payload(data, codec)
+    except (ValueError, TypeError, AttributeError, OSError, zlib.error, lzma.LZMAError) as ex:
+        error_msg = 'inbound payload decompression error for event {}'.format(event_name)
+        raise SchemaError(error_msg, errors={'data': [str(ex)]}, data=None)
+
+
+def _compression(compression, compression_threshold, options):
+    """Return the codec and threshold to use from the arguments or the options"""
+    codec = options.compression if compression is None else compression
+    if codec and codec not in COMPRESSION_CODECS:
+        raise ValueError('Unknown compression codec {}, expected one of {}'.format(
+            codec, ', '.join(sorted(COMPRESSION_CODECS))
+        ))
+    if compression_threshold is None:
+        compression_threshold = options.compression_threshold
+    return codec, compression_threshold
+
+
+def _dump(schema, data):
+    """Serialize data with the schema, raising SchemaError on failure"""
+    # TODO: @will-norris backwards compat - remove
+    if MARSHMALLOW_2:
+        return schema.dump(data).data
+
+    try:
+        return schema.dump(data)
+    except ValidationError as vex:
+        error_msg = 'Error serializing queue message data'
+        raise SchemaError(error_msg, errors=vex.messages, data=data)
+
+
+def _load(schema, data):
+    """Deserialize data with the schema
+
+    Returns:
+        tuple: (deserialized data, errors or None)
+    """
+    # TODO: @will-norris backwards compat - remove
+    if MARSHMALLOW_2:
+        return schema.load(data)
+
+    try:
+        return schema.load(data), None
+    except ValidationError as vex:
+        return None, vex.messages
+
+
+def _send_options(app):
+    """Return the send_ts_task options of a Celery app
+
+    Looking up Celery settings is slow compared to publishing a small task,
+    so the options are only read from the config once per app.
+    """
+    options = _SEND_OPTIONS.get(app)
+    if options is None:
+        options = _SEND_OPTIONS[app] = _SendOptions(
+            validation=app.conf.get('TS_TASK_VALIDATION', VALIDATION_FULL),
+            validation_rate=app.conf.get('TS_TASK_VALIDATION_SAMPLE_RATE', DEFAULT_VALIDATION_SAMPLE_RATE),
+            timing_rate=app.conf.get('TS_TASK_TIMING_SAMPLE_RATE', DEFAULT_TIMING_SAMPLE_RATE),
+            compression=app.conf.get('TS_TASK_COMPRESSION', None),
+            compression_threshold=app.conf.get('TS_TASK_COMPRESSION_THRESHOLD', DEFAULT_COMPRESSION_THRESHOLD),
+            routing=app.conf.get('TS_TASK_ROUTING', None) or {},
+        )
+    return options
+
+
+def _route(event_name, data, routing, app, options):
+    """Return the routing_key and priority options to publish a task with"""
+    route = {'routing_key': event_name}
+    routing = routing or options.routing.get(event_name)
+    if routing is not None:
+        route.update(routing.route(event_name, data, app))
+    return route
+
+
+def _should_validate(validation, options):
+    """Return True if the dumped payload must be loaded back for validation"""
+    if validation == VALIDATION_FULL:
+        return True
+    elif validation == VALIDATION_DUMP_ONLY:
+        return False
+    elif validation == VALIDATION_SAMPLED:
+        return random.random() < options.validation_rate  # nosec - sampling, not security related
+    else:
+        raise ValueError('Unknown validation policy {}, expected one of {}'.format(
+            validation, ', '.join(VALIDATION_POLICIES)
+        ))
+
+
+def _report_timings(stat_prefix, timings, rate):
+    """Send the stage timings of a sample of calls to statsd in one packet"""
+    if random.random() >= rate:  # nosec - sampling, not security related
+        return
+
+    with statsd.pipeline() as pipe:
+        for stage, seconds in timings:
+            pipe.timing(stat_name('{}.{}', stat_prefix, stage), seconds * 1000)
+
+
+def _dump_and_validate(event_name, schema, data, validation, options, stat_prefix, timings):
+    """Dump the payload and validate it according to the validation policy
+
+    The time spent in each stage is appended to timings.
+
+    Returns:
+        The dumped payload
+    """
+    started = time.perf_counter()
+    data = _dump(schema, data)
+    timings.append(('dump', time.perf_counter() - started))
+
+    if _should_validate(validation, options):
+        started = time.perf_counter()
+        loaded, errors = _load(schema, data)
+        timings.append(('validate', time.perf_counter() - started))
+
+        if errors:
+            statsd.incr(stat_name('{}.errors.schema', stat_prefix))
+            error_msg = 'Outbound schema validation error for event {}'.format(event_name)  # noqa
+            schema_error = SchemaError(error_msg, errors=errors, data=data)
+            logger.error(error_msg, extra=schema_error.log_extra())
+            raise schema_error
+
+        # TODO: @will-norris backwards compat - remove
+        if MARSHMALLOW_2:
+            data = loaded
+
+    return data
+
+
+def send_ts_task(
+    event_name, schema, data, validation=None, compression=None, compression_threshold=None, routing=None, **kwargs
+):
     """Send a Thunderstorm messaging event
 
     The correct task name is derived from the event name.
 
+    The payload is always dumped with the schema. Whether it is then loaded
+    back to validate it depends on the validation policy:
+
+    * ``full``: every payload is loaded back (the default), so it is
+      validated twice, here and by ts_task
+    * ``dump``: payloads are only dumped, no validation, serialization only.
+      Under marshmallow 3 dumping does not validate, so invalid payloads,
+      e.g. missing required fields, are published. Each payload is then
+      validated once, by ts_task, which has to load it to deserialize it
+      and cannot load without validating
+    * ``sampled``: a fraction of payloads is loaded back, the fraction is
+      set by ``TS_TASK_VALIDATION_SAMPLE_RATE`` in the Celery config
+
+    The default policy can be set with ``TS_TASK_VALIDATION`` in the Celery
+    config, which is read on the first send.
+
+    The time spent dumping, validating and publishing is reported to statsd
+    as ``tasks.<task_name>.send_ts_task.<stage>`` for a sample of the calls,
+    the fraction is set by ``TS_TASK_TIMING_SAMPLE_RATE`` (0.1 by default).
+
+    Payloads can be compressed with one of COMPRESSION_CODECS. The codec is
+    set per call or with ``TS_TASK_COMPRESSION`` in the Celery config and
+    only payloads whose JSON encoding is at least the threshold in bytes
+    are compressed (``TS_TASK_COMPRESSION_THRESHOLD``, 1024 by default).
+    Compressed payloads are sent base64 encoded in the envelope data, with
+    the codec in its ``compressed`` key. ts_task decompresses them.
+
+    Tasks are published with the event name as routing key unless the event
+    has a routing policy, given per call or per event name in the
+    ``TS_TASK_ROUTING`` Celery config. The policy can change the routing key
+    and set the priority of each task, see thunderstorm.routing.
+
     Example:
         send_ts_task(
             'domain.action.request', DomainActionRequestSchema(),
@@ -128,9 +606,16 @@ def send_ts_task(event_name, schema, data, **kwargs):
         schema (marshmallow.Schema): The schema instance the payload must
                                      comply to
         data (dict or list): The event data to be emitted (does not need to be serialized yet)
+        validation (str): Validation policy overriding the configured one
+        compression (str): Compression codec overriding the configured one,
+                           False disables compression
+        compression_threshold (int): Minimum size in bytes to compress
+        routing (thunderstorm.routing.RoutingPolicy): Routing policy overriding
+                                                       the configured one
 
     Raises:
         SchemaError If schema validation fails.
+        ValueError If the validation policy or compression codec is unknown.
 
     Returns:
         The result of the send_task call.
@@ -138,55 +623,280 @@ def send_ts_task(event_name, schema, data, **kwargs):
 
     if {'name', 'args', 'exchange', 'routing_key'} & set(kwargs.keys()):
         raise ValueError('Cannot override name, args, exchange or routing_key')
-    task_name = ts_task_name(event_name)
+    handle = registry.register(event_name, schema, TRANSPORT_CELERY)
+    task_name = handle.task_name
+    app = current_app._get_current_object()
+    options = _send_options(app)
+    validation = validation or options.validation
+    codec, threshold = _compression(compression, compression_threshold, options)
+    stat_prefix = stat_name('tasks.{}.send_ts_task', task_name)
+    timings = []
+
+    data = _dump_and_validate(event_name, schema, data, validation, options, stat_prefix, timings)
+    route = _route(event_name, data, routing, app, options)
+
+    logger.info('send_ts_task on {}'.format(event_name))
+    started = time.perf_counter()
+    event = _envelope(data, codec, threshold)
+    if codec:
+        timings.append(('compress', time.perf_counter() - started))
+
+    started = time.perf_counter()
+    result = app.send_task(
+        task_name,
+        (event,),
+        exchange='ts.messaging',
+        # an explicit priority takes precedence over the routing policy's
+        **dict(route, **kwargs)
+    )
+    timings.append(('publish', time.perf_counter() - started))
+    handle.sent += 1
+
+    _report_timings(stat_prefix, timings, options.timing_rate)
+
+    return result
+
+
+def _many_schema(schema):
+    """Return a many=True copy of a schema instance, created once per instance"""
+    many_schema = _MANY_SCHEMAS.get(schema)
+    if many_schema is None:
+        many_schema = _MANY_SCHEMAS[schema] = _copy_schema(schema, many=True)
+    return many_schema
+
+
+def send_ts_tasks(
+    event_name, schema, payloads, validation=None, transaction=False,
+    compression=None, compression_threshold=None, routing=None, **kwargs
+):
+    """Send many Thunderstorm messaging events with the same event name
+
+    Sends one task per payload, as send_ts_task would, with less overhead
+    per task: all payloads are dumped and validated in a single
+    ``many=True`` pass and all tasks are published over one producer
+    acquired from Celery's producer pool. If any payload fails validation
+    no task is sent.
+
+    With ``transaction=True`` the tasks are published on a dedicated
+    channel inside one AMQP transaction, so the broker receives either all
+    of them or none. This requires an AMQP broker.
 
-    # TODO: @will-norris backwards compat - remove
-    if MARSHMALLOW_2:
-        data = schema.dump(data).data
+    Example:
+        send_ts_tasks(
+            'domain.action.request', DomainActionRequestSchema(),
+            [payload_1, payload_2]
+        )
 
-        data, errors = schema.load(data)
-        if errors:
-            statsd.incr('tasks.{}.send_ts_task.errors.schema'.format(task_name))
-            error_msg = 'Outbound schema validation error for event {}'.format(event_name)  # noqa
-            logger.error(error_msg, extra={'errors': errors, 'data': data})
+    Args:
+        event_name (str): The event name (this is also the routing key)
+        schema (marshmallow.Schema): The schema instance each payload must
+                                     comply to, it must not be many=True
+        payloads (list): The event data of each task to be emitted
+        validation (str): Validation policy overriding the configured one,
+                          see send_ts_task
+        transaction (bool): Publish all tasks in one AMQP transaction
+        compression (str): Compression codec overriding the configured one,
+                           see send_ts_task
+        compression_threshold (int): Minimum size in bytes to compress
+        routing (thunderstorm.routing.RoutingPolicy): Routing policy overriding
+                                                       the configured one, applied
+                                                       to each payload
 
-            raise SchemaError(error_msg, errors=errors, data=data)
-        else:
-            logger.info('send_ts_task on {}'.format(event_name))
-            event = {
-                'data': data
-            }
-            return current_app.send_task(
-                task_name,
-                (event,),
-                exchange='ts.messaging',
-                routing_key=event_name,
-                **kwargs
-            )
+    Raises:
+        SchemaError If schema validation fails.
+        ValueError If the schema is many=True, or the validation policy or
+                   compression codec is unknown.
+
+    Returns:
+        list: The results of the send_task calls.
+    """
+    if {'name', 'args', 'exchange', 'routing_key', 'producer', 'connection'} & set(kwargs.keys()):
+        raise ValueError('Cannot override name, args, exchange, routing_key, producer or connection')
+    if schema.many:
+        raise ValueError('send_ts_tasks expects the schema of a single payload')
+    handle = registry.register(event_name, schema, TRANSPORT_CELERY)
+    task_name = handle.task_name
+    app = current_app._get_current_object()
+    options = _send_options(app)
+    validation = validation or options.validation
+    codec, threshold = _compression(compression, compression_threshold, options)
+    stat_prefix = stat_name('tasks.{}.send_ts_tasks', task_name)
+    timings = []
+
+    payloads = _dump_and_validate(
+        event_name, _many_schema(schema), payloads, validation, options, stat_prefix, timings
+    )
+
+    routes = [_route(event_name, data, routing, app, options) for data in payloads]
+
+    logger.info('send_ts_tasks on {} with {} tasks'.format(event_name, len(payloads)))
+    started = time.perf_counter()
+    events = [_envelope(data, codec, threshold) for data in payloads]
+    if codec:
+        timings.append(('compress', time.perf_counter() - started))
+
+    started = time.perf_counter()
+    if transaction:
+        results = _send_tasks_in_transaction(app, task_name, routes, events, kwargs)
     else:
-        try:
-            data = schema.dump(data)
-        except ValidationError as vex:
-            error_msg = 'Error serializing queue message data'
-            raise SchemaError(error_msg, errors=vex.messages, data=data)
+        with app.producer_or_acquire() as producer:
+            results = _send_tasks(app, producer, task_name, routes, events, kwargs)
+    timings.append(('publish', time.perf_counter() - started))
 
+    handle.sent += len(results)
+
+    _report_timings(stat_prefix, timings, options.timing_rate)
+    statsd.incr(stat_name('{}.sent', stat_prefix), len(results))
+
+    return results
+
+
+def _send_tasks(app, producer, task_name, routes, events, options):
+    return [
+        app.send_task(
+            task_name,
+            (event,),
+            exchange='ts.messaging',
+            producer=producer,
+            **dict(route, **options)
+        )
+        for route, event in zip(routes, events)
+    ]
+
+
+def _send_tasks_in_transaction(app, task_name, routes, events, options):
+    # a channel can't leave transaction mode, so a dedicated channel is used
+    # instead of one from the producer pool
+    with app.connection_for_write() as connection:
+        channel = connection.channel()
         try:
-            schema.load(data)
-        except ValidationError as vex:
-            statsd.incr('tasks.{}.send_ts_task.errors.schema'.format(task_name))
-            error_msg = 'Outbound schema validation error for event {}'.format(event_name)  # noqa
-            logger.error(error_msg, extra={'errors': vex.messages, 'data': data})
+            if not hasattr(channel, 'tx_select'):
+                raise ValueError('Broker transport does not support AMQP transactions')
+
+            channel.tx_select()
+            producer = app.amqp.Producer(channel, auto_declare=False)
+            try:
+                results = _send_tasks(app, producer, task_name, routes, events, options)
+            except Exception:
+                channel.tx_rollback()
+                raise
+            channel.tx_commit()
+        finally:
+            channel.close()
+
+    return results
+
+
+def _load_many(schema, items):
+    """Deserialize a list of payloads with a many=True schema
+
+    Returns:
+        tuple: (deserialized items, errors keyed by item index)
+    """
+    # TODO: @will-norris backwards compat - remove
+    if MARSHMALLOW_2:
+        return schema.load(items)
+
+    try:
+        return schema.load(items), {}
+    except ValidationError as vex:
+        return vex.valid_data, vex.messages
+
 
-            raise SchemaError(error_msg, errors=vex.messages, data=data)
+def _store_results(requests, results=None, exc=None):
+    """Store the outcome of each batched request if a result backend is used"""
+    backend = current_app.backend
+    if isinstance(backend, DisabledBackend):
+        return
+
+    for index, request in enumerate(requests):
+        if not request.id:
+            continue
+        if exc is not None:
+            backend.mark_as_failure(request.id, exc)
         else:
-            logger.info('send_ts_task on {}'.format(event_name))
-            event = {
-                'data': data
-            }
-            return current_app.send_task(
-                task_name,
-                (event,),
-                exchange='ts.messaging',
-                routing_key=event_name,
-                **kwargs
-            )
+            backend.mark_as_done(request.id, results[index] if results else None)
+
+
+def _ts_batch_task(event_name, schema, bind, batch_size, batch_interval, **options):
+    if Batches is None:
+        raise ImportError('ts_task batch mode requires `pip install thunderstorm-library[batches]`')
+    if schema.many:
+        raise ValueError('ts_task batch mode expects the schema of a single message')
+
+    if batch_size is not None:
+        options['flush_every'] = batch_size
+    if batch_interval is not None:
+        options['flush_interval'] = batch_interval
+
+    def decorator(task_func):
+        handle = registry.register(event_name, schema, TRANSPORT_CELERY)
+        task_name = handle.task_name
+
+        def batch_task_handler(*args):
+            """
+            args are the list of buffered requests, preceded by self for a bound task
+            """
+            if len(args) == 1:
+                return _batch_task_handler(requests=args[0])
+            elif len(args) == 2:
+                return _batch_task_handler(self=args[0], requests=args[1])
+            else:
+                raise NotImplementedError('Maximum 2 parameters allowed for ts_task decorator')
+
+        def _batch_task_handler(self=None, requests=()):
+            handle.received += len(requests)
+            # a message which cannot be unwrapped, e.g. a corrupt compressed
+            # payload, fails on its own and the rest of the batch is delivered
+            unwrapped_requests, ts_messages = [], []
+            for request in requests:
+                message = dict(request.args[0])
+                try:
+                    ts_messages.append(TSMessage(_unwrap(message, event_name), message))
+                except SchemaError as schema_error:
+                    handle.errors += 1
+                    statsd.incr(stat_name('tasks.{}.ts_task.errors.schema', task_name))
+                    logger.error(schema_error.args[0], extra=schema_error.log_extra())
+                    _store_results([request], exc=schema_error)
+                else:
+                    unwrapped_requests.append(request)
+
+            loaded, errors = _load_many(_many_schema(schema), [m.data for m in ts_messages])
+            if errors and not all(isinstance(index, int) for index in errors):
+                # the batch as a whole was rejected, every message failed
+                errors = {index: errors for index in range(len(ts_messages))}
+
+            handle.errors += len(errors)
+            valid_requests, valid_messages = [], []
+            for index, (request, ts_message) in enumerate(zip(unwrapped_requests, ts_messages)):
+                if index in errors:
+                    statsd.incr(stat_name('tasks.{}.ts_task.errors.schema', task_name))
+                    error_msg = 'inbound schema validation error for event {}'.format(event_name)
+                    schema_error = SchemaError(error_msg, errors=errors[index], data=ts_message)
+                    logger.error(error_msg, extra=schema_error.log_extra())
+                    _store_results([request], exc=schema_error)
+                else:
+                    ts_message.data = loaded[index]
+                    valid_requests.append(request)
+                    valid_messages.append(ts_message)
+
+            if not valid_messages:
+                return None
+
+            logger.info('received {} ts_tasks on {}'.format(len(valid_messages), event_name))
+            try:
+                result = task_func(self, valid_messages) if bind else task_func(valid_messages)
+            except Exception as ex:
+                statsd.incr(stat_name('tasks.{}.ts_task.errors.execution', task_name), len(valid_messages))
+                _store_results(valid_requests, exc=ex)
+                raise
+
+            # a list with one result per message is stored per message
+            per_message = isinstance(result, list) and len(result) == len(valid_requests)
+            _store_results(valid_requests, results=result if per_message else None)
+
+            return result
+
+        return shared_task(base=Batches, bind=bind, name=task_name, **options)(batch_task_handler)
+
+    return decorator
@@ -0,0 +1,265 @@
+"""In-process metrics with an OpenMetrics scrape endpoint
+
+Usage:
+    >>> from thunderstorm.metrics import MetricsRegistry, MetricsClient, start_http_server
+    >>>
+    >>> registry = MetricsRegistry()
+    >>> client = MetricsClient(registry, prefix='my_service')
+    >>> client.incr('stream.foo.messages.sent')
+    >>> server = start_http_server(registry, port=9102)
+"""
+import bisect
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+__all__ = [
+    'Counter', 'Gauge', 'Histogram', 'MetricsRegistry', 'MetricsClient',
+    'start_http_server', 'DEFAULT_BUCKETS', 'CONTENT_TYPE'
+]
+
+CONTENT_TYPE = 'application/openmetrics-text; version=0.0.1; charset=utf-8'
+
+# latency buckets in seconds, fixed so each histogram has a bounded size
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+RE_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_:]')
+
+
+def metric_name(name, prefix=''):
+    """Return a valid OpenMetrics name for a statsd style dotted name
+
+    >>> metric_name('topic.pos-week.messages_received', 'x.faust')
+    'x_faust_topic_pos_week_messages_received'
+    """
+    if prefix:
+        name = '{}_{}'.format(prefix, name)
+    name = RE_INVALID_NAME_CHARS.sub('_', name)
+    if name[:1].isdigit():
+        name = '_' + name
+    return name
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+class Counter(object):
+    """Monotonic counter"""
+    type = 'counter'
+
+    def __init__(self, name, documentation=''):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented')
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield '{}_total'.format(self.name), self.value
+
+
+class Gauge(object):
+    """Value that can go up and down"""
+    type = 'gauge'
+
+    def __init__(self, name, documentation=''):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Histogram(object):
+    """Histogram with a fixed bucket layout
+
+    Only one count per bucket plus the sum and count are kept, so memory use
+    does not grow with the number of observations.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation='', buckets=DEFAULT_BUCKETS):
+        buckets = sorted(float(b) for b in buckets)
+        if not buckets:
+            raise ValueError('Histogram needs at least one bucket')
+        if buckets[-1] != float('inf'):
+            buckets.append(float('inf'))
+
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield '{}_bucket{{le="{}"}}'.format(self.name, _format_value(bound)), cumulative
+        yield '{}_sum'.format(self.name), total
+        yield '{}_count'.format(self.name), count
+
+
+class MetricsRegistry(object):
+    """Collection of metrics rendered together on scrape"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, **kwargs)
+        if not isinstance(metric, cls):
+            raise ValueError('Metric {} already registered as a {}'.format(name, metric.type))
+        return metric
+
+    def counter(self, name, documentation=''):
+        return self._get_or_create(Counter, name, documentation=documentation)
+
+    def gauge(self, name, documentation=''):
+        return self._get_or_create(Gauge, name, documentation=documentation)
+
+    def histogram(self, name, documentation='', buckets=None):
+        return self._get_or_create(
+            Histogram, name, documentation=documentation, buckets=buckets or self.buckets
+        )
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Return all metrics in the OpenMetrics text format"""
+        lines = []
+        for name, metric in sorted(self._metrics.copy().items()):
+            if metric.documentation:
+                lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            for sample_name, value in metric.samples():
+                lines.append('{} {}'.format(sample_name, _format_value(value)))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsClient(object):
+    """statsd.StatsClient compatible client recording into a MetricsRegistry
+
+    Anything written against the statsd client (``incr``, ``decr``,
+    ``gauge`` and ``timing``) can record in process instead. Stats that are
+    incremented are exposed as counters unless listed in ``gauge_stats``,
+    which is required for stats that are also decremented. Timings are
+    given in milliseconds, as with statsd, and observed in seconds.
+    """
+
+    def __init__(self, registry, prefix='', gauge_stats=()):
+        self.registry = registry
+        self.prefix = prefix
+        self.gauge_stats = frozenset(gauge_stats)
+        self._names = {}
+
+    def _name(self, stat):
+        name = self._names.get(stat)
+        if name is None:
+            name = self._names[stat] = metric_name(stat, self.prefix)
+        return name
+
+    def incr(self, stat, count=1, rate=1):
+        # recording in process is exact, there is no need to scale by rate
+        if stat in self.gauge_stats:
+            self.registry.gauge(self._name(stat)).inc(count)
+        else:
+            self.registry.counter(self._name(stat)).inc(count)
+
+    def decr(self, stat, count=1, rate=1):
+        self.registry.gauge(self._name(stat)).dec(count)
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        gauge = self.registry.gauge(self._name(stat))
+        if delta:
+            gauge.inc(value)
+        else:
+            gauge.set(value)
+
+    def timing(self, stat, delta, rate=1):
+        self.registry.histogram('{}_seconds'.format(self._name(stat))).observe(delta / 1000.0)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _metrics_handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes are frequent, do not write them to stderr
+            pass
+
+    return MetricsHandler
+
+
+def start_http_server(registry, host='127.0.0.1', port=9102):
+    """Serve the registry on a background thread
+
+    Args:
+        registry (MetricsRegistry): metrics to expose
+        host (str): interface to bind to
+        port (int): port to bind to, 0 picks a free port
+
+    Returns:
+        HTTPServer: call ``shutdown()`` and ``server_close()`` to stop it
+    """
+    server = _ThreadingHTTPServer((host, port), _metrics_handler(registry))
+    thread = threading.Thread(target=server.serve_forever, name='ts-metrics-server', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,168 @@
+"""Registry of the Thunderstorm messaging events of a service
+
+Every event sent or received with ts_task, send_ts_task, ts_event or
+send_ts_event is registered once, under its name and transport, with the
+handles needed to send and receive it: the schema instance, its
+validator and the task name. Sends and receives look the handle up
+instead of deriving them on each call, and count their messages on it.
+
+Usage:
+    >>> from thunderstorm.registry import registry
+    >>>
+    >>> print(registry.report())
+"""
+import threading
+import time
+
+from marshmallow.exceptions import ValidationError
+
+from thunderstorm.shared import ts_task_name
+
+import marshmallow  # TODO: @will-norris backwards compat - remove
+MARSHMALLOW_2 = int(marshmallow.__version__[0]) < 3
+
+__all__ = ['EventHandle', 'EventRegistry', 'registry', 'TRANSPORT_CELERY', 'TRANSPORT_KAFKA']
+
+TRANSPORT_CELERY = 'celery'
+TRANSPORT_KAFKA = 'kafka'
+
+
+def _validator(schema):
+    """Return a function loading data with the schema
+
+    The function returns a tuple of the deserialized data and the errors,
+    or None, whichever the marshmallow version.
+    """
+    # TODO: @will-norris backwards compat - remove
+    if MARSHMALLOW_2:
+        return schema.load
+
+    def validate(data):
+        try:
+            return schema.load(data), None
+        except ValidationError as vex:
+            return None, vex.messages
+
+    return validate
+
+
+class EventHandle(object):
+    """Everything needed to send and receive one event on one transport
+
+    The counters are for reporting, they are incremented without a lock.
+    """
+    __slots__ = (
+        'name', 'transport', 'schema', 'schema_class', 'task_name', 'validate',
+        'sent', 'received', 'errors', 'registered_at'
+    )
+
+    def __init__(self, name, transport, schema):
+        self.name = name
+        self.transport = transport
+        self.task_name = ts_task_name(name)
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.registered_at = time.monotonic()
+        self.set_schema(schema)
+
+    def set_schema(self, schema):
+        # kafka events are declared with a schema class, celery ones with an instance
+        if isinstance(schema, type):
+            self.schema_class, self.schema = schema, schema()
+        else:
+            self.schema_class, self.schema = schema.__class__, schema
+        self.validate = _validator(self.schema)
+
+    def uses(self, schema):
+        """Return True if schema is the handle's schema class or an instance of it
+
+        Senders usually pass a new instance on every call, which matches
+        without replacing the handle's schema.
+        """
+        return schema is self.schema_class or schema.__class__ is self.schema_class
+
+    def validator(self, schema):
+        """Return the function loading data with schema
+
+        Instances of the handle's schema class share the handle but may be
+        created with other options, e.g. unknown or partial, so any other
+        instance than the handle's gets a validator of its own.
+        """
+        if schema is self.schema or schema is self.schema_class:
+            return self.validate
+        return _validator(schema)
+
+    def throughput(self, now=None):
+        """Return the messages sent and received per second since registration"""
+        elapsed = (now or time.monotonic()) - self.registered_at
+        if elapsed <= 0:
+            return 0.0
+        return (self.sent + self.received) / elapsed
+
+
+class EventRegistry(object):
+    """Event handles by transport and event name"""
+
+    def __init__(self):
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, schema, transport):
+        """Return the handle of an event, registering it on first use
+
+        Registering an event again with the same schema class, or another
+        instance of it, returns the handle as it is, receivers validate with
+        their own instance, see EventHandle.validator. Registering it with
+        another schema class replaces the schema of its handle and keeps its
+        counters.
+
+        Args:
+            name (str): The event name, or topic for kafka events
+            schema (marshmallow.Schema): The schema instance or class
+            transport (str): TRANSPORT_CELERY or TRANSPORT_KAFKA
+
+        Returns:
+            EventHandle
+        """
+        key = (transport, name)
+        handle = self._handles.get(key)
+        if handle is not None and handle.uses(schema):
+            return handle
+
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = self._handles[key] = EventHandle(name, transport, schema)
+            elif not handle.uses(schema):
+                handle.set_schema(schema)
+        return handle
+
+    def get(self, name, transport):
+        return self._handles.get((transport, name))
+
+    def __iter__(self):
+        return iter(sorted(self._handles.values(), key=lambda h: (h.name, h.transport)))
+
+    def __len__(self):
+        return len(self._handles)
+
+    def clear(self):
+        with self._lock:
+            self._handles.clear()
+
+    def report(self):
+        """Return a table of the registered events and their counters"""
+        now = time.monotonic()
+        row = '{:<40} {:<9} {:<40} {:<24} {:>10} {:>10} {:>8} {:>10}'
+        lines = [row.format('event', 'transport', 'task', 'schema', 'sent', 'received', 'errors', 'msgs/s')]
+        for handle in self:
+            lines.append(row.format(
+                handle.name, handle.transport, handle.task_name, handle.schema_class.__name__,
+                handle.sent, handle.received, handle.errors, '{:.1f}'.format(handle.throughput(now))
+            ))
+        return '\n'.join(lines)
+
+
+# events of this process, registered by the messaging modules
+registry = EventRegistry()
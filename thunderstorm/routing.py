@@ -0,0 +1,149 @@
+"""Routing policies for Thunderstorm messaging tasks
+
+A routing policy decides where send_ts_task publishes a task and which
+queues ts_task workers consume for it. Policies are given per call, per
+event in the ``TS_TASK_ROUTING`` Celery setting or to ts_task.
+
+Usage:
+    >>> from thunderstorm.routing import HashShardRouting
+    >>>
+    >>> routing = HashShardRouting('device_uuid', shards=4)
+    >>> send_ts_task('device.updated', DeviceSchema(), device, routing=routing)
+    >>>
+    >>> @ts_task('device.updated', schema=DeviceSchema(), routing=routing)
+    >>> def handle_device_updated(message):
+    >>>     ...
+"""
+import binascii
+import logging
+import threading
+import time
+
+from kombu import Exchange, Queue
+
+__all__ = [
+    'RoutingPolicy', 'HashShardRouting', 'PriorityRouting', 'OverflowRouting', 'TS_EXCHANGE'
+]
+
+TS_EXCHANGE = Exchange('ts.messaging', type='topic')
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingPolicy(object):
+    """Base routing policy, routes every task with the event name"""
+
+    def route(self, event_name, data, app):
+        """Return the publish options for a task
+
+        Args:
+            event_name (str): The event name
+            data: The dumped payload of the task
+            app (celery.Celery): The app publishing the task
+
+        Returns:
+            dict: options for send_task, any of routing_key and priority
+        """
+        return {}
+
+    def queues(self, event_name):
+        """Return the extra queues ts_task workers must consume for the event
+
+        Returns:
+            list: kombu.Queue instances bound to the ts.messaging exchange
+        """
+        return []
+
+
+def _queue(name, **kwargs):
+    return Queue(name, TS_EXCHANGE, routing_key=name, **kwargs)
+
+
+class HashShardRouting(RoutingPolicy):
+    """Shard an event across queues by hashing a payload key
+
+    Tasks are routed to ``<event_name>.shard.<n>`` where n is the CRC32 of
+    the key's value modulo the number of shards, so all tasks with the same
+    key end up in the same queue and keep their order.
+    """
+
+    def __init__(self, key, shards):
+        if shards < 1:
+            raise ValueError('shards must be at least 1')
+        self.key = key
+        self.shards = shards
+
+    def shard(self, data):
+        value = data.get(self.key) if isinstance(data, dict) else None
+        return binascii.crc32(str(value).encode()) % self.shards
+
+    def shard_name(self, event_name, shard):
+        return '{}.shard.{}'.format(event_name, shard)
+
+    def route(self, event_name, data, app):
+        return {'routing_key': self.shard_name(event_name, self.shard(data))}
+
+    def queues(self, event_name):
+        return [_queue(self.shard_name(event_name, shard)) for shard in range(self.shards)]
+
+
+class PriorityRouting(RoutingPolicy):
+    """Set the message priority per event
+
+    Priorities only have an effect on queues declared with the
+    ``x-max-priority`` argument.
+    """
+
+    def __init__(self, priorities, default=None):
+        self.priorities = dict(priorities)
+        self.default = default
+
+    def route(self, event_name, data, app):
+        priority = self.priorities.get(event_name, self.default)
+        return {} if priority is None else {'priority': priority}
+
+
+class OverflowRouting(RoutingPolicy):
+    """Spill tasks over to an overflow queue when the event queue is too deep
+
+    The depth of the queue is read from the broker at most once per
+    check_interval seconds. While it is at or above the threshold tasks are
+    routed to ``<event_name>.overflow``.
+    """
+
+    def __init__(self, threshold, queue=None, check_interval=5.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.queue = queue
+        self.check_interval = check_interval
+        self.clock = clock
+        self._depths = {}
+        self._lock = threading.Lock()
+
+    def overflow_name(self, event_name):
+        return '{}.overflow'.format(event_name)
+
+    def queue_depth(self, app, queue_name):
+        with app.connection_for_write() as connection:
+            return connection.default_channel.queue_declare(queue=queue_name, passive=True).message_count
+
+    def _depth(self, app, queue_name):
+        now = self.clock()
+        checked_at, depth = self._depths.get(queue_name, (None, 0))
+        if checked_at is None or now - checked_at >= self.check_interval:
+            with self._lock:
+                try:
+                    depth = self.queue_depth(app, queue_name)
+                except Exception as ex:
+                    # keep routing normally if the broker can't tell
+                    logger.warning('Could not read depth of queue {}: {}'.format(queue_name, ex))
+                    depth = 0
+                self._depths[queue_name] = (now, depth)
+        return depth
+
+    def route(self, event_name, data, app):
+        if self._depth(app, self.queue or event_name) >= self.threshold:
+            return {'routing_key': self.overflow_name(event_name)}
+        return {}
+
+    def queues(self, event_name):
+        return [_queue(self.overflow_name(event_name))]
@@ -1,3 +1,99 @@
+import base64
+import bz2
+import collections.abc
+import hashlib
+import json
+import lzma
+import sys
+import zlib
+
+from kombu.utils import json as kombu_json
+
+# compression codecs for message payloads: name -> (compress, decompress)
+COMPRESSION_CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+NameCacheInfo = collections.namedtuple('NameCacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+# name caches by name, see name_cache_info
+NAME_CACHES = {}
+
+
+class NameCache(object):
+    """Bounded cache of names derived from other names
+
+    Message handlers derive the same task, topic and metric names from a
+    small set of event names over and over. The derived names are computed
+    once, interned and returned from a dict afterwards. When maxsize names
+    are cached the oldest one is evicted.
+
+    Every cache is listed by name_cache_info() with its hit, miss and
+    eviction counts.
+    """
+
+    def __init__(self, func, name, maxsize=4096):
+        self.func = func
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._names = {}
+        NAME_CACHES[name] = self
+
+    def __call__(self, key):
+        try:
+            name = self._names[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return name
+
+        self.misses += 1
+        name = sys.intern(self.func(key))
+        if len(self._names) >= self.maxsize:
+            try:
+                self._names.pop(next(iter(self._names)), None)
+            except (StopIteration, RuntimeError):  # emptied or resized by another thread
+                pass
+            else:
+                self.evictions += 1
+        self._names[key] = name
+        return name
+
+    def __len__(self):
+        return len(self._names)
+
+    def info(self):
+        return NameCacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._names))
+
+    def clear(self):
+        self._names.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+def name_cache_info():
+    """Return the NameCacheInfo of every name cache by cache name"""
+    return {name: cache.info() for name, cache in NAME_CACHES.items()}
+
+
+def _task_name(event_name):
+    task_name = event_name
+    for c in '.-':
+        task_name = task_name.replace(c, '_')
+
+    return 'handle_{}'.format(task_name)
+
+
+_TASK_NAMES = NameCache(_task_name, 'task_names')
+_TOPIC_NAMES = NameCache(lambda topic: topic.replace('.', '_'), 'topic_names')
+_STAT_NAMES = NameCache(lambda key: key[0].format(*key[1:]), 'stat_names')
+
+
 def ts_task_name(event_name):
     """Return the task name derived from the event name
 
@@ -10,18 +106,207 @@ def ts_task_name(event_name):
     Returns:
         task_name (str)
     """
-    task_name = event_name
-    for c in '.-':
-        task_name = task_name.replace(c, '_')
+    return _TASK_NAMES(event_name)
 
-    return 'handle_{}'.format(task_name)
+
+def topic_name(topic):
+    """Return the topic name as used in metric names, with dots replaced
+
+    >>> topic_name('pos-week.fetch')
+    'pos-week_fetch'
+    """
+    return _TOPIC_NAMES(topic)
+
+
+def stat_name(template, *parts):
+    """Return the metric name formatted from a template and its parts
+
+    >>> stat_name('stream.{}.messages.sent', 'pos-week_fetch')
+    'stream.pos-week_fetch.messages.sent'
+    """
+    return _STAT_NAMES((template,) + parts)
+
+
+def truncate_payload(value, max_bytes):
+    """Return a copy of value cut down to about max_bytes when rendered
+
+    Mappings, sequences and strings are copied until the budget is spent,
+    the rest is replaced by a marker, so only the part that is kept is
+    visited. The result can be JSON encoded if the leaves of value can.
+
+    Args:
+        value: The payload or errors to truncate
+        max_bytes (int): Budget of the rendered copy, approximated in characters
+
+    Returns:
+        The truncated copy
+    """
+    return _truncate(value, [max_bytes])
+
+
+def _truncate(value, budget):
+    if isinstance(value, (bool, int, float, type(None))):
+        budget[0] -= 8
+        return value
+
+    value = _unwrap_message(value)
+    if isinstance(value, collections.abc.Mapping):
+        truncated = {}
+        for key in value:
+            if budget[0] <= 0:
+                truncated['...'] = '{} more'.format(len(value) - len(truncated))
+                break
+            name = _truncate(key if isinstance(key, str) else str(key), budget)
+            truncated[name] = _truncate(value[key], budget)
+        return truncated
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        truncated = []
+        for item in value:
+            if budget[0] <= 0:
+                truncated.append('... {} more'.format(len(value) - len(truncated)))
+                break
+            truncated.append(_truncate(item, budget))
+        return truncated
+
+    if isinstance(value, (bytes, bytearray)):
+        # only decode the part that is kept
+        value = bytes(value[:max(budget[0], 0) + 1]).decode('utf-8', 'replace')
+    elif not isinstance(value, str):
+        value = str(value)
+
+    if len(value) > budget[0]:
+        value = value[:max(budget[0], 0)] + '...'
+    budget[0] -= len(value) + 2
+    return value
+
+
+def payload_digest(data):
+    """Return the size in bytes and a digest of a payload
+
+    Strings and bytes are hashed as they are, anything else is JSON encoded
+    chunk by chunk, so the encoded payload is never held in memory at once.
+
+    Returns:
+        tuple: (size, hex digest)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(data, str):
+        data = data.encode('utf-8', 'replace')
+    if isinstance(data, (bytes, bytearray)):
+        digest.update(data)
+        return len(data), digest.hexdigest()
+
+    size = 0
+    encoder = json.JSONEncoder(default=str, sort_keys=True)
+    for chunk in encoder.iterencode(_json_compatible(data)):
+        chunk = chunk.encode('utf-8', 'replace')
+        size += len(chunk)
+        digest.update(chunk)
+    return size, digest.hexdigest()
+
+
+def _unwrap_message(value):
+    # messages like TSMessage are mappings over their data, which may be a list
+    if isinstance(value, collections.abc.Mapping) and not isinstance(value, dict):
+        return getattr(value, 'data', value)
+    return value
+
+
+def _json_compatible(data):
+    # the JSON encoder only encodes dict mappings
+    data = _unwrap_message(data)
+    if isinstance(data, collections.abc.Mapping) and not isinstance(data, dict):
+        return dict(data)
+    return data
 
 
 class SchemaError(Exception):
+    """Raised when a message fails schema validation
+
+    The errors and data can be large, for a large malformed message, so
+    they are only rendered when needed and then cut down to max_bytes each,
+    with the size and a digest of the data to tell payloads apart. The
+    rendering is done once per error and shared by str() and log_extra().
+    Set ``SchemaError.max_bytes`` to change the budget.
+    """
+    max_bytes = 2048
+
     def __init__(self, message, *, errors=None, data=None):
         super().__init__(message)
         self.errors = errors
         self.data = data
+        self._summary = None
+
+    def summary(self):
+        """Return the truncated errors and data with the data's size and digest
+
+        Returns:
+            dict: with keys errors, data, size and digest
+        """
+        if self._summary is None:
+            size, digest = payload_digest(self.data) if self.data is not None else (0, None)
+            self._summary = {
+                'errors': truncate_payload(self.errors, self.max_bytes),
+                'data': truncate_payload(self.data, self.max_bytes),
+                'size': size,
+                'digest': digest,
+            }
+        return self._summary
+
+    def log_extra(self):
+        """Return the logging extra describing the error
+
+        Returns:
+            dict: errors and data keys for the logger's extra argument
+        """
+        summary = self.summary()
+        return {
+            'errors': summary['errors'],
+            'data': {'payload': summary['data'], 'size': summary['size'], 'digest': summary['digest']},
+        }
 
     def __str__(self):
-        return '{}: {} with {}'.format(super().__str__(), self.errors, self.data)
+        summary = self.summary()
+        message = '{}: {} with {}'.format(super().__str__(), summary['errors'], summary['data'])
+        if summary['digest']:
+            message += ' ({} bytes, digest {})'.format(summary['size'], summary['digest'])
+        return message
+
+
+def compress_payload(raw, codec='zlib'):
+    """Compress a serialized payload into a base64 string
+
+    Args:
+        raw (bytes): JSON encoded message data
+        codec (str): One of COMPRESSION_CODECS
+
+    Returns:
+        str: base64 encoded compressed data
+    """
+    try:
+        compress, _ = COMPRESSION_CODECS[codec]
+    except KeyError:
+        raise ValueError('Unknown compression codec {}, expected one of {}'.format(
+            codec, ', '.join(sorted(COMPRESSION_CODECS))
+        ))
+    return base64.b64encode(compress(raw)).decode()
+
+
+def decompress_payload(data, codec='zlib'):
+    """Return the message data compressed by compress_payload
+
+    Args:
+        data (str): base64 encoded compressed JSON
+        codec (str or bool): One of COMPRESSION_CODECS, True means zlib
+
+    Returns:
+        The decompressed message data
+    """
+    if codec is True:
+        codec = 'zlib'
+    try:
+        _, decompress = COMPRESSION_CODECS[codec]
+    except KeyError:
+        raise ValueError('Unknown compression codec {}'.format(codec))
+    return kombu_json.loads(decompress(base64.b64decode(data.encode())))
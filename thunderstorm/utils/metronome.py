@@ -1,18 +1,160 @@
+import argparse
+import asyncio
+import math
+import os
+import struct
+import tempfile
 import time
 import binascii
+import statistics
+import sys
+import uuid as uuid_module
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def _crc32_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xEDB88320 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+# CRC-32 lookup table, as used by binascii.crc32, for the vectorized crc32_many
+_CRC32_TABLE = _crc32_table()
+
+
+def _id_bytes(entity_id):
+    if isinstance(entity_id, uuid_module.UUID):
+        return entity_id.bytes
+    if isinstance(entity_id, (bytes, bytearray, memoryview)) and len(entity_id) == 16:
+        return bytes(entity_id)
+    raise ValueError('Expected a UUID or its 16 bytes, got {!r}'.format(entity_id))
+
+
+def _as_uuid(entity_id):
+    if isinstance(entity_id, uuid_module.UUID):
+        return entity_id
+    return uuid_module.UUID(bytes=_id_bytes(entity_id))
+
+
+def _id_matrix(uuids):
+    """Return the ids as an (n, 16) uint8 NumPy array"""
+    if isinstance(uuids, numpy.ndarray):
+        if uuids.dtype == numpy.uint8 and uuids.ndim == 2 and uuids.shape[1] == 16:
+            return uuids
+        if uuids.dtype.kind in 'SV' and uuids.dtype.itemsize == 16:
+            return numpy.frombuffer(uuids.tobytes(), dtype=numpy.uint8).reshape(-1, 16)
+    raw = b''.join(_id_bytes(entity_id) for entity_id in uuids)
+    return numpy.frombuffer(raw, dtype=numpy.uint8).reshape(-1, 16)
+
+
+def crc32_many(uuids):
+    """Return the CRC-32 of the bytes of each UUID
+
+    Args:
+        uuids: sequence of uuid.UUID or 16 byte buffers, or a NumPy array of
+               16 byte strings or of shape (n, 16) and dtype uint8
+
+    Returns:
+        numpy.ndarray of uint32 if NumPy is installed, a list of int otherwise
+    """
+    if numpy is None:
+        return [binascii.crc32(_id_bytes(entity_id)) for entity_id in uuids]
+
+    ids = _id_matrix(uuids)
+    table = numpy.array(_CRC32_TABLE, dtype=numpy.uint32)
+    # table driven CRC-32 computed a byte column at a time for all ids
+    crc = numpy.full(len(ids), 0xFFFFFFFF, dtype=numpy.uint32)
+    for column in range(16):
+        crc = table[(crc ^ ids[:, column]) & 0xFF] ^ (crc >> 8)
+    return crc ^ numpy.uint32(0xFFFFFFFF)
 
 
 class Metronome(object):
     """
+    By default now_remainder is fixed when the metronome is created. Given a
+    clock it follows the clock instead, the current slot is cached until its
+    end, and ticks() / aticks() yield each new slot as it begins:
+
+        metronome = Metronome(5, 4, clock=time.time)
+        async for remainder in metronome.aticks():
+            schedule(index.due())
     """
 
-    def __init__(self, tick_time, beat_times_every_day):
+    def __init__(self, tick_time, beat_times_every_day, clock=None):
         """
         tick_time: int (minutes) trigger every n minutes
         beat_times_every_day: int  the func should run n times every day
+        clock: callable returning the time in seconds, like time.time
         """
-        self.fetch_times_factor = int(24 * 60 * 60 / beat_times_every_day / (tick_time * 60))
-        self.now_remainder = int(time.time() / (tick_time * 60)) % self.fetch_times_factor
+        self.tick_seconds = tick_time * 60
+        self.fetch_times_factor = int(24 * 60 * 60 / beat_times_every_day / self.tick_seconds)
+        self.clock = clock
+        self._set_slot((clock or time.time)())
+
+    def _set_slot(self, now):
+        self._slot = int(now / self.tick_seconds)
+        self._slot_start = self._slot * self.tick_seconds
+        self._slot_end = self._slot_start + self.tick_seconds
+        self._now_remainder = self._slot % self.fetch_times_factor
+
+    def _refresh(self):
+        now = self.clock()
+        if not self._slot_start <= now < self._slot_end:
+            self._set_slot(now)
+        return now
+
+    @property
+    def now_remainder(self):
+        if self.clock is not None:
+            self._refresh()
+        return self._now_remainder
+
+    @now_remainder.setter
+    def now_remainder(self, value):
+        # a live metronome overwrites it on the next slot
+        self._now_remainder = value
+
+    def seconds_to_next_tick(self):
+        if self.clock is None:
+            raise ValueError('Metronome needs a clock to tick')
+        return self._slot_end - self._refresh()
+
+    def ticks(self, sleep=time.sleep):
+        """
+        Yield now_remainder for the current slot, then for every new slot as
+        it begins, sleeping in between
+        sleep: callable sleeping for the given seconds
+        """
+        slot = None
+        while True:
+            wait = self.seconds_to_next_tick()
+            if self._slot != slot:
+                slot = self._slot
+                yield self._now_remainder
+                # the consumer may have run past the next tick
+                continue
+            sleep(wait)
+
+    async def aticks(self, sleep=asyncio.sleep):
+        """
+        Async ticks(), sleep is a coroutine function like asyncio.sleep
+        """
+        slot = None
+        while True:
+            wait = self.seconds_to_next_tick()
+            if self._slot != slot:
+                slot = self._slot
+                yield self._now_remainder
+                continue
+            await sleep(wait)
 
     def beat_it(self, uuid):
         crc = binascii.crc32(uuid.bytes)
@@ -20,3 +162,291 @@ class Metronome(object):
         if self.now_remainder == obj_remainder:
             return True
         return False
+
+    def remainders(self, uuids):
+        """
+        Return the remainder of each UUID, which beat_many compares to now_remainder
+        remainders only depend on the UUIDs and fetch_times_factor, they can be
+        computed once and given to beat_many on every tick
+        """
+        crcs = crc32_many(uuids)
+        if numpy is None:
+            return [crc % self.fetch_times_factor for crc in crcs]
+        return crcs % self.fetch_times_factor
+
+    def beat_many(self, uuids, mask=False, remainders=None):
+        """
+        Bulk beat_it
+        uuids: sequence of uuid.UUID or 16 byte buffers, or a NumPy array of them
+        mask: bool  return a boolean mask instead of the due UUIDs
+        remainders: the cached result of remainders(uuids)
+        returns the UUIDs due this tick, a NumPy array if uuids is one, or the mask
+        """
+        if remainders is None:
+            remainders = self.remainders(uuids)
+
+        if numpy is None:
+            due = [remainder == self.now_remainder for remainder in remainders]
+            if mask:
+                return due
+            return [entity_id for entity_id, is_due in zip(uuids, due) if is_due]
+
+        due = numpy.asarray(remainders) == self.now_remainder
+        if mask:
+            return due
+        if isinstance(uuids, numpy.ndarray):
+            return uuids[due]
+        return [uuids[index] for index in numpy.flatnonzero(due)]
+
+
+class MetronomeIndex(object):
+    """
+    Entity UUIDs bucketed by remainder, so finding the entities due on a tick
+    only reads their bucket instead of calling beat_it on every entity
+
+    With a tolerance entities are assigned with bounded-load hashing: an
+    entity goes to the slot of its remainder unless that slot already holds
+    (1 + tolerance) times the average load, then to the next slot with room.
+    No slot exceeds the average by more than the tolerance (rounded up to a
+    whole entity) when entities are added, at the cost of keeping each
+    entity's slot and of beat_it no longer matching due() for moved entities.
+    rebalance() restores the bound after many removals.
+    """
+    # file format: magic, fetch_times_factor, then per bucket its size and the ids' bytes
+    MAGIC = b'TSMI\x01'
+    HEADER = struct.Struct('>5sI')
+    BUCKET_SIZE = struct.Struct('>I')
+
+    def __init__(self, metronome, uuids=(), tolerance=None):
+        """
+        metronome: Metronome  the metronome whose now_remainder picks the due bucket
+        uuids: initial entity UUIDs or their 16 byte buffers
+        tolerance: float  allowed load above the average slot load, 0.05 is 5%
+        """
+        if tolerance is not None and tolerance < 0:
+            raise ValueError('tolerance must not be negative')
+        self.metronome = metronome
+        self.tolerance = tolerance
+        self._buckets = [set() for _ in range(metronome.fetch_times_factor)]
+        self._slots = {} if tolerance is not None else None
+        self._size = 0
+        self.update(uuids)
+
+    def _remainder(self, uuid):
+        return binascii.crc32(uuid.bytes) % self.metronome.fetch_times_factor
+
+    def slot(self, uuid):
+        """returns the slot of an indexed UUID, None if it is not indexed"""
+        uuid = _as_uuid(uuid)
+        if self._slots is not None:
+            return self._slots.get(uuid)
+        remainder = self._remainder(uuid)
+        return remainder if uuid in self._buckets[remainder] else None
+
+    def capacity(self, size=None):
+        """returns the most entities a slot takes in balanced mode, for size entities"""
+        size = self._size if size is None else size
+        return max(1, math.ceil((1 + self.tolerance) * size / len(self._buckets)))
+
+    def _place(self, uuid, remainder, capacity):
+        if self._slots is None:
+            bucket = self._buckets[remainder]
+            if uuid not in bucket:
+                bucket.add(uuid)
+                self._size += 1
+            return
+
+        if uuid in self._slots:
+            return
+        slot = remainder
+        while len(self._buckets[slot]) >= capacity:
+            slot = (slot + 1) % len(self._buckets)
+        self._buckets[slot].add(uuid)
+        self._slots[uuid] = slot
+        self._size += 1
+
+    def add(self, uuid):
+        uuid = _as_uuid(uuid)
+        capacity = self.capacity(self._size + 1) if self._slots is not None else None
+        self._place(uuid, self._remainder(uuid), capacity)
+
+    def update(self, uuids):
+        uuids = [_as_uuid(entity_id) for entity_id in uuids]
+        if not uuids:
+            return
+        capacity = self.capacity(self._size + len(uuids)) if self._slots is not None else None
+        for uuid, remainder in zip(uuids, self.metronome.remainders(uuids)):
+            self._place(uuid, remainder, capacity)
+
+    def remove(self, uuid):
+        """raises KeyError if the UUID is not indexed"""
+        uuid = _as_uuid(uuid)
+        slot = self.slot(uuid)
+        if slot is None:
+            raise KeyError(uuid)
+        self._buckets[slot].remove(uuid)
+        if self._slots is not None:
+            del self._slots[uuid]
+        self._size -= 1
+
+    def discard(self, uuid):
+        try:
+            self.remove(uuid)
+        except KeyError:
+            pass
+
+    def rebalance(self):
+        """reassigns every entity, in balanced mode"""
+        uuids = list(self)
+        for bucket in self._buckets:
+            bucket.clear()
+        if self._slots is not None:
+            self._slots.clear()
+        self._size = 0
+        self.update(uuids)
+
+    def bucket(self, remainder):
+        return frozenset(self._buckets[remainder])
+
+    def due(self):
+        """returns the UUIDs due on the metronome's current tick"""
+        return self.bucket(self.metronome.now_remainder)
+
+    def histogram(self):
+        """returns the number of entities in each slot"""
+        return [len(bucket) for bucket in self._buckets]
+
+    def __contains__(self, uuid):
+        return self.slot(uuid) is not None
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from bucket
+
+    def save(self, path):
+        """
+        Write the index to a file, replacing it atomically
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metronome-index-')
+        try:
+            with os.fdopen(fd, 'wb') as index_file:
+                index_file.write(self.HEADER.pack(self.MAGIC, len(self._buckets)))
+                for bucket in self._buckets:
+                    index_file.write(self.BUCKET_SIZE.pack(len(bucket)))
+                    index_file.write(b''.join(uuid.bytes for uuid in bucket))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, metronome, tolerance=None):
+        """
+        Read an index written by save
+        ids are only rehashed if the file was written for another fetch_times_factor
+        raises ValueError if the file is not a metronome index
+        """
+        with open(path, 'rb') as index_file:
+            header = index_file.read(cls.HEADER.size)
+            if len(header) != cls.HEADER.size or not header.startswith(cls.MAGIC):
+                raise ValueError('{} is not a metronome index'.format(path))
+            _, factor = cls.HEADER.unpack(header)
+
+            buckets = []
+            for _ in range(factor):
+                raw = index_file.read(cls.BUCKET_SIZE.size)
+                if len(raw) != cls.BUCKET_SIZE.size:
+                    raise ValueError('{} is truncated'.format(path))
+                size, = cls.BUCKET_SIZE.unpack(raw)
+                raw = index_file.read(16 * size)
+                if len(raw) != 16 * size:
+                    raise ValueError('{} is truncated'.format(path))
+                buckets.append({uuid_module.UUID(bytes=raw[i:i + 16]) for i in range(0, len(raw), 16)})
+
+        index = cls(metronome, tolerance=tolerance)
+        if factor == metronome.fetch_times_factor:
+            # keep the saved assignment, which may be balanced
+            index._buckets = buckets
+            index._size = sum(len(bucket) for bucket in buckets)
+            if index._slots is not None:
+                index._slots = {uuid: slot for slot, bucket in enumerate(buckets) for uuid in bucket}
+        else:
+            index.update(uuid for bucket in buckets for uuid in bucket)
+        return index
+
+
+def slot_histogram(metronome, uuids, tolerance=None):
+    """
+    returns the number of entities assigned to each slot
+    tolerance: float  use the balanced assignment of MetronomeIndex
+    """
+    if tolerance is not None:
+        return MetronomeIndex(metronome, uuids, tolerance=tolerance).histogram()
+
+    counts = [0] * metronome.fetch_times_factor
+    for remainder in metronome.remainders(uuids):
+        counts[remainder] += 1
+    return counts
+
+
+def skew_report(counts):
+    """
+    returns the load statistics of a slot histogram
+    skew is how far the busiest slot is above the average, 0.1 is 10%
+    """
+    mean = sum(counts) / len(counts)
+    return {
+        'slots': len(counts),
+        'entities': sum(counts),
+        'min': min(counts),
+        'max': max(counts),
+        'mean': mean,
+        'stdev': statistics.pstdev(counts),
+        'skew': max(counts) / mean - 1 if mean else 0.0,
+    }
+
+
+def format_report(counts, width=50):
+    """returns the skew report and a bar per slot as text"""
+    report = skew_report(counts)
+    lines = [
+        'slots {slots}  entities {entities}  min {min}  max {max}  mean {mean:.1f}  '
+        'stdev {stdev:.1f}  skew {skew:+.1%}'.format(**report)
+    ]
+    scale = width / (report['max'] or 1)
+    for slot, count in enumerate(counts):
+        lines.append('{:>5} {:>9} {}'.format(slot, count, '#' * int(round(count * scale))))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Report the slot histogram of a population, one UUID per line
+
+        python -m thunderstorm.utils.metronome --tick-time 5 --beat-times 4 uuids.txt
+    """
+    parser = argparse.ArgumentParser(description='Report the Metronome slot load of a set of UUIDs')
+    parser.add_argument('file', nargs='?', default='-', help='file with one UUID per line, - for stdin')
+    parser.add_argument('--tick-time', type=int, required=True, help='minutes between ticks')
+    parser.add_argument('--beat-times', type=int, required=True, help='times every entity is due every day')
+    parser.add_argument('--tolerance', type=float, help='report the balanced assignment with this tolerance')
+    args = parser.parse_args(argv)
+
+    if args.file == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.file) as uuids_file:
+            lines = uuids_file.readlines()
+    uuids = [uuid_module.UUID(line.strip()) for line in lines if line.strip()]
+
+    metronome = Metronome(args.tick_time, args.beat_times)
+    print(format_report(slot_histogram(metronome, uuids, tolerance=args.tolerance)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())